@@ -19,12 +19,41 @@ class Io_15_3_1():
         # trajectory 
         self.trajectory = None
         
+        # fit of the trajectory slope, one of pm.trend_fits
+        self.trend_fit = pm.trend_fit
+        
         # matrix, change output format to a plain list. we need it to remap the land cover instead of a matrix.
         self.transition_matrix = pm.default_trans_matrix
         
+        # productivity lookup table indexed by [trajectory][state][performance], see pm.productivity_tables
+        self.productivity_table = pm.productivity_tables['default']
+        
         #Climate regime
         self.conversion_coef =None
         
+        # error bound of the approximate 90th percentile of the productivity performance (None for the exact one)
+        self.percentile_error = pm.percentile_error
+        
+        # export the 4 layers as a single multi-band image (one task, one download)
+        self.single_export = False
+        
+        # backend used to compute the maps ('gee' or 'local')
+        self.backend = 'gee'
+        
+        # local stacks (GeoTIFF or Zarr) used by the local backend, they all need to share the same grid
+        # ndvi: cloud masked ndvi observations (x10000), one band per date (YYYY-MM-DD)
+        # precipitation: precipitation observations, one band per date (YYYY-MM-DD)
+        # land_cover: ESA CCI land cover, one band per year (y1992, y1993, ...)
+        self.local_ndvi = None
+        self.local_precipitation = None
+        self.local_land_cover = None
+        self.local_soc = None
+        self.local_soil_tax = None
+        self.local_climate_zones = None
+        
+        # vector file (shp, geojson, gpkg...) of the aoi used by the local backend for the zonal statistics, one zone per feature
+        self.local_aoi = None
+        
         ######################
         ##      output      ##
         ######################
@@ -34,3 +63,9 @@ class Io_15_3_1():
         self.productivity = None
         self.indicator_15_3_1 = None
         
+        # hash of the parameters used to compute the maps, see scripts.result_cache
+        self.cache_key = None
+        
+        # size of the request of each stage of the gee computation, see scripts.GraphReport
+        self.graph_report = None
+        
@@ -2,4 +2,8 @@ from .directory import *
 from .sensor import *
 from .matrix import *
 from .ui import *
-from .computation import *
\ No newline at end of file
+from .computation import *
+from .drive import *
+from .gee import *
+from .cache import *
+from .batch import *
\ No newline at end of file
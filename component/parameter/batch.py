@@ -0,0 +1,5 @@
+# number of aois computed at the same time by the batch runner (one process each)
+batch_max_workers = 4
+
+# number of aois exporting their maps at the same time (4 GEE tasks each)
+batch_max_exports = 2
@@ -0,0 +1,16 @@
+from .directory import result_dir
+
+# content addressed cache of the results, one folder per set of parameters
+cache_dir = result_dir.joinpath('cache')
+
+# maximum size of the cache, the least recently used results are removed beyond it (bytes)
+cache_max_size = 20 * 1024 * 1024 * 1024
+
+# number of hex characters of the parameter hash used in the file and task names
+cache_key_length = 12
+
+# bump it when the computation changes to invalidate all the cached results
+cache_version = 1
+
+# a run that registered a key more than this time ago (s) is considered dead, its key can be evicted again
+cache_run_timeout = 24 * 3600
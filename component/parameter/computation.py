@@ -1,3 +1,6 @@
+from itertools import product
+import os
+
 import numpy as np
 
 # to use a single parameter for all filters 
@@ -17,4 +20,72 @@ def get_kendall_coef(n, level=95):
         99: [6, 8, 11, 18, 22, 25, 29, 34, 38, 41, 47, 50, 56, 61, 65, 70, 76, 81, 87, 92, 98, 105, 111, 116, 124, 129, 135, 142, 150, 155, 163, 170, 176, 183, 191, 198, 206, 213, 221, 228, 236, 245, 253, 260, 268, 277, 285, 294, 302, 311, 319, 328, 336, 345, 355, 364]
     }
     
-    return coefs[level][n]
\ No newline at end of file
+    return coefs[level][n]
+
+# size of the square windows processed by the local backend
+local_block_size = 512
+
+# number of windows processed in parallel by the local backend
+local_max_workers = os.cpu_count()
+
+
+# one out all out rule of the 15.3.1 indicator
+def one_out_all_out(classes):
+    """ combine the sub-indicators classes (0 nodata - 1 degraded - 2 stable - 3 improved) 
+    
+    The indicator is degraded if any sub-indicator is degraded, improved if any is improved and none degraded, stable otherwise. 
+    It is only set when the 3 sub-indicators are available or when a single one is (0 otherwise)
+    """
+    
+    classes = [c for c in classes if c]
+    
+    if len(classes) not in [1, 3]:
+        return 0
+    elif 1 in classes:
+        return 1
+    elif 3 in classes:
+        return 3
+    else:
+        return 2
+    
+# lookup table of the indicator indexed by productivity*16 + land_cover*4 + soc
+indicator_table = [one_out_all_out(classes) for classes in product(range(4), repeat=3)]
+
+# productivity rules: class of the productivity for each (trajectory, state, performance) combination
+# the combinations that are not listed (i.e. with nodata) are set to 0
+productivity_rules = {
+    'default': {
+        (3, 3, 2): 3, (3, 3, 1): 3, (3, 2, 2): 3, (3, 2, 1): 3, (3, 1, 2): 3, (3, 1, 1): 1, 
+        (2, 3, 2): 2, (2, 3, 1): 2, (2, 2, 2): 2, (2, 2, 1): 1, (2, 1, 2): 1, (2, 1, 1): 1, 
+        (1, 3, 2): 1, (1, 3, 1): 1, (1, 2, 2): 1, (1, 2, 1): 1, (1, 1, 2): 1, (1, 1, 1): 1
+    },
+    'one_out_all_out': {classes: one_out_all_out(classes) for classes in product([1, 2, 3], [1, 2, 3], [1, 2])}
+}
+
+def get_productivity_table(rules):
+    """ create the 3-D lookup table of the productivity indexed by [trajectory][state][performance] from a rules dict"""
+    
+    return [[[rules.get((t, s, p), 0) for p in range(4)] for s in range(4)] for t in range(4)]
+
+productivity_tables = {name: get_productivity_table(rules) for name, rules in productivity_rules.items()}
+
+# range of the ndvi (scaled by 10000) covered by the histograms of the approximate percentiles
+ndvi_range = [-10000, 10000]
+
+# maximum error of the approximate 90th percentile of the productivity performance (ndvi x10000), None to compute the exact one
+# the histogram bins are 2 x percentile_error wide so the memory only depends on the number of ecoregions
+percentile_error = 5
+
+# maximum number of values kept in memory by the exact percentile of the local backend, above it the values are added to a histogram of percentile_error
+exact_percentile_max_values = 50 * 10**6
+
+# tileScale of the grouped percentile reduction, higher values use less memory per tile but are slower
+performance_tile_scale = 4
+
+
+# fit of the slope of the productivity trajectory: 'ols' (least squares) or 'theil_sen' (median of the slopes of all the pairs of years, robust to outliers)
+trend_fits = ['ols', 'theil_sen']
+trend_fit = 'ols'
+
+# number of pixels for which the pairwise slopes of the local theil_sen fit are computed at once (n_years x (n_years - 1) / 2 float32 each)
+theil_sen_chunk = 4096
\ No newline at end of file
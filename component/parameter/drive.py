@@ -0,0 +1,17 @@
+# number of files downloaded in parallel from gdrive
+drive_max_workers = 4
+
+# size of the ranged requests used to download the files from gdrive (bytes)
+drive_chunk_size = 32 * 1024 * 1024
+
+# time during which the listing of the gdrive files is reused (s)
+drive_index_ttl = 300
+
+# number of layers downloaded and merged at the same time
+digest_max_workers = 2
+
+# maximum number of tiles opened at the same time when merging
+merge_max_open = 64
+
+# size of the blocks written in the merged files
+merge_block_size = 512
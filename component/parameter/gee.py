@@ -0,0 +1,15 @@
+# polling interval of the gee tasks (s), it grows by poll_factor while nothing changes
+poll_min = 5
+poll_max = 60
+poll_factor = 1.5
+
+# number of consecutive polls after which a task that is not in the task list is considered FAILED (e.g. failed submission)
+poll_missing_max = 5
+
+# final states of the gee tasks
+task_final_states = ['COMPLETED', 'FAILED', 'CANCELLED']
+
+# maximum size of the request of each stage of the computation, a stage above its budget stops the process before any task is submitted
+# the stage budgets override the default ones (e.g. {'soc': {'nodes': 50000}})
+graph_budget = {'nodes': 50000, 'bytes': 10 * 1024 * 1024, 'getinfo': 5}
+graph_stage_budgets = {}
@@ -0,0 +1,258 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from pathlib import Path
+from datetime import datetime
+import multiprocessing as mp
+import argparse
+import logging
+import json
+import time
+import re
+
+import ee
+
+from component import parameter as pm
+from component.message import ms
+from component.io import Io_15_3_1
+from .gee import init_ee
+
+logger = logging.getLogger(__name__)
+
+# semaphore shared by the workers to bound the number of running exports
+_export_slots = None
+
+class BatchAoi(object):
+    """headless replacement of the sepal_ui aoi io, the aoi is an asset or a single value of a column of an asset
+
+    Args:
+        asset (str): the asset id of the FeatureCollection
+        column (str, optional): the column used to select the features
+        value (str|int, optional): the value of the column
+    """
+
+    def __init__(self, asset, column=None, value=None):
+
+        self.asset = asset
+        self.column = column
+        self.value = value
+
+    @property
+    def feature_collection(self):
+
+        return self.get_aoi_ee()
+
+    def get_aoi_name(self):
+
+        name = Path(self.asset).name
+
+        return name if self.column is None else f'{name}_{self.column}_{self.value}'
+
+    def get_aoi_ee(self):
+
+        aoi = ee.FeatureCollection(self.asset)
+
+        return aoi if self.column is None else aoi.filter(ee.Filter.eq(self.column, self.value))
+
+class BatchOutput(object):
+    """headless replacement of the sepal_ui Alert, the messages are logged"""
+
+    def __init__(self, name):
+
+        self.name = name
+
+    def add_live_msg(self, msg, type_='info'):
+
+        msg = re.sub(r'<br\s*/?>', ' | ', str(msg))
+        logger.log(logging.WARNING if type_ in ['warning', 'error'] else logging.INFO, f'{self.name}: {msg}')
+
+        return self
+
+    add_msg = add_live_msg
+
+def get_aois(asset, column=None, values=None):
+    """return the specs of the aois of a FeatureCollection asset, one per value of column (all the distinct values by default)"""
+
+    if column is None:
+        return [{'asset': asset}]
+
+    if values is None:
+        init_ee()
+        values = ee.FeatureCollection(asset).aggregate_array(column).distinct().sort().getInfo()
+
+    return [{'asset': asset, 'column': column, 'value': value} for value in values]
+
+def get_io(params):
+    """create an Io_15_3_1 from a dict of its inputs"""
+
+    io = Io_15_3_1()
+    for key, value in params.items():
+        if not hasattr(io, key):
+            raise Exception(ms.batch.error.param.format(key))
+        setattr(io, key, value)
+
+    return io
+
+def _init_worker(export_slots):
+
+    global _export_slots
+    _export_slots = export_slots
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(message)s')
+
+    return
+
+def run_aoi(aoi, params):
+    """compute, export, download and analyse a single aoi
+
+    Args:
+        aoi (dict): the BatchAoi arguments
+        params (dict): the Io_15_3_1 inputs
+
+    Returns:
+        entry (dict): the manifest entry of the aoi
+    """
+
+    # the pipeline is only imported in the workers
+    from component import scripts as cs
+
+    aoi_io = BatchAoi(**aoi)
+    output = BatchOutput(aoi_io.get_aoi_name())
+    entry = {'aoi': aoi, 'status': 'running', 'timings': {}, 'outputs': {}}
+    start = time.time()
+
+    def stage(name, function, *args):
+        stage_start = time.time()
+        result = function(*args)
+        entry['timings'][name] = time.time() - stage_start
+        return result
+
+    cs.tracer.reset()
+    
+    try:
+        io = get_io(params)
+
+        stage('compute', cs.compute_indicator_maps, aoi_io, io, output)
+
+        # the exports wait for a free slot, the local maps don't need any
+        # no semaphore is installed when run_aoi is called outside of run_batch
+        with _export_slots or nullcontext():
+            links = stage('download', cs.download_maps, aoi_io, io, output)
+
+        stats = stage('statistics', cs.compute_zonal_analysis, aoi_io, io, output)
+
+        layers = ['land_cover', 'soc', 'productivity', 'indicator_15_3_1']
+        entry['outputs'] = {**{layer: str(link) for layer, link in zip(layers, links)}, 'statistics': str(stats)}
+        entry['outputs']['trace'] = str(cs.write_trace(aoi_io, io))
+        entry['cache_key'] = io.cache_key
+        entry['status'] = 'completed'
+
+    except Exception as e:
+        entry['status'] = 'failed'
+        entry['error'] = str(e)
+
+    entry['timings']['total'] = time.time() - start
+
+    return entry
+
+def run_batch(aois, params, max_workers=pm.batch_max_workers, max_exports=pm.batch_max_exports, manifest_file=None):
+    """run the indicator on a list of aois with the same parameters in a process pool
+
+    The manifest is rewritten each time an aoi is over so that a crashed run can be inspected.
+
+    Args:
+        aois ([dict]): the BatchAoi arguments of each aoi, see get_aois
+        params (dict): the Io_15_3_1 inputs
+        max_workers (int): the number of aois computed at the same time
+        max_exports (int): the number of aois exporting their maps at the same time
+        manifest_file (pathlib.Path, optional): the run manifest, in pm.result_dir by default
+
+    Returns:
+        manifest (dict): the params, the status and the timings of each aoi
+    """
+
+    # check the params before starting any process
+    get_io(params)
+
+    if manifest_file is None:
+        manifest_file = pm.result_dir.joinpath(f'batch_{datetime.now():%Y%m%d_%H%M%S}.json')
+    manifest_file = Path(manifest_file)
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+
+    names = [BatchAoi(**aoi).get_aoi_name() for aoi in aois]
+    manifest = {
+        'params': params,
+        'start': datetime.now().isoformat(),
+        'aois': {name: {'aoi': aoi, 'status': 'pending'} for name, aoi in zip(names, aois)}
+    }
+
+    logger.info(ms.batch.start.format(len(aois), max_workers))
+
+    # ee and the gdrive service don't survive a fork
+    context = mp.get_context('spawn')
+    export_slots = context.BoundedSemaphore(max_exports)
+
+    with ProcessPoolExecutor(max_workers, mp_context=context, initializer=_init_worker, initargs=(export_slots,)) as executor:
+
+        futures = {executor.submit(run_aoi, aoi, params): name for name, aoi in zip(names, aois)}
+
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                entry = {**manifest['aois'][name], 'status': 'failed', 'error': str(e)}
+
+            manifest['aois'][name] = entry
+            _write_manifest(manifest_file, manifest)
+            logger.info(ms.batch.aoi_status.format(name, entry['status'], entry.get('timings', {}).get('total', 0)))
+
+    manifest['end'] = datetime.now().isoformat()
+    _write_manifest(manifest_file, manifest)
+
+    logger.info(ms.batch.manifest.format(manifest_file))
+
+    return manifest
+
+def _write_manifest(manifest_file, manifest):
+
+    tmp_file = manifest_file.with_suffix('.tmp')
+    with tmp_file.open('w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    tmp_file.replace(manifest_file)
+
+    return
+
+def _parse_value(value):
+    """read the numbers of the command line as numbers so that they match the numeric columns"""
+
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Compute the SDG 15.3.1 indicator on several aois with the same parameters')
+    parser.add_argument('params', help='json file of the Io_15_3_1 inputs (e.g. {"start": 2001, "baseline_end": 2015, ...})')
+    parser.add_argument('asset', help='FeatureCollection asset of the aois')
+    parser.add_argument('--column', default=None, help='column of the asset, one aoi is computed per value')
+    parser.add_argument('--values', nargs='*', type=_parse_value, default=None, help='values of the column to compute (all by default)')
+    parser.add_argument('--workers', type=int, default=pm.batch_max_workers, help='number of aois computed at the same time')
+    parser.add_argument('--max-exports', type=int, default=pm.batch_max_exports, help='number of aois exporting their maps at the same time')
+    parser.add_argument('--manifest', default=None, help='path of the run manifest')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    with open(args.params) as f:
+        params = json.load(f)
+
+    init_ee()
+    aois = get_aois(args.asset, args.column, args.values)
+
+    manifest = run_batch(aois, params, args.workers, args.max_exports, args.manifest)
+
+    return 0 if all(entry['status'] == 'completed' for entry in manifest['aois'].values()) else 1
+
+if __name__ == '__main__':
+    raise SystemExit(main())
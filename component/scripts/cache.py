@@ -0,0 +1,202 @@
+from pathlib import Path
+from contextlib import contextmanager
+import threading
+import fcntl
+import hashlib
+import shutil
+import json
+import time
+import os
+
+from component import parameter as pm
+
+class ResultCache(object):
+    """Content addressed cache of the results
+    
+    Each set of parameters (every input of the Io_15_3_1 and the aoi) is hashed in a key that names a folder of the cache. 
+    The manifest keeps the parameters and the last access time of each key so that the least recently used folders 
+    can be removed when the cache exceeds max_size. The keys used by a running process and the keys without size 
+    (never completed) are never removed. The manifest is shared by the processes of a batch run, it is only updated 
+    under a file lock.
+    """
+    
+    def __init__(self, root=pm.cache_dir, max_size=pm.cache_max_size):
+        
+        self.root = Path(root)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        
+    @property
+    def manifest_file(self):
+        
+        return self.root.joinpath('manifest.json')
+    
+    @property
+    def lock_file(self):
+        
+        return self.root.joinpath('manifest.lock')
+        
+    def get_params(self, aoi_io, io):
+        """gather all the parameters that define the results"""
+        
+        params = {
+            'version': pm.cache_version,
+            'aoi': aoi_io.get_aoi_name(),
+            'start': io.start,
+            'baseline_end': io.baseline_end,
+            'target_start': io.target_start,
+            'end': io.end,
+            'sensors': sorted(io.sensors or []),
+            'trajectory': io.trajectory,
+            'trend_fit': io.trend_fit,
+            'transition_matrix': io.transition_matrix,
+            'productivity_table': io.productivity_table,
+            'conversion_coef': io.conversion_coef,
+            'percentile_error': io.percentile_error,
+            'backend': io.backend
+        }
+        
+        if io.backend == 'local':
+            # a stack rewritten in place changes the results
+            stacks = {
+                'ndvi': io.local_ndvi,
+                'precipitation': io.local_precipitation,
+                'land_cover': io.local_land_cover,
+                'soc': io.local_soc,
+                'soil_tax': io.local_soil_tax,
+                'climate_zones': io.local_climate_zones,
+                'aoi': io.local_aoi
+            }
+            params['stacks'] = {name: self._stat(path) for name, path in stacks.items() if path}
+        else:
+            # the serialized graph of the aoi contains its asset id or its coordinates 
+            params['aoi_geometry'] = aoi_io.get_aoi_ee().serialize()
+            
+        return params
+    
+    def key(self, aoi_io, io):
+        """return the hash of the parameters"""
+        
+        params = json.dumps(self.get_params(aoi_io, io), sort_keys=True, default=str)
+        
+        return hashlib.sha256(params.encode()).hexdigest()
+    
+    def name(self, aoi_io, key):
+        """return the name used as prefix of the tasks and the files of a key"""
+        
+        return f'{aoi_io.get_aoi_name()}_{key[:pm.cache_key_length]}'
+    
+    def get_dir(self, aoi_io, io, key):
+        """create the folder of the key, register its parameters in the manifest and mark it as used by this process until touch"""
+        
+        folder = self.root.joinpath(key[:pm.cache_key_length])
+        folder.mkdir(parents=True, exist_ok=True)
+        
+        with self._locked():
+            manifest = self._read()
+            entry = manifest.setdefault(key, {'created': time.time(), 'params': self.get_params(aoi_io, io)})
+            entry['last_access'] = time.time()
+            entry.setdefault('running', {})[str(os.getpid())] = time.time()
+            self._write(manifest)
+        
+        return folder
+    
+    def touch(self, key):
+        """update the last access time and the size of the key, release it and evict the least recently used keys"""
+        
+        with self._locked():
+            manifest = self._read()
+            
+            if key in manifest:
+                manifest[key]['last_access'] = time.time()
+                manifest[key]['size'] = self._size(self.root.joinpath(key[:pm.cache_key_length]))
+                manifest[key].get('running', {}).pop(str(os.getpid()), None)
+                
+            self._evict(manifest, key)
+            self._write(manifest)
+            
+        return
+    
+    def _evict(self, manifest, keep):
+        """remove the least recently used keys until the cache fits in max_size, keep and the keys in progress are never removed"""
+        
+        total = sum(entry.get('size', 0) for entry in manifest.values())
+        
+        for key in sorted(manifest, key=lambda k: manifest[k]['last_access']):
+            if total <= self.max_size: 
+                break
+            if key == keep or 'size' not in manifest[key] or self._is_running(manifest[key]):
+                continue
+                
+            shutil.rmtree(self.root.joinpath(key[:pm.cache_key_length]), ignore_errors=True)
+            total -= manifest.pop(key).get('size', 0)
+            
+        return
+    
+    @contextmanager
+    def _locked(self):
+        """hold the manifest for the threads of this process and for the other processes"""
+        
+        with self.lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with self.lock_file.open('a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+    
+    @staticmethod
+    def _is_running(entry):
+        """check if a live process still uses the key"""
+        
+        for pid, start in entry.get('running', {}).items():
+            if time.time() - start > pm.cache_run_timeout:
+                continue
+            try:
+                os.kill(int(pid), 0)
+                return True
+            except ProcessLookupError:
+                continue
+            except PermissionError:
+                return True
+            
+        return False
+    
+    def _read(self):
+        
+        if not self.manifest_file.is_file():
+            return {}
+        
+        with self.manifest_file.open() as f:
+            return json.load(f)
+        
+    def _write(self, manifest):
+        
+        # write a full file before replacing the manifest so that it's never read half written
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.manifest_file.with_suffix(f'.{os.getpid()}.tmp')
+        with tmp_file.open('w') as f:
+            json.dump(manifest, f, indent=2, default=str)
+        tmp_file.replace(self.manifest_file)
+        
+        return
+        
+    @staticmethod
+    def _size(folder):
+        
+        return sum(file.stat().st_size for file in folder.rglob('*') if file.is_file())
+    
+    @staticmethod
+    def _stat(path):
+        
+        path = Path(path)
+        if not path.exists():
+            return [str(path)]
+        
+        stat = path.stat()
+        
+        return [str(path), stat.st_mtime, stat.st_size]
+    
+# the cache shared by all the computations
+result_cache = ResultCache()
@@ -1,17 +1,31 @@
 import time
+import threading
+from collections import OrderedDict
 
+import numpy as np
 import rasterio as rio
-from rasterio.merge import merge
+from rasterio.windows import Window
+from rasterio.transform import from_origin
+from rasterio.shutil import copy as rio_copy
 from matplotlib.colors import to_rgba
 
 from component.message import ms
 from component import parameter as pm
 from .gdrive import gdrive
+from .stack import map_windows, get_windows
+from .trace import tracer, traced
 
-def digest_tiles(aoi_io, filename, result_dir, output, tmp_file):
+@traced('digest_tiles')
+def digest_tiles(aoi_io, filename, result_dir, output, tmp_file, band_files=None):
+    """download and merge the tiles of an export in tmp_file
     
-    if tmp_file.is_file():
-        output.add_live_msg(ms.download.file_exist.format(tmp_file), 'warning')
+    Args:
+        band_files ([pathlib.Path], optional): if set, the bands of the merged image are split in these files and tmp_file is removed
+    """
+    
+    dst_files = band_files or [tmp_file]
+    if all(file.is_file() for file in dst_files):
+        output.add_live_msg(ms.download.file_exist.format(', '.join(str(file) for file in dst_files)), 'warning')
         time.sleep(2)
         return 
     
@@ -22,45 +36,158 @@ def digest_tiles(aoi_io, filename, result_dir, output, tmp_file):
     if not len(files):
         raise Exception(ms.gdrive.error.no_file)
         
-    drive_handler.download_files(files, result_dir)
-    
-    pathname = f'{filename}*.tif'
-    
-    files = [file for file in result_dir.glob(pathname)]
+    with tracer.span('download_files', file=filename) as span:
+        drive_handler.download_files(files, result_dir)
+        files = [result_dir.joinpath(file['name']) for file in files]
+        span['bytes'] = sum(file.stat().st_size for file in files)
         
     # run the merge process
     output.add_live_msg(ms.download.merge_tile)
-    time.sleep(2)
     
-    # manual open and close because I don't know how many file there are
-    sources = [rio.open(file) for file in files]
+    with tracer.span('merge_tiles', file=filename):
+        merge_tiles(files, tmp_file, cog=not band_files)
+    
+    # delete local files
+    [file.unlink() for file in files]
+    
+    if band_files:
+        split_bands(tmp_file, band_files)
+        tmp_file.unlink()
+    
+    return
 
-    data, output_transform = merge(sources)
-    
-    out_meta = sources[0].meta.copy()
-    out_meta.update(nodata=0)
-    out_meta.update(
-        driver    = "GTiff",
-        height    =  data.shape[1],
-        width     =  data.shape[2],
-        transform = output_transform,
-        compress  = 'lzw'
+def merge_tiles(files, dst_file, max_workers=pm.local_max_workers, block_size=pm.merge_block_size, max_open=pm.merge_max_open, cog=True):
+    """merge the tiles of an export block by block so that the mosaic is never fully loaded in memory, the result is a COG if cog is set
+    
+    The tiles exported by GEE share the same grid so the output grid is the union of their bounds. 
+    The blocks are read in a thread pool, each thread keeping at most max_open / max_workers tiles opened.
+    
+    Args:
+        files ([pathlib.Path]): the tiles to merge
+        dst_file (pathlib.Path): the merged file
+    """
+    
+    # read the tile grids
+    tiles = []
+    for file in files:
+        with rio.open(file) as src:
+            tiles.append({'file': file, 'bounds': src.bounds, 'height': src.height, 'width': src.width})
+            meta = src.meta.copy()
+            
+    xres, yres = meta['transform'].a, -meta['transform'].e
+    left = min(tile['bounds'].left for tile in tiles)
+    top = max(tile['bounds'].top for tile in tiles)
+    right = max(tile['bounds'].right for tile in tiles)
+    bottom = min(tile['bounds'].bottom for tile in tiles)
+    
+    # position of the tiles in the output grid
+    for tile in tiles:
+        tile['row'] = int(round((top - tile['bounds'].top) / yres))
+        tile['col'] = int(round((tile['bounds'].left - left) / xres))
+    
+    meta.update(
+        driver     = "GTiff",
+        height     = int(round((top - bottom) / yres)),
+        width      = int(round((right - left) / xres)),
+        transform  = from_origin(left, top, xres, yres),
+        nodata     = 0,
+        compress   = 'lzw',
+        tiled      = True,
+        blockxsize = block_size,
+        blockysize = block_size,
+        num_threads = 'all_cpus'
     )
     
-    # create a colormap
-    colormap = {}
-    for i, color in enumerate(pm.legend.values()):
-        color = tuple(int(c*255) for c in to_rgba(color))
-        colormap[i+1] = color
+    # each thread keeps its own pool of opened tiles
+    local = threading.local()
+    pools = []
+    def open_tile(file):
+        if not hasattr(local, 'sources'):
+            local.sources = OrderedDict()
+            pools.append(local.sources)
+        if file not in local.sources:
+            if len(local.sources) >= max(1, max_open // max_workers):
+                local.sources.popitem(last=False)[1].close()
+            local.sources[file] = rio.open(file)
+        local.sources.move_to_end(file)
+        return local.sources[file]
     
-    with rio.open(tmp_file, "w", **out_meta) as dest:
-        dest.write(data)
-        dest.write_colormap(1, colormap)
+    def read_block(window):
+        data = np.zeros((meta['count'], window.height, window.width), dtype=meta['dtype'])
+        for tile in tiles:
+            row_start = max(window.row_off, tile['row'])
+            row_stop = min(window.row_off + window.height, tile['row'] + tile['height'])
+            col_start = max(window.col_off, tile['col'])
+            col_stop = min(window.col_off + window.width, tile['col'] + tile['width'])
+            if row_start >= row_stop or col_start >= col_stop:
+                continue
+            
+            tile_window = Window(col_start - tile['col'], row_start - tile['row'], col_stop - col_start, row_stop - row_start)
+            data[:, row_start - window.row_off: row_stop - window.row_off, col_start - window.col_off: col_stop - window.col_off] = \
+                open_tile(tile['file']).read(window=tile_window)
+            
+        return data
     
-    # manually close the files
-    [src.close() for src in sources]
+    try:
+        with rio.open(dst_file, "w", **meta) as dest:
+            for window, data in map_windows(read_block, get_windows(meta['width'], meta['height'], block_size), max_workers):
+                dest.write(data, window=window)
+            dest.write_colormap(1, get_colormap())
+    finally:
+        # the threads are over, close the remaining opened tiles
+        [src.close() for sources in pools for src in sources.values()]
+        
+    if cog: 
+        to_cog(dst_file)
     
-    # delete local files
-    [file.unlink() for file in files]
+    return
+
+def split_bands(file, dst_files, block_size=pm.merge_block_size):
+    """split the bands of file in single band COGs (one per dst_files), block by block"""
+    
+    with rio.open(file) as src:
+        
+        meta = src.meta.copy()
+        meta.update(count=1, compress='lzw', tiled=True, blockxsize=block_size, blockysize=block_size)
+        
+        for i, dst_file in enumerate(dst_files):
+            with rio.open(dst_file, 'w', **meta) as dst:
+                for window in get_windows(src.width, src.height, block_size):
+                    dst.write(src.read(i + 1, window=window), 1, window=window)
+                dst.write_colormap(1, get_colormap())
+            
+            to_cog(dst_file)
+            
+    return
+
+def to_cog(file):
+    """convert in place a GeoTIFF into a Cloud Optimized GeoTIFF with internal overviews
+    
+    The overviews use the mode resampling to keep the class values and the colormap is kept.
+    """
+    
+    tmp_file = file.with_name(f'{file.stem}_cog.tif')
+    
+    rio_copy(
+        file, 
+        tmp_file, 
+        driver = 'COG', 
+        compress = 'LZW', 
+        blocksize = pm.merge_block_size, 
+        overview_resampling = 'MODE', 
+        num_threads = 'ALL_CPUS'
+    )
+    
+    tmp_file.replace(file)
     
-    return
\ No newline at end of file
+    return
+
+def get_colormap():
+    """create the colormap of the 1 degraded - 2 stable - 3 improved byte convention"""
+    
+    colormap = {}
+    for i, color in enumerate(pm.legend.values()):
+        color = tuple(int(c*255) for c in to_rgba(color))
+        colormap[i+1] = color
+        
+    return colormap
@@ -1,23 +1,146 @@
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left, bisect_right
+import threading
+import time
 
 import ee
-import io
-from googleapiclient.http import MediaIoBaseDownload
-from apiclient import discovery
 
 from component.message import ms
-from .gee import search_task
+from component import parameter as pm
+from .gee import search_task, init_ee
+from .trace import tracer, traced
 
 import logging
 logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.ERROR)
 
+class DriveIndex(object):
+    """Index of the tif files of the gdrive sorted by name, shared by all the gdrive objects
+    
+    The listing is reused for ttl seconds. Prefixes can be invalidated when new files are expected (e.g. an export task) 
+    so that only them are listed again. An invalidated prefix stays stale, even through a full listing, until it is listed 
+    again by a listing started after its invalidation. A longer prefix listed after the invalidation of a shorter one is 
+    not stale anymore, the rest of the shorter prefix is.
+    """
+    
+    def __init__(self, ttl=pm.drive_index_ttl):
+        
+        self.ttl = ttl
+        self.date = None
+        self.items = []
+        self.names = []
+        # invalidation time of the stale prefixes
+        self.stale = {}
+        # listing time of the prefixes covered by a stale prefix
+        self.listed = {}
+        self.lock = threading.Lock()
+        
+    def is_valid(self):
+        """check if the full listing is still valid"""
+        
+        return self.date is not None and time.time() - self.date < self.ttl
+    
+    def is_stale(self, prefix):
+        """check if the prefix needs to be listed again"""
+        
+        for p, date in self.stale.items():
+            if p.startswith(prefix):
+                return True
+            if prefix.startswith(p) and not any(prefix.startswith(q) and start >= date for q, start in self.listed.items()):
+                return True
+                
+        return False
+        
+    def _range(self, prefix):
+        """return the slice of the items starting with prefix"""
+        
+        return slice(bisect_left(self.names, prefix), bisect_right(self.names, prefix + '\U0010ffff'))
+        
+    def update(self, items, start):
+        """replace the full listing requested at start, the stale prefixes are kept as their exports may still be running"""
+        
+        with self.lock:
+            self.items = sorted(items, key=lambda item: item['name'])
+            self.names = [item['name'] for item in self.items]
+            self.date = start
+            
+        return
+    
+    def update_prefix(self, prefix, items, start):
+        """replace the items starting with prefix listed at start, only the invalidations older than the listing are cleared
+        
+        The shorter stale prefixes stay stale for their other items, the listing of prefix is kept to narrow them.
+        
+        The prefix should only be listed once the tasks exporting its files are over.
+        """
+        
+        items = [item for item in items if item['name'].startswith(prefix)]
+        
+        with self.lock:
+            range_ = self._range(prefix)
+            self.items[range_] = sorted(items, key=lambda item: item['name'])
+            self.names = [item['name'] for item in self.items]
+            self.stale = {p: date for p, date in self.stale.items() if not p.startswith(prefix) or date > start}
+            self.listed[prefix] = start
+            self.listed = {q: date for q, date in self.listed.items() if any(q.startswith(p) for p in self.stale)}
+            
+        return
+    
+    def search(self, prefix):
+        """return the items starting with prefix"""
+        
+        with self.lock:
+            items = self.items[self._range(prefix)]
+        
+        return items
+    
+    def invalidate(self, prefix):
+        """the files starting with prefix will be listed again on next search"""
+        
+        with self.lock:
+            self.stale[prefix] = time.time()
+            
+        return
+    
+    def remove(self, files):
+        """remove the deleted files from the index"""
+        
+        ids = [file['id'] for file in files]
+        
+        with self.lock:
+            self.items = [item for item in self.items if item['id'] not in ids]
+            self.names = [item['name'] for item in self.items]
+            
+        return
+    
+drive_index = DriveIndex()
+
 class gdrive(object):
 
     def __init__(self):
         
-        self.initialize = ee.Initialize()
+        init_ee()
         self.credentials = ee.Credentials()
-        self.service = discovery.build(serviceName='drive', version='v3', cache_discovery=False, credentials=self.credentials)
+        self.service = self.build_service()
+        
+        # the services are not thread safe, each download thread builds its own
+        self._local = threading.local()
+        
+    def build_service(self):
+        """build a gdrive service using the ee credentials"""
+        
+        # the google api client is only needed to download the maps
+        from apiclient import discovery
+        
+        return discovery.build(serviceName='drive', version='v3', cache_discovery=False, credentials=self.credentials)
+    
+    def thread_service(self):
+        """return the gdrive service of the current thread"""
+        
+        if not hasattr(self._local, 'service'):
+            self._local.service = self.build_service()
+            
+        return self._local.service
         
     def tasks_list(self):
         """for debugging purpose, print the list of all the tasks in gee"""
@@ -44,62 +167,116 @@ class gdrive(object):
             for item in items:
                 print('{0} ({1})'.format(item['name'], item['id']))
 
-    def get_items(self):
-        """ get all the items in the Gdrive, items will have 2 columns, 'name' and 'id' """ 
-        service = self.service
+    def get_items(self, prefix=None):
+        """ get all the items in the Gdrive (only the one with name containing prefix if set), items will have 3 columns, 'name', 'id' and 'size' """ 
+        service = self.thread_service()
         
-        # get list of files
-        results = service.files().list( 
-            q ="mimeType='image/tiff' and trashed = false",
-            pageSize=1000, 
-            fields="nextPageToken, files(id, name)").execute()
-        items = results.get('files', [])
+        query = "mimeType='image/tiff' and trashed = false"
+        if prefix:
+            query += " and name contains '{}'".format(prefix.replace("'", "\\'"))
+        
+        # get list of files, page by page
+        items = []
+        page_token = None
+        while True:
+            results = service.files().list( 
+                q = query,
+                pageSize=1000, 
+                pageToken=page_token,
+                fields="nextPageToken, files(id, name, size)").execute()
+            items += results.get('files', [])
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
 
         return items
     
     
     def get_files(self, file_name):
-        """ look for the file_name patern in my Gdrive files and retreive a list of Ids"""
+        """ look for the files exported as file_name in my Gdrive files (file_name.tif or file_name-xxx.tif tiles) and retreive a list of Ids
+        
+        The export of file_name need to be over, its files are listed again if they were invalidated.
+        """
         
-        items = self.get_items()
+        if not drive_index.is_valid():
+            start = time.time()
+            drive_index.update(self.get_items(), start)
+        if drive_index.is_stale(file_name):
+            start = time.time()
+            drive_index.update_prefix(file_name, self.get_items(file_name), start)
+            
         files = []
-        for item in items:
-            if (file_name in item['name']):
-                files.append({'id':item['id'], 'name': item['name']})
+        for item in drive_index.search(file_name):
+            if item['name'] == f'{file_name}.tif' or item['name'].startswith(f'{file_name}-'):
+                files.append({'id':item['id'], 'name': item['name'], 'size': item.get('size')})
                 
         return files
                                 
-    def download_files(self, files, local_path):
-        """download the files from gdrive to the local_path"""
+    def download_files(self, files, local_path, max_workers=pm.drive_max_workers, chunk_size=pm.drive_chunk_size):
+        """download the files from gdrive to the local_path, max_workers files at a time"""
         
         # create path object 
         local_path = Path(local_path)
         
-        #open the gdrive service
-        service = self.service
+        with ThreadPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(self.download_file, file, local_path, chunk_size) for file in files]
+            
+            # raise the download errors if any
+            [future.result() for future in futures]
+            
+        return
+    
+    def download_file(self, file, local_path, chunk_size=pm.drive_chunk_size):
+        """download a file from gdrive to the local_path
+        
+        The file is requested by ranges of chunk_size bytes that are directly written in a .part file, 
+        renamed once the download is complete. An existing .part file is resumed where it stopped.
+        """
+        
+        dst = Path(local_path).joinpath(file['name'])
+        part = dst.with_name(f'{dst.name}.part')
+        
+        # open the gdrive service of this thread
+        service = self.thread_service()
         
-        # request the files from gdrvie in chunks
-        for file in files:
-            request = service.files().get_media(fileId=file['id'])
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-            # write them in a local based file
-            with local_path.joinpath(file['name']).open('wb') as f:
-                f.write(fh.getvalue())
+        size = file.get('size') or service.files().get(fileId=file['id'], fields='size').execute()['size']
+        size = int(size)
+        
+        start = part.stat().st_size if part.is_file() else 0
+        if start > size: 
+            part.unlink()
+            start = 0
+        
+        # request the file from gdrive in chunks
+        with part.open('ab') as f:
+            while start < size:
+                request = service.files().get_media(fileId=file['id'])
+                request.headers['Range'] = f'bytes={start}-{min(start + chunk_size, size) - 1}'
+                chunk = request.execute()
+                if not chunk: 
+                    raise Exception(ms.gdrive.error.incomplete.format(file['name']))
+                f.write(chunk)
+                start += len(chunk)
+                
+        part.replace(dst)
+        
+        return dst
             
     def delete_files(self, files):
         """ delete files from gdrive disk"""
         
         # open gdrive service
-        service = self.service
+        service = self.thread_service()
         
         # remove the files
-        for file in files:
-            service.files().delete(fileId=file['id']).execute()
+        with tracer.span('delete_files', bytes=sum(int(file.get('size') or 0) for file in files)):
+            for file in files:
+                service.files().delete(fileId=file['id']).execute()
+            
+        drive_index.remove(files)
             
+    @traced('download_to_disk')
     def download_to_disk(self, filename, image, aoi_io, output):
         """download the tile to the GEE disk
         
@@ -131,6 +308,9 @@ class gdrive(object):
                 task = ee.batch.Export.image.toDrive(**task_config)
                 task.start()
                 download = True
+                
+                # the exported files will need to be listed
+                drive_index.invalidate(filename)
             else:
                 output.add_live_msg(ms.gdrive.already_done.format(filename), 'success')
             
@@ -143,6 +323,7 @@ class gdrive(object):
             if task.state == 'RUNNING':
                 output.add_live_msg(f'{filename}: {task.state}')
                 download = True
+                drive_index.invalidate(filename)
             else: 
                 download = launch_task(filename, image, aoi_io, output)
                 
@@ -1,35 +1,107 @@
+import threading
 import time
 
 import ee 
 
 from component.message import ms
+from component import parameter as pm
+from .trace import traced
 
-ee.Initialize()
+_initialized = False
+_init_lock = threading.Lock()
+
+def init_ee():
+    """Initialize the Earth Engine session on the first call only, the other calls do nothing
+    
+    It should be called by every function that talks to the server so that importing the module needs no credentials.
+    """
+    
+    global _initialized
+    
+    with _init_lock:
+        if not _initialized:
+            ee.Initialize()
+            _initialized = True
+    
+    return
 
 # messages 
 STATUS = "Status : {0}"
     
-def wait_for_completion(task_descripsion, output):
-    """Wait until the selected process are finished. Display some output information
+@traced('wait_for_completion')
+def wait_for_completion(task_descripsion, output, callback=None):
+    """Wait until all the selected process are finished. Display some output information
+
+    The task list is requested once per cycle and the interval between 2 cycles grows 
+    from pm.poll_min to pm.poll_max while no task changes its state. A task missing from the list 
+    for pm.poll_missing_max consecutive cycles is set to FAILED. The elapsed time of a task stops when it reaches a final state.
 
     Args:
         task_descripsion ([str]) : name of the running tasks
         widget_alert (v.Alert) : alert to display the output messages
+        callback (function, optional) : called with (description, state) as soon as a task reaches a final state
     
-    Returns: state (str) : final state
+    Returns: states (dict) : final state of each task
     """
-    state = 'UNSUBMITTED'
-    while not (state == 'COMPLETED' or state =='FAILED'):
-        output.add_live_msg(ms.gee.status.format(state))
-        time.sleep(5)
+    
+    start = time.time()
+    states = {description: 'UNSUBMITTED' for description in task_descripsion}
+    missing = {description: 0 for description in task_descripsion}
+    ends = {}
+    delay = pm.poll_min
+    
+    def display():
+        """display the state and the elapsed time of each task"""
+        now = time.time()
+        msg = [ms.gee.task_status.format(description, state, ends.get(description, now) - start) for description, state in states.items()]
+        output.add_live_msg(ms.gee.status.format('<br>'.join(msg)))
+    
+    while not all(state in pm.task_final_states for state in states.values()):
+        
+        display()
+        
+        time.sleep(delay)
                     
-        # search for the task in task_list
-        for task in task_descripsion:
-            current_task = search_task(task)
-            state = current_task.state
-            if state == 'RUNNING': break
+        # search for all the tasks in a single task list
+        tasks = get_tasks()
+        new_states = {}
+        for description, state in states.items():
+            missing[description] = 0 if description in tasks else missing[description] + 1
+            if description in tasks:
+                new_states[description] = tasks[description].state
+            elif state not in pm.task_final_states and missing[description] >= pm.poll_missing_max:
+                new_states[description] = 'FAILED'
+            else:
+                new_states[description] = state
+        
+        for description, state in new_states.items():
+            if state in pm.task_final_states and states[description] not in pm.task_final_states:
+                ends[description] = time.time()
+                if callback:
+                    callback(description, state)
+        
+        # poll faster when something is moving
+        delay = pm.poll_min if new_states != states else min(delay * pm.poll_factor, pm.poll_max)
+        states = new_states
     
-    return state
+    display()
+    
+    return states
+
+def get_tasks():
+    """list the user tasks once and index them by description, only the most recent task of each description is kept
+    
+    Returns:
+        tasks (dict): the ee.Task indexed by description
+    """
+    
+    init_ee()
+    
+    tasks = {}
+    for task in ee.batch.Task.list():
+        tasks.setdefault(task.config['description'], task)
+        
+    return tasks
 
 def search_task(task_descripsion):
     """Search for the described task in the user Task list return None if nothing is find
@@ -41,14 +113,4 @@ def search_task(task_descripsion):
         task (ee.Task) : return the found task else None
     """
     
-    tasks_list = ee.batch.Task.list()
-    current_task = None
-    for task in tasks_list:
-        if task.config['description'] == task_descripsion:
-            current_task = task
-            break
-            
-    return current_task
-
-
-
+    return get_tasks().get(task_descripsion)
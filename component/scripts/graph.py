@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+import threading
+import json
+
+import ee
+
+from component import parameter as pm
+from component.message import ms
+
+_count_lock = threading.Lock()
+
+@contextmanager
+def count_getinfo():
+    """count the blocking requests (getInfo) sent to the server in the context
+
+    Yields:
+        counter (dict): the number of requests in counter['getinfo'], updated when the context exits
+    """
+
+    counter = {'getinfo': 0}
+    compute_value = ee.data.computeValue
+
+    def counting_compute_value(*args, **kwargs):
+        with _count_lock:
+            counter['getinfo'] += 1
+        return compute_value(*args, **kwargs)
+
+    ee.data.computeValue = counting_compute_value
+    try:
+        yield counter
+    finally:
+        ee.data.computeValue = compute_value
+
+def count_nodes(graph):
+    """count the function calls of a serialized ee object, the shared nodes are only counted once"""
+
+    if isinstance(graph, dict):
+        return ('functionInvocationValue' in graph) + sum(count_nodes(v) for v in graph.values())
+    elif isinstance(graph, list):
+        return sum(count_nodes(v) for v in graph)
+
+    return 0
+
+class GraphReport(object):
+    """measure the request built by each stage of the computation and stop as soon as a stage is above its budget
+
+    Args:
+        budget (dict): the default budget of a stage (nodes, bytes and getinfo)
+        stage_budgets (dict): the budgets of specific stages, they override the default one
+    """
+
+    def __init__(self, budget=pm.graph_budget, stage_budgets=pm.graph_stage_budgets):
+
+        self.budget = budget
+        self.stage_budgets = stage_budgets
+        self.stages = {}
+
+    def run(self, names, function, *args):
+        """call function, measure the ee objects it returns (one per name) and check their budgets
+
+        The getInfo calls of function are attributed to the first object.
+        """
+
+        single = isinstance(names, str)
+        names = [names] if single else names
+
+        with count_getinfo() as counter:
+            result = function(*args)
+
+        results = [result] if single else result
+        for i, (name, obj) in enumerate(zip(names, results)):
+            self.add(name, obj, counter['getinfo'] if i == 0 else 0)
+
+        return result
+
+    def add(self, name, obj, getinfo=0):
+        """measure an ee object and check its budget"""
+
+        if obj is None:
+            raise Exception(ms.gee.error.no_result.format(name))
+
+        serialized = obj.serialize()
+
+        self.stages[name] = {
+            'nodes': count_nodes(json.loads(serialized)),
+            'bytes': len(serialized.encode()),
+            'getinfo': getinfo
+        }
+
+        self.check(name)
+
+        return obj
+
+    def check(self, name):
+        """raise an error if the stage is above one of its budgets"""
+
+        budget = {**self.budget, **self.stage_budgets.get(name, {})}
+
+        for metric, value in self.stages[name].items():
+            if metric in budget and value > budget[metric]:
+                raise Exception(ms.gee.error.budget.format(name, metric, value, budget[metric]))
+
+        return
+
+    def to_msg(self):
+        """return the report as a message for the Alert"""
+
+        stages = [ms.gee.graph_stage.format(name, s['nodes'], s['bytes'] / 1024, s['getinfo']) for name, s in self.stages.items()]
+
+        return ms.gee.graph_report.format('<br>'.join(stages))
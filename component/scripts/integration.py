@@ -2,10 +2,10 @@ from functools import partial
 import json
 
 import ee 
+import numpy as np
 
 from component import parameter as pm
-
-ee.Initialize()
+from .stack import nanmean
 
 def integrate_ndvi_climate(aoi_io, io, output):
     
@@ -112,8 +112,10 @@ def int_yearly_ndvi(ndvi_coll, start, end):
         
         ndvi_collection = ndvi_coll
         ndvi_coll_ann = ndvi_collection.filter(ee.Filter.calendarRange(year, field = 'year'))
+        # each month is counted once, whatever its number of images
         months = (ndvi_coll_ann.aggregate_array("system:time_start")
-                .map(lambda x: ee.Number.parse(ee.Date(x).format("MM"))))
+                .map(lambda x: ee.Number.parse(ee.Date(x).format("MM")))
+                .distinct())
  
 
         img_coll= ee.ImageCollection.fromImages(
@@ -151,6 +153,8 @@ def int_yearly_climate(precipitation, start, end):
                 .set('year', year)
         )
     )
+    
+    return img_coll
 
 def CalcNDVI(img):
     """compute the ndvi on renamed bands"""
@@ -165,3 +169,50 @@ def CalcNDVI(img):
         .set('system:time_start', img.get('system:time_start'))
     
     return ndvi
+
+
+###########################
+#      local backend      #
+###########################
+
+def integrate_ndvi_climate_local(io, stacks, window):
+    """local equivalent of integrate_ndvi_climate on a window of the ndvi and precipitation stacks
+    
+    Returns:
+        (ndvi_int, climate_int) (np.array): yearly integrated ndvi and climate of shape (years, rows, cols)
+    """
+    
+    ndvi = stacks['ndvi'].read(window)
+    ndvi_int = int_yearly_ndvi_local(ndvi, stacks['ndvi'].dates(), io.start, io.end)
+    
+    precipitation = stacks['precipitation'].read(window)
+    climate_int = int_yearly_climate_local(precipitation, stacks['precipitation'].dates(), io.start, io.end)
+    
+    return (ndvi_int, climate_int)
+
+def int_yearly_ndvi_local(ndvi, dates, start, end):
+    """local equivalent of int_yearly_ndvi: mean of the monthly means of each year, each month counted once"""
+    
+    years = np.array([d.year for d in dates])
+    months = np.array([d.month for d in dates])
+    
+    ndvi_int = []
+    for year in range(start, end + 1):
+        
+        monthly = [nanmean(ndvi[(years == year) & (months == month)]) for month in np.unique(months[years == year])]
+        
+        if monthly:
+            ndvi_int.append(nanmean(np.stack(monthly)))
+        else:
+            ndvi_int.append(np.full(ndvi.shape[1:], np.nan, dtype=np.float32))
+        
+    return np.stack(ndvi_int).astype(np.float32)
+
+def int_yearly_climate_local(precipitation, dates, start, end):
+    """local equivalent of int_yearly_climate: mean of the observations of each year"""
+    
+    years = np.array([d.year for d in dates])
+    
+    climate_int = [nanmean(precipitation[years == year]) for year in range(start, end + 1)]
+        
+    return np.stack(climate_int).astype(np.float32)
@@ -1,8 +1,8 @@
 import ee 
+import numpy as np
 
 from component import parameter as pm
-
-ee.Initialize()
+from .stack import remap, to_uint8
 
 def land_cover(io, aoi_io, output):
     """Calculate land cover indicator"""
@@ -46,3 +46,35 @@ def land_cover(io, aoi_io, output):
         .rename("degradation")
 
     return landcover_degredation
+
+
+###########################
+#      local backend      #
+###########################
+
+def land_cover_local(io, stacks, window):
+    """local equivalent of land_cover on a window of the land cover stack"""
+    
+    lc_year_start = min(max(io.start, pm.lc_first_year), pm.land_use_max_year)
+    lc_year_end = min(max(io.end, pm.lc_first_year), pm.land_use_max_year)
+    
+    stack = stacks['land_cover']
+    landcover = stack.read(window, [stack.index(f'y{lc_year_start}'), stack.index(f'y{lc_year_end}')])
+    landcover[landcover == 9999] = np.nan
+    
+    # baseline and target land cover map reclassified into IPCC classes
+    landcover_bl_remapped = remap(landcover[0], pm.translation_matrix[0], pm.translation_matrix[1])
+    landcover_tg_remapped = remap(landcover[1], pm.translation_matrix[0], pm.translation_matrix[1])
+    
+    # compute transition map (first digit for baseline land cover, and second digit for target year land cover)
+    landcover_transition = landcover_bl_remapped * 10 + landcover_tg_remapped
+    
+    # definition of land cover transitions as degradation (-1), improvement (1), or no relevant change (0)
+    trans_matrix_flatten = [item for sublist in io.transition_matrix for item in sublist]
+    landcover_degredation = remap(landcover_transition, pm.IPCC_lc_change_matrix, trans_matrix_flatten)
+    
+    # use the byte convention 
+    # 1 degraded - 2 stable - 3 improved
+    landcover_degredation = remap(landcover_degredation, [1, 0, -1], [3, 2, 1])
+    
+    return to_uint8(landcover_degredation)
@@ -1,15 +1,16 @@
-from functools import partial 
+import warnings
 
 import ee 
 import json
+import numpy as np
 
 from component import parameter as pm
-
-ee.Initialize()
+from component.message import ms
+from .stack import remap, to_uint8, nanmean
 
 def productivity_trajectory(io, nvdi_yearly_integration, climate_yearly_integration, output):
     """
-    Productivity Trend describes the trajectory of change in productivity over time. Trend is calculated by fitting a robust, non-parametric linear regression model.The significance of trajectory slopes at the P <= 0.05 level should be reported in terms of three classes:
+    Productivity Trend describes the trajectory of change in productivity over time. Trend is calculated by fitting a linear regression model, either a least square fit or the robust, non-parametric Theil-Sen estimator (io.trend_fit).The significance of trajectory slopes at the P <= 0.05 level should be reported in terms of three classes:
         1) Z score < -1.96 = Potential degradation, as indicated by a significant decreasing trend,
         2) Z score > 1.96 = Potential improvement, as indicated by a significant increasing trend, or
         3) Z score > -1.96 AND < 1.96 = No significant change
@@ -24,17 +25,17 @@ The following code runs the selected trend method and produce an output by recla
     
     # nvi trend
     if io.trajectory == trajectories[0]:
-        lf_trend, mk_trend = ndvi_trend(io.start, io.end, nvdi_yearly_integration)
+        lf_trend, mk_trend = ndvi_trend(io.start, io.end, nvdi_yearly_integration, io.trend_fit)
     # p restrend
     elif io.trajectory == trajectories[1]:
-        lf_trend, mk_trend = p_restrend(io.start, io.end, nvdi_yearly_integration, climate_yearly_integration)
+        lf_trend, mk_trend = p_restrend(io.start, io.end, nvdi_yearly_integration, climate_yearly_integration, io.trend_fit)
     # s restrend
     elif io.trajectory == trajectories[2]:
         #TODO: need to code this
         raise NameError("s_restrend method not yet supported")
     # ue trend
     elif io.trajectory == trajectories[3]:
-        lf_trend, mk_trend = ue_trend(io.start, io.end, nvdi_yearly_integration, climate_yearly_integration)
+        lf_trend, mk_trend = ue_trend(io.start, io.end, nvdi_yearly_integration, climate_yearly_integration, io.trend_fit)
     else:
         raise NameError(f'Unrecognized method "{io.trajectory}"')
 
@@ -44,6 +45,9 @@ The following code runs the selected trend method and produce an output by recla
     kendall95 = pm.get_kendall_coef(period, 95)
     kendall99 = pm.get_kendall_coef(period, 99)
 
+    # only the S statistic is compared to the Kendall parameters
+    mk_trend = mk_trend.select('s')
+
     # Create final productivity trajectory output layer. Positive values are 
     # significant increase, negative values are significant decrease.
     signif = ee.Image(pm.int_16_min) \
@@ -122,20 +126,31 @@ def productivity_performance(aoi_io, io, nvdi_yearly_integration, climate_yearly
     ndvi_id = ndvi_mean.addBands(similar_ecoregions).updateMask(mask)
 
     # compute 90th percentile by unit
+    # the exact percentile keeps every pixel value, the approximate one only a fixed histogram per unit
+    if io.percentile_error:
+        steps, width = histogram_bins(io.percentile_error)
+        reducer = ee.Reducer.fixedHistogram(pm.ndvi_range[0], pm.ndvi_range[1], steps)
+    else:
+        reducer = ee.Reducer.percentile([90])
+        
     percentile_90 = ndvi_id.reduceRegion(
-        reducer=ee.Reducer.percentile([90]).group(
+        reducer=reducer.group(
             groupField=1, 
             groupName='code'
         ),
         geometry=aoi_io.get_aoi_ee().geometry(),
         scale=30,
-        maxPixels=1e15
+        maxPixels=1e15,
+        tileScale=pm.performance_tile_scale
     )
 
     # Extract the cluster IDs and the 90th percentile
     groups = ee.List(percentile_90.get("groups"))
     ids = groups.map(lambda d: ee.Dictionary(d).get('code'))
-    percentile = groups.map(lambda d: ee.Dictionary(d).get('p90'))
+    if io.percentile_error:
+        percentile = groups.map(lambda d: histogram_percentile(ee.Dictionary(d).get('histogram'), 90, width))
+    else:
+        percentile = groups.map(lambda d: ee.Dictionary(d).get('p90'))
 
     # remap the similar ecoregion raster using their 90th percentile value
     ecoregion_perc90 = similar_ecoregions.remap(ids, percentile)
@@ -154,6 +169,24 @@ def productivity_performance(aoi_io, io, nvdi_yearly_integration, climate_yearly
     
     return prod_performance
 
+def histogram_bins(error):
+    """return the number of bins and their width so that the middle of a bin is at most error away from its values"""
+    
+    steps = int(np.ceil((pm.ndvi_range[1] - pm.ndvi_range[0]) / (2 * error)))
+    
+    return (steps, (pm.ndvi_range[1] - pm.ndvi_range[0]) / steps)
+
+def histogram_percentile(histogram, percentile, width):
+    """return the middle of the bin of a fixedHistogram ([[bucket_min, count], ...]) that holds the percentile (nearest rank)"""
+    
+    histogram = ee.Array(histogram)
+    cumulative = histogram.slice(1, 1, 2).project([0]).accum(0)
+    total = cumulative.reduce(ee.Reducer.max(), [0]).get([0])
+    
+    index = cumulative.gte(total.multiply(percentile / 100)).argmax().get(0)
+    
+    return histogram.get(ee.List([index, 0])).add(width / 2)
+
 def productivity_state(aoi_io, io, ndvi_yearly_integration, climate_int, output):
     """
     It represents the level of relative productivity in a pixel compred to a historical observations of productivity for that pixel. 
@@ -223,31 +256,9 @@ def productivity_state(aoi_io, io, ndvi_yearly_integration, climate_int, output)
         .reduce(ee.Reducer.mean()) \
         .rename(['ndvi'])
 
-    # reclassify mean ndvi for baseline period based on the percentiles
-    baseline_classes = ee.Image(pm.int_16_min) \
-        .where(baseline_ndvi_mean.lte(baseline_ndvi_perc.select('p10')), 1) \
-        .where(baseline_ndvi_mean.gt(baseline_ndvi_perc.select('p10')), 2) \
-        .where(baseline_ndvi_mean.gt(baseline_ndvi_perc.select('p20')), 3) \
-        .where(baseline_ndvi_mean.gt(baseline_ndvi_perc.select('p30')), 4) \
-        .where(baseline_ndvi_mean.gt(baseline_ndvi_perc.select('p40')), 5) \
-        .where(baseline_ndvi_mean.gt(baseline_ndvi_perc.select('p50')), 6) \
-        .where(baseline_ndvi_mean.gt(baseline_ndvi_perc.select('p60')), 7) \
-        .where(baseline_ndvi_mean.gt(baseline_ndvi_perc.select('p70')), 8) \
-        .where(baseline_ndvi_mean.gt(baseline_ndvi_perc.select('p80')), 9) \
-        .where(baseline_ndvi_mean.gt(baseline_ndvi_perc.select('p90')), 10)
-
-    # reclassify mean ndvi for target period based on the percentiles
-    target_classes = ee.Image(pm.int_16_min) \
-        .where(target_ndvi_mean.lte(baseline_ndvi_perc.select('p10')), 1) \
-        .where(target_ndvi_mean.gt(baseline_ndvi_perc.select('p10')), 2) \
-        .where(target_ndvi_mean.gt(baseline_ndvi_perc.select('p20')), 3) \
-        .where(target_ndvi_mean.gt(baseline_ndvi_perc.select('p30')), 4) \
-        .where(target_ndvi_mean.gt(baseline_ndvi_perc.select('p40')), 5) \
-        .where(target_ndvi_mean.gt(baseline_ndvi_perc.select('p50')), 6) \
-        .where(target_ndvi_mean.gt(baseline_ndvi_perc.select('p60')), 7) \
-        .where(target_ndvi_mean.gt(baseline_ndvi_perc.select('p70')), 8) \
-        .where(target_ndvi_mean.gt(baseline_ndvi_perc.select('p80')), 9) \
-        .where(target_ndvi_mean.gt(baseline_ndvi_perc.select('p90')), 10)
+    # reclassify mean ndvi for baseline and target period based on the percentiles
+    baseline_classes = percentile_classes(baseline_ndvi_mean, baseline_ndvi_perc)
+    target_classes = percentile_classes(target_ndvi_mean, baseline_ndvi_perc)
 
     # difference between start and end clusters >= 2 means improvement (<= -2 
     # is degradation)
@@ -272,35 +283,41 @@ def productivity_state(aoi_io, io, ndvi_yearly_integration, climate_int, output)
 
     return degredation
 
-def productivity_final(trajectory, performance, state, output):
+def percentile_classes(ndvi_mean, ndvi_perc):
+    """classify the mean ndvi in the 10 percentile classes, masked pixels are set to int_16_min. part of productivity_state
+    
+    As the percentiles are sorted, the class is 1 + the number of percentiles (p10 to p90) below the mean: 
+    a single comparison against the 9 bands and a sum instead of a chain of 10 where.
+    """
+    
+    edges = ndvi_perc.select([f'p{p}' for p in range(10, 100, 10)])
+    
+    return ndvi_mean \
+        .gt(edges) \
+        .reduce(ee.Reducer.sum()) \
+        .add(1) \
+        .unmask(pm.int_16_min)
+
+def productivity_final(trajectory, performance, state, table, output):
+    """combine the 3 productivity sub-indicators with a single remap on the table (see pm.productivity_tables)"""
+    
     trajectory_class = trajectory.select('trajectory')
     performance_class = performance.select('performance')
     state_class = state.select('state')
+    
+    table = [table[t][s][p] for t in range(4) for s in range(4) for p in range(4)]
 
-    productivity = ee.Image(0)\
-        .where(trajectory_class.eq(3).And(state_class.eq(3)).And(performance_class.eq(2)),3) \
-        .where(trajectory_class.eq(3).And(state_class.eq(3)).And(performance_class.eq(1)),3) \
-        .where(trajectory_class.eq(3).And(state_class.eq(2)).And(performance_class.eq(2)),3) \
-        .where(trajectory_class.eq(3).And(state_class.eq(2)).And(performance_class.eq(1)),3) \
-        .where(trajectory_class.eq(3).And(state_class.eq(1)).And(performance_class.eq(2)),3) \
-        .where(trajectory_class.eq(3).And(state_class.eq(1)).And(performance_class.eq(1)),1) \
-        .where(trajectory_class.eq(2).And(state_class.eq(3)).And(performance_class.eq(2)),2) \
-        .where(trajectory_class.eq(2).And(state_class.eq(3)).And(performance_class.eq(1)),2) \
-        .where(trajectory_class.eq(2).And(state_class.eq(2)).And(performance_class.eq(2)),2) \
-        .where(trajectory_class.eq(2).And(state_class.eq(2)).And(performance_class.eq(1)),1) \
-        .where(trajectory_class.eq(2).And(state_class.eq(1)).And(performance_class.eq(2)),1) \
-        .where(trajectory_class.eq(2).And(state_class.eq(1)).And(performance_class.eq(1)),1) \
-        .where(trajectory_class.eq(1).And(state_class.eq(3)).And(performance_class.eq(2)),1) \
-        .where(trajectory_class.eq(1).And(state_class.eq(3)).And(performance_class.eq(1)),1) \
-        .where(trajectory_class.eq(1).And(state_class.eq(2)).And(performance_class.eq(2)),1) \
-        .where(trajectory_class.eq(1).And(state_class.eq(2)).And(performance_class.eq(1)),1) \
-        .where(trajectory_class.eq(1).And(state_class.eq(1)).And(performance_class.eq(2)),1) \
-        .where(trajectory_class.eq(1).And(state_class.eq(1)).And(performance_class.eq(1)),1) \
+    productivity = trajectory_class \
+        .multiply(16) \
+        .add(state_class.multiply(4)) \
+        .add(performance_class) \
+        .remap(list(range(64)), table) \
+        .unmask(0) \
         .rename('productivity')
     
     return productivity.uint8()
 
-def ndvi_trend(start, end, ndvi_yearly_integration):
+def ndvi_trend(start, end, ndvi_yearly_integration, fit='ols'):
     """Calculate NDVI trend.
     
     Calculates the trend of temporal NDVI using NDVI data from selected satellite dataset. Areas where changes are not significant
@@ -308,52 +325,53 @@ def ndvi_trend(start, end, ndvi_yearly_integration):
     """
 
     # Compute linear trend function to predict ndvi based on year (ndvi trend)
-    lf_trend = ndvi_yearly_integration \
-        .select(['year', 'ndvi']) \
-        .reduce(ee.Reducer.linearFit())
+    lf_trend = trend_fit(ndvi_yearly_integration.select(['year', 'ndvi']), fit)
 
     # Compute Kendall statistics
     mk_trend = mann_kendall(ndvi_yearly_integration.select('ndvi'))
 
     return (lf_trend, mk_trend)
 
-def p_restrend(start, end, nvdi_yearly_integration, climate_yearly_integration):
+def p_restrend(start, end, nvdi_yearly_integration, climate_yearly_integration, fit='ols'):
     """
     Residual trend analysis predicts NDVI based on the given rainfall.
     p_restrend uses linear regression model to predict NDVI for a given rainfall amount. 
     The residual (Predicted - Obsedved) NDVI trend is considered as productivity change that is indipendent of climatic variation. 
+    The fit, the prediction and the residuals are computed in array images: a single image whatever the number of years.
     For further details, check the reference: Wessels, K.J.; van den Bergh, F.; Scholes, R.J. Limits to detectability of land degradation by trend analysis of vegetation index data. Remote Sens. Environ. 2012, 125, 10–22.
     """
     
-    # Apply function to create image collection of ndvi and climate
-    ndvi_climate_yearly_integration = ndvi_climate_merge(climate_yearly_integration, nvdi_yearly_integration, start, end)
-
-    # Compute linear trend function to predict ndvi based on climate (independent are followed by dependent var
-    linear_model_climate_ndvi = ndvi_climate_yearly_integration \
-        .select(['clim', 'ndvi']) \
-        .reduce(ee.Reducer.linearFit())
-
-    # Apply function to  predict NDVI based on climate
-    first = ee.List([])
-    predicted_yearly_ndvi = ee.ImageCollection(ee.List(
-        ndvi_climate_yearly_integration \
-        .select('clim') \
-        .iterate(partial(ndvi_prediction_climate, linear_model_climate_ndvi = linear_model_climate_ndvi), first)
-    ))
-
-    # Apply function to compute NDVI annual residuals
-    residual_yearly_ndvi = image_collection_residuals(start, end, nvdi_yearly_integration, predicted_yearly_ndvi)
-    #residual_yearly_ndvi = nvdi_yearly_integration.map(partial(ndvi_residuals, model = predicted_yearly_ndvi))
+    # (n, 4) array per pixel: [1, clim, ndvi, year], the years masked in one of the datasets are excluded
+    def add_bands(image):
+        image = ee.Image.constant(1).rename('one') \
+            .addBands(image.select(['clim', 'ndvi'])) \
+            .addBands(ee.Image.constant(image.get('year')).rename('year')) \
+            .float()
+        return image.updateMask(image.mask().reduce(ee.Reducer.min()))
+    
+    array = ndvi_climate_merge(climate_yearly_integration, nvdi_yearly_integration, start, end) \
+        .map(add_bands) \
+        .toArray()
+    
+    design = array.arraySlice(1, 0, 2)
+    ndvi = array.arraySlice(1, 2, 3)
+    years = array.arraySlice(1, 3, 4)
+    
+    # least square fit of the ndvi against the climate (2, 1), then the prediction and the residuals 
+    # of all the years at once (n, 1) so the request does not grow with the number of years
+    coefficients = design.matrixSolve(ndvi)
+    residuals = ndvi.subtract(design.matrixMultiply(coefficients))
 
     # Fit a linear regression to the NDVI residuals
-    lf_trend = residual_yearly_ndvi.select(['year', 'ndvi_res']).reduce(ee.Reducer.linearFit())
+    fitted = years.arrayCat(residuals, 1).arrayReduce(trend_reducer(fit), [0], 1)
+    lf_trend = ee.Image.cat(fitted.arrayGet([0, 0]), fitted.arrayGet([0, 1])).rename(['scale', 'offset'])
 
     # Compute Kendall statistics
-    mk_trend = mann_kendall(residual_yearly_ndvi.select('ndvi_res'))
+    mk_trend = mann_kendall_array(residuals.arrayCat(years, 1))
     
     return (lf_trend, mk_trend)
 
-def ue_trend(start, end, ndvi_yearly_integration, climate_yearly_integration):
+def ue_trend(start, end, ndvi_yearly_integration, climate_yearly_integration, fit='ols'):
     """
     Calculate trend based on rain use efficiency.
     It is the ratio of ANPP(annual integral of NDVI as proxy) to annual precipitation.
@@ -364,19 +382,39 @@ def ue_trend(start, end, ndvi_yearly_integration, climate_yearly_integration):
     # TODO: Need to handle scaling for ET for WUE
     
     # Apply function to create image collection of ndvi and climate
-    ndvi_climate_yearly_integration = ndvi_climate_merge(climate_yearly_integration, nvdi_yearly_integration)
+    ndvi_climate_yearly_integration = ndvi_climate_merge(climate_yearly_integration, ndvi_yearly_integration, start, end)
     
     # Apply function to compute ue and store as a collection
     ue_yearly_collection = ndvi_climate_yearly_integration.map(use_efficiency)
 
     # Compute linear trend function to predict ndvi based on year (ndvi trend)
-    lf_trend = ue_yearly_collection.select(['year', 'ue']).reduce(ee.Reducer.linearFit())
+    lf_trend = trend_fit(ue_yearly_collection.select(['year', 'ue']), fit)
 
     # Compute Kendall statistics
     mk_trend = mann_kendall(ue_yearly_collection.select('ue'))
     
     return (lf_trend, mk_trend)
 
+def trend_fit(collection, fit='ols'):
+    """fit the second band of the collection against the first one, return the slope ('scale') and the intercept ('offset')
+    
+    Args:
+        collection (ee.ImageCollection): the (x, y) images
+        fit (str): 'ols' for a least square fit or 'theil_sen' for the median of the slopes of all the pairs of images
+    """
+    
+    return collection.reduce(trend_reducer(fit)).rename(['scale', 'offset'])
+
+def trend_reducer(fit='ols'):
+    """return the 2 inputs (x, y) reducer of the selected fit, its outputs are the slope and the intercept"""
+    
+    if fit == 'ols':
+        return ee.Reducer.linearFit()
+    elif fit == 'theil_sen':
+        return ee.Reducer.sensSlope()
+    
+    raise Exception(ms._15_3_1.error.trend_fit.format(fit, pm.trend_fits))
+
 ###########################
 #      kendall index      #
 ###########################
@@ -387,41 +425,69 @@ def mann_kendall(imageCollection):
     less than 40. The significance of a calculated S statistic is found in
     table A.30 of Nonparametric Statistical Methods, second edition by
     Hollander & Wolfe.
+    All the pairs are compared at once in (n, n) array images so the size of the 
+    request does not depend on n and no getInfo is needed. The images are ordered 
+    by their 'year' property and masked values are excluded pixel by pixel.
     Args:
         imageCollection: A Google Earth Engine image collection.
     Returns:
-        A Google Earth Engine image collection with Mann Kendall statistic for
+        A Google Earth Engine image with the Mann Kendall S statistic ('s'), 
+            its variance corrected for ties ('var') and the Z score ('z') for 
             each pixel.
     """
     
-    TimeSeriesList = imageCollection.toList(50)
+    # add the year as a second band with the same mask to keep the order of the series
+    def add_year(image):
+        year = ee.Image.constant(image.get('year')).float().updateMask(image.mask())
+        return image.float().addBands(year)
     
-    NumberOfItems = TimeSeriesList.length().getInfo()
-    ConcordantArray = []
-    DiscordantArray = []
-    for i in range(0, NumberOfItems - 1):
-        
-        CurrentImage = ee.Image(TimeSeriesList.get(i))
-        
-        for j in range(i + 1, NumberOfItems):
-            
-            nextImage = ee.Image(TimeSeriesList.get(j))
-            
-            Concordant = CurrentImage.lt(nextImage)
-            ConcordantArray.append(Concordant)
-            
-            Discordant = CurrentImage.gt(nextImage)
-            DiscordantArray.append(Discordant)
-            
-    ConcordantSum = ee.ImageCollection(ConcordantArray).sum()
-    DiscordantSum = ee.ImageCollection(DiscordantArray).sum()
+    # (n, 2) array per pixel
+    return mann_kendall_array(imageCollection.map(add_year).toArray())
+
+def mann_kendall_array(array):
+    """Mann Kendall's S statistic of an (n, 2) array image of the values and their years, see mann_kendall"""
+    
+    n = array.arrayLength(0)
     
-    MKSstat = ConcordantSum.subtract(DiscordantSum)
+    # (n, n) differences between all the pairs of values and years
+    values = array.arraySlice(1, 0, 1).arrayRepeat(1, n)
+    years = array.arraySlice(1, 1, 2).arrayRepeat(1, n)
+    value_diff = values.arrayTranspose().subtract(values)
+    year_diff = years.arrayTranspose().subtract(years)
     
-    return MKSstat
+    # each pair is seen twice in the matrix
+    MKSstat = value_diff.signum() \
+        .multiply(year_diff.signum()) \
+        .arrayReduce(ee.Reducer.sum(), [0, 1]) \
+        .arrayGet([0, 0]) \
+        .divide(2)
+    
+    # size of the group of ties of each value, sum(t(t-1)(2t+5)) over the groups 
+    # is sum((t_i-1)(2t_i+5)) over the values
+    ties = value_diff.eq(0).arrayReduce(ee.Reducer.sum(), [1])
+    ties_correction = ties.subtract(1) \
+        .multiply(ties.multiply(2).add(5)) \
+        .arrayReduce(ee.Reducer.sum(), [0]) \
+        .arrayGet([0, 0])
+    
+    MKSvar = n.multiply(n.subtract(1)).multiply(n.multiply(2).add(5)) \
+        .subtract(ties_correction) \
+        .divide(18)
+    
+    MKSz = ee.Image(0) \
+        .where(MKSstat.gt(0), MKSstat.subtract(1).divide(MKSvar.sqrt())) \
+        .where(MKSstat.lt(0), MKSstat.add(1).divide(MKSvar.sqrt()))
+    
+    return ee.Image.cat(MKSstat, MKSvar, MKSz).rename(['s', 'var', 'z'])
 
 def ndvi_climate_merge(climate_yearly_integration, nvdi_yearly_integration, start=None, end=None):
-    """Creat an ImageCollection of annual integral of NDVI and annual inegral of climate data"""
+    """Creat an ImageCollection of annual integral of NDVI and annual inegral of climate data, only the years from start to end if they are set"""
+    
+    # keep the years of the period
+    if start is not None and end is not None:
+        years_filter = ee.Filter.rangeContains('year', start, end)
+        climate_yearly_integration = climate_yearly_integration.filter(years_filter)
+        nvdi_yearly_integration = nvdi_yearly_integration.filter(years_filter)
     
     # create the filter to use in the join
     join_filter = ee.Filter.equals(
@@ -444,80 +510,449 @@ def ndvi_climate_merge(climate_yearly_integration, nvdi_yearly_integration, star
             .set('year', ee.Image(feature.get('clim')).get('year')) # both have the same year
     )
     
-    return joined
+    return ee.ImageCollection(joined)
 
-def ndvi_prediction_climate(image, linear_model):
-    """predict NDVI from climate. part of p_restrend function"""
+def use_efficiency(image):
+    """Function to creat rain use efficiency and store it as an imageCollection"""
+        
+    # the yearly ndvi and climate (in meters) of the merged image
+    year = image.get('year')
+    ndvi_img = image.select('ndvi')
+    clim_img = image.select('clim').divide(1000)
     
-    ndvi = linear_model \
-        .select('offset') \
-        .add(
-            linear_model \
-            .select('scale') \
-            .multiply(image.select('clim'))
-        ) \
-        .set({'year': image.get('year')})
+    divide_img = ndvi_img \
+        .divide(clim_img) \
+        .addBands(ee.Image.constant(year).float()) \
+        .rename(['ue', 'year']) \
+        .set({'year': year})
+
+    return divide_img
+
+###########################
+#      local backend      #
+###########################
+
+def productivity_trajectory_local(io, ndvi_int, climate_int):
+    """local equivalent of productivity_trajectory on yearly stacks of shape (years, rows, cols)"""
+    
+    years = np.arange(io.start, io.end + 1)
+    
+    # Run the selected algorithm
+    trajectories = [traj['value'] for traj in pm.trajectories]
+    
+    # nvi trend
+    if io.trajectory == trajectories[0]:
+        scale, mk_trend = ndvi_trend_local(years, ndvi_int, io.trend_fit)
+    # p restrend
+    elif io.trajectory == trajectories[1]:
+        scale, mk_trend = p_restrend_local(years, ndvi_int, climate_int, io.trend_fit)
+    # ue trend
+    elif io.trajectory == trajectories[3]:
+        scale, mk_trend = ue_trend_local(years, ndvi_int, climate_int, io.trend_fit)
+    elif io.trajectory in trajectories:
+        raise NameError(f'{io.trajectory} method not yet supported by the local backend')
+    else:
+        raise NameError(f'Unrecognized method "{io.trajectory}"')
+        
+    # Define Kendall parameter values for a significance of 0.05
+    period = io.end - io.start + 1
+    kendall90 = pm.get_kendall_coef(period, 90)
+    kendall95 = pm.get_kendall_coef(period, 95)
+    kendall99 = pm.get_kendall_coef(period, 99)
+    
+    # same cascade as the gee signif image, nan pixels stay at int_16_min
+    mk_abs = np.abs(mk_trend[0])
+    signif = np.full(scale.shape, pm.int_16_min, dtype=np.int32)
+    signif[(scale > 0) & (mk_abs >= kendall90)] = 1
+    signif[(scale > 0) & (mk_abs >= kendall95)] = 2
+    signif[(scale > 0) & (mk_abs >= kendall99)] = 3
+    signif[(scale < 0) & (mk_abs >= kendall90)] = -1
+    signif[(scale < 0) & (mk_abs >= kendall95)] = -2
+    signif[(scale < 0) & (mk_abs >= kendall99)] = -3
+    signif[mk_abs <= kendall90] = 0
+    signif[np.abs(scale) <= 10] = 0
+    
+    # use the bytes convention 
+    # 1 degraded - 2 stable - 3 improved
+    trajectory = np.zeros(scale.shape, dtype=np.uint8)
+    trajectory[signif > 0] = 3
+    trajectory[signif == 0] = 2
+    trajectory[(signif < 0) & (signif != pm.int_16_min)] = 1
     
-    return ndvi
+    return trajectory
 
-def ndvi_residuals(image, model):
-    """Function to compute residuals (ndvi obs - ndvi pred). part of p_restrend function"""
+def ecoregions_local(io, stacks, window, ndvi_int):
+    """compute the mean ndvi and the similar ecoregions codes of a window. part of productivity_performance_local
     
-    # get the year from image props
-    year = image.get('year')
+    Returns:
+        (ndvi_mean, similar_ecoregions, mask) (np.array): the mean ndvi, the ecoregion codes (nan if masked) and the pixels used in the percentile computation
+    """
+    
+    # land cover data from esa cci
+    lc_year_start = min(max(io.start, pm.lc_first_year), pm.lc_last_year)
+    lc = stacks['land_cover'].read(window, [stacks['land_cover'].index(f'y{lc_year_start}')])[0]
+    lc[lc == 9999] = np.nan
     
-    ndvi_o = image.select('ndvi')
+    # reclassify lc to ipcc classes
+    lc_reclass = remap(lc, pm.ESA_lc_classes, pm.reclassification_matrix)
+    
+    # global agroecological zones from IIASA
+    soil_tax_usda = stacks['soil_tax'].read(window, [0])[0]
+    
+    # compute mean ndvi for the period
+    ndvi_mean = nanmean(ndvi_int)
+    
+    # define unit of analysis as the intersect of soil_tax_usda and land cover
+    similar_ecoregions = soil_tax_usda * 100 + lc_reclass
     
-    ndvi_p = model.filter(ee.Filter.eq('year', year))
+    mask = (ndvi_mean != 0) & ~np.isnan(ndvi_mean) & ~np.isnan(similar_ecoregions)
+    
+    return (ndvi_mean, similar_ecoregions, mask)
+
+def productivity_performance_local(ndvi_mean, similar_ecoregions, percentile_90):
+    """local equivalent of productivity_performance
+    
+    Args:
+        ndvi_mean, similar_ecoregions (np.array): outputs of ecoregions_local
+        percentile_90 (dict): the 90th percentile of the mean ndvi indexed by ecoregion code
+    """
+    
+    # remap the similar ecoregion raster using their 90th percentile value
+    ecoregion_perc90 = remap(similar_ecoregions, list(percentile_90.keys()), list(percentile_90.values()), np.float64)
+    
+    # compute the ratio of observed ndvi to 90th for that class
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed_ratio = ndvi_mean / ecoregion_perc90
+    
+    prod_performance = np.zeros(ndvi_mean.shape, dtype=np.uint8)
+    prod_performance[observed_ratio >= 0.5] = 2
+    prod_performance[observed_ratio <= 0.5] = 1
+    
+    return prod_performance
+
+class HistogramSketch(object):
+    """mergeable approximation of the quantiles of the values of each group (ecoregion), local equivalent of the grouped fixedHistogram
     
-    ndvi_r = ee.Image(year) \
-        .float() \
-        .addBands(ndvi_o.subtract(ndvi_p)) \
-        .rename(['year', 'ndvi_res'])
+    Each group keeps a fixed histogram over pm.ndvi_range so the memory is proportional to the number of groups, not to the number of values.
+    
+    Args:
+        error (float): the maximum error of the quantiles
+    """
+    
+    def __init__(self, error):
         
-    return ndvi_r
-
-#def ndvi_residuals(year, ndvi_climate_yearly_integration, predicted_yearly_ndvi):
-#    """Function to compute residuals (ndvi obs - ndvi pred). part of p_restrend function"""
-#    
-#    ndvi_o = ndvi_climate_yearly_integration \
-#        .filter(ee.Filter.eq('year', year)) \
-#        .select('ndvi') \
-#        .median() # I assume there is only one
-#    
-#    ndvi_p = predicted_yearly_ndvi \
-#        .filter(ee.Filter.eq('year', year)) \
-#        .median() # I assume there is only one
-#    
-#    ndvi_r = ee.Image(year) \
-#        .float() \
-#        .addBands(ndvi_o.subtract(ndvi_p))
-#    
-#    return ndvi_r.rename(['year', 'ndvi_res'])
-
-def image_collection_residuals(start, end, ndvi_climate_yearly_integration, predicted_yearly_ndvi):
-    """Function to create image collection of residuals. part of p_restrend function"""
+        self.steps, self.width = histogram_bins(error)
+        self.counts = {}
         
-    res_list = ee.List([])
-    for year in range(start, end + 1):
+    def update(self, groups, values):
+        """add the values (1-D) of each group (1-D, same shape) to the sketch"""
+        
+        codes, inverse = np.unique(groups, return_inverse=True)
+        bins = np.clip(((values - pm.ndvi_range[0]) // self.width).astype(np.int64), 0, self.steps - 1)
+        counts = np.bincount(inverse.ravel() * self.steps + bins, minlength=len(codes) * self.steps).reshape(len(codes), self.steps)
+        
+        for code, count in zip(codes, counts):
+            self.counts[code] = self.counts[code] + count if code in self.counts else count
             
-        res_image = ndvi_residuals(year, ndvi_climate_yearly_integration, predicted_yearly_ndvi)
+        return self
+    
+    def merge(self, other):
+        """add the counts of another sketch"""
         
-        res_list = res_list.add(res_image)
+        for code, count in other.counts.items():
+            self.counts[code] = self.counts[code] + count if code in self.counts else count.copy()
+            
+        return self
+    
+    def quantile(self, percentile):
+        """return the middle of the bin that holds the percentile (nearest rank) of each group"""
         
-    return ndvi_r
+        quantiles = {}
+        for code, count in self.counts.items():
+            cumulative = np.cumsum(count)
+            index = np.argmax(cumulative >= cumulative[-1] * percentile / 100)
+            quantiles[code] = pm.ndvi_range[0] + (index + 0.5) * self.width
+            
+        return quantiles
 
-def use_efficiency(image):
-    """Function to creat rain use efficiency and store it as an imageCollection"""
+def exact_percentile_local(values, percentile, max_values=pm.exact_percentile_max_values):
+    """exact percentile of the values of each group (ecoregion), local equivalent of the grouped percentile reducer
+    
+    All the values are kept in memory, so above max_values they are moved to a HistogramSketch of pm.percentile_error 
+    and the rest of the values are only counted in it.
+    
+    Args:
+        values (iterable): the (groups, values) 1-D arrays of each window
         
-    # extract climate and ndvi median values
-    ndvi_img = image.select('ndvi').median()
-    clim_img = image.select('clim').median().divide(1000)
+    Returns:
+        (quantiles, exact) (dict, bool): the percentile of each group and False if it was approximated
+    """
     
-    divide_img = ndvi_img \
-        .divide(clim_img) \
-        .addBands(ee.Image(year)) \
-        .rename(['ue', 'year']) \
-        .set({'year': year})
+    kept, n_values, sketch = {}, 0, None
+    for groups, group_values in values:
+        
+        if sketch is None and n_values + group_values.size > max_values:
+            sketch = HistogramSketch(pm.percentile_error)
+            for code, code_values in kept.items():
+                code_values = np.concatenate(code_values)
+                sketch.update(np.full(code_values.shape, code), code_values)
+            kept = {}
+            
+        if sketch is not None:
+            sketch.update(groups, group_values)
+            continue
+            
+        for code in np.unique(groups):
+            kept.setdefault(code, []).append(group_values[groups == code])
+        n_values += group_values.size
+        
+    if sketch is not None:
+        return (sketch.quantile(percentile), False)
+    
+    return ({code: np.percentile(np.concatenate(code_values), percentile) for code, code_values in kept.items()}, True)
+
+def productivity_state_local(io, ndvi_int):
+    """local equivalent of productivity_state on a yearly ndvi stack of shape (years, rows, cols)"""
+    
+    years = np.arange(io.start, io.end + 1)
+    baseline_ndvi = ndvi_int[(years >= io.start) & (years <= io.baseline_end)]
+    target_ndvi = ndvi_int[(years >= io.target_start) & (years <= io.end)]
+    
+    # add two bands to the time series: one 5% lower than min and one 5% higher than max
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        baseline_min = np.nanmin(baseline_ndvi, axis=0)
+        baseline_max = np.nanmax(baseline_ndvi, axis=0)
+    baseline_ndvi_5p = (baseline_max - baseline_min) * 0.05
+    
+    baseline_ndvi_extended = np.concatenate([
+        baseline_ndvi,
+        (baseline_min - baseline_ndvi_5p)[None],
+        (baseline_max + baseline_ndvi_5p)[None]
+    ])
+    
+    # compute percentiles of annual ndvi for the extended baseline period
+    percentiles = [10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+    baseline_ndvi_perc = nanpercentile_local(baseline_ndvi_extended, percentiles)
+    
+    # compute mean ndvi for the baseline and target period period
+    ndvi_means = np.stack([nanmean(baseline_ndvi), nanmean(target_ndvi)])
+    
+    # reclassify both mean ndvi based on the percentiles in a single pass
+    baseline_classes, target_classes = percentile_classes_local(ndvi_means, baseline_ndvi_perc)
+    baseline_ndvi_mean, target_ndvi_mean = ndvi_means
+    
+    # difference between start and end clusters >= 2 means improvement (<= -2 
+    # is degradation)
+    classes_change = target_classes - baseline_classes
+    classes_change[np.abs(baseline_ndvi_mean - target_ndvi_mean) <= 100] = 0
+    
+    # reclassification to get the degredation classes
+    # use the bytes convention 
+    # 1 degraded - 2 stable - 3 improved
+    degredation = np.full(classes_change.shape, pm.int_16_min, dtype=np.int32)
+    degredation[classes_change >= 2] = 3
+    degredation[(classes_change <= -2) & (classes_change != pm.int_16_min)] = 1
+    degredation[(classes_change < 2) & (classes_change > -2)] = 2
+    
+    return to_uint8(degredation)
+
+def percentile_classes_local(ndvi_mean, ndvi_perc):
+    """classify the mean ndvi in the 10 percentile classes, nan pixels are set to int_16_min. part of productivity_state_local
+    
+    The percentiles are sorted so the class is 1 + the number of percentiles (p10 to p90) below the mean (searchsorted on each pixel).
+    
+    Args:
+        ndvi_mean (np.array): the mean ndvi of shape (rows, cols) or a stack of them (n, rows, cols)
+        ndvi_perc (np.array): the 10 percentiles of shape (10, rows, cols)
+    """
+    
+    edges = ndvi_perc[:9]
+    if ndvi_mean.ndim == 3:
+        edges = edges[:, None]
+    
+    classes = (ndvi_mean[None] > edges).sum(axis=0, dtype=np.int32) + 1
+    classes[np.isnan(ndvi_mean) | np.isnan(ndvi_perc[0])] = pm.int_16_min
+        
+    return classes
+
+def nanpercentile_local(stack, percentiles, axis=0):
+    """np.nanpercentile(stack, percentiles, axis=axis) with a partial selection (np.partition) of the needed ranks instead of a full sort
+    
+    The pixels are grouped by their number of valid values so that they share the same ranks, 
+    the values of each pixel are gathered contiguously before the selection.
+    """
+    
+    stack = np.moveaxis(stack, axis, -1)
+    valid = (~np.isnan(stack)).sum(axis=-1)
+    fractions = np.asarray(percentiles) / 100
+    
+    result = np.full((len(percentiles),) + stack.shape[:-1], np.nan, dtype=stack.dtype)
+    for n in np.unique(valid[valid > 0]):
+        pixels = valid == n
+        
+        # linear interpolation between the 2 closest ranks, as np.percentile
+        positions = (n - 1) * fractions
+        low = np.floor(positions).astype(int)
+        high = np.ceil(positions).astype(int)
+        weight = positions - low
+        
+        values = stack[pixels]
+        values[np.isnan(values)] = np.inf
+        values.partition(np.unique(np.concatenate([low, high])), axis=-1)
+        result[:, pixels] = (values[:, low] * (1 - weight) + values[:, high] * weight).T
+        
+    return result
+
+def productivity_final_local(trajectory, performance, state, table):
+    """local equivalent of productivity_final"""
+    
+    return np.asarray(table, dtype=np.uint8)[trajectory, state, performance]
+
+def ndvi_trend_local(years, ndvi_int, fit='ols'):
+    """local equivalent of ndvi_trend, return the slope of the linear fit and the Mann Kendall's S statistic"""
+    
+    scale, _ = trend_fit_local(years, ndvi_int, fit)
+    mk_trend = mann_kendall_local(ndvi_int)
+    
+    return (scale, mk_trend)
+
+def p_restrend_local(years, ndvi_int, climate_int, fit='ols'):
+    """local equivalent of p_restrend, return the slope of the fit of the residuals and their Mann Kendall's S statistic
+    
+    The ndvi is fitted against the climate pixel by pixel and the residuals of all the years are computed in a single pass on the stack.
+    """
+    
+    scale, offset = linear_fit_local(climate_int, ndvi_int)
+    residuals = ndvi_int - (offset + scale * climate_int)
+    
+    res_scale, _ = trend_fit_local(years, residuals, fit)
+    mk_trend = mann_kendall_local(residuals)
+    
+    return (res_scale, mk_trend)
+
+def ue_trend_local(years, ndvi_int, climate_int, fit='ols'):
+    """local equivalent of ue_trend, return the slope of the linear fit and the Mann Kendall's S statistic"""
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ue = ndvi_int / (climate_int / 1000)
+    ue[~np.isfinite(ue)] = np.nan
+    
+    scale, _ = trend_fit_local(years, ue, fit)
+    mk_trend = mann_kendall_local(ue)
+    
+    return (scale, mk_trend)
+
+def trend_fit_local(x, y, fit='ols'):
+    """local equivalent of trend_fit on a stack y of shape (years, rows, cols)"""
+    
+    if fit == 'ols':
+        return linear_fit_local(x, y)
+    elif fit == 'theil_sen':
+        return theil_sen_local(x, y)
+    
+    raise Exception(ms._15_3_1.error.trend_fit.format(fit, pm.trend_fits))
 
-    return divide_img
\ No newline at end of file
+def linear_fit_local(x, y):
+    """per pixel least square fit of y (years, rows, cols) against x (years) or (years, rows, cols), nan values are ignored
+    
+    The closed form is computed from running sums over the years accumulated in float32, 
+    x is centered so that the sums of squares don't lose the precision of the slope.
+    
+    Returns:
+        (scale, offset) (np.array): the slope and the intercept of the fit
+    """
+    
+    x = np.asarray(x, dtype=np.float32)
+    x = x.reshape(x.shape + (1,) * (y.ndim - x.ndim))
+    x_mean = nanmean(x)
+    
+    n, sx, sy, sxx, sxy = (np.zeros(y.shape[1:], dtype=np.float32) for _ in range(5))
+    for xi, yi in zip(x - x_mean, y):
+        valid = ~np.isnan(xi) & ~np.isnan(yi)
+        xi = np.where(valid, xi, 0).astype(np.float32, copy=False)
+        yi = np.where(valid, yi, 0).astype(np.float32, copy=False)
+        n += valid
+        sx += xi
+        sy += yi
+        sxx += xi * xi
+        sxy += xi * yi
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        offset = (sy - scale * sx) / n - scale * x_mean
+    
+    return (scale, offset)
+
+def theil_sen_local(x, y, chunk=pm.theil_sen_chunk):
+    """per pixel Theil-Sen fit of y (years, rows, cols) against x (years), nan values are ignored
+    
+    The slope is the median of the slopes of all the pairs of years and the intercept the median of y - slope * x (as ee.Reducer.sensSlope).
+    The (pixels, pairs) slopes are computed chunk by chunk of pixels to bound the memory.
+    
+    Returns:
+        (scale, offset) (np.array): the slope and the intercept of the fit
+    """
+    
+    x = np.asarray(x, dtype=np.float32)
+    n = len(x)
+    
+    # (pixels, years) so that the pairs of a pixel are contiguous
+    shape = y.shape[1:]
+    y = y.reshape(len(x), -1).T
+    
+    scale = np.full(y.shape[0], np.nan, dtype=np.float32)
+    offset = np.full(y.shape[0], np.nan, dtype=np.float32)
+    for start in range(0, y.shape[0], chunk):
+        pixels = slice(start, start + chunk)
+        values = np.ascontiguousarray(y[pixels], dtype=np.float32)
+        
+        # slopes of the pairs of years lag by lag, the pairs with a masked year are nan and ignored by the median
+        slopes = np.empty((len(values), n * (n - 1) // 2), dtype=np.float32)
+        position = 0
+        for lag in range(1, n):
+            slopes[:, position: position + n - lag] = (values[:, lag:] - values[:, :-lag]) / (x[lag:] - x[:-lag])
+            position += n - lag
+        
+        scale[pixels] = nanpercentile_local(slopes, [50], axis=1)[0]
+        offset[pixels] = nanpercentile_local(values - scale[pixels, None] * x, [50], axis=1)[0]
+    
+    return (scale.reshape(shape), offset.reshape(shape))
+
+def mann_kendall_local(stack):
+    """local equivalent of mann_kendall on a stack of shape (years, rows, cols), nan values are ignored
+    
+    The pairs are compared one year against all the following ones so the memory stays in O(years x rows x cols).
+    
+    Returns:
+        mk_trend (np.array): the S statistic, its variance corrected for ties and the Z score stacked in a (3, rows, cols) array
+    """
+    
+    valid = ~np.isnan(stack)
+    n = valid.sum(axis=0)
+    
+    mk_stat = np.zeros(stack.shape[1:], dtype=np.float64)
+    ties = valid.astype(np.float64)
+    
+    for i in range(stack.shape[0] - 1):
+        diff = stack[i + 1:] - stack[i]
+        mk_stat += np.nansum(np.sign(diff), axis=0)
+        
+        # count each tie for both values of the pair
+        equal = diff == 0
+        ties[i] += equal.sum(axis=0)
+        ties[i + 1:] += equal
+        
+    # sum(t(t-1)(2t+5)) over the groups of ties is sum((t_i-1)(2t_i+5)) over the values
+    ties_correction = np.where(valid, (ties - 1) * (2 * ties + 5), 0).sum(axis=0)
+    mk_var = (n * (n - 1) * (2 * n + 5) - ties_correction) / 18
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mk_z = np.where(mk_stat > 0, (mk_stat - 1) / np.sqrt(mk_var), 0)
+        mk_z = np.where(mk_stat < 0, (mk_stat + 1) / np.sqrt(mk_var), mk_z)
+        
+    # pixels without any valid pair are masked
+    mk_trend = np.stack([mk_stat, mk_var, mk_z])
+    mk_trend[:, n < 2] = np.nan
+    
+    return mk_trend
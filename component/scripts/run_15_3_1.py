@@ -1,38 +1,51 @@
 from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor
 import time
 
 import ee
-import geemap
-from ipywidgets import Output
+import numpy as np
 import ipyvuetify as v
-import geopandas as gpd
-import pandas as pd
 
 from component import parameter as pm
 from component.message import ms 
 
 from .gdrive import gdrive
-from .gee import wait_for_completion
-from .download import digest_tiles
+from .gee import wait_for_completion, init_ee
+from .stack import open_stacks, map_windows
+from .cache import result_cache
+from .graph import GraphReport
+from .trace import tracer, traced
 from .integration import * 
 from .productivity import *
 from .soil_organic_carbon import *
 from .land_cover import *
 
-ee.Initialize()
-
+@traced('download_maps')
 def download_maps(aoi_io, io, output):
     
+    # the local backend already wrote the maps in the result directory
+    if io.backend == 'local':
+        return (io.land_cover, io.soc, io.productivity, io.indicator_15_3_1)
+    
+    # rasterio and matplotlib are only loaded when the maps are downloaded
+    from .download import digest_tiles
+    
+    init_ee()
+    
     # get the export scale 
     scale = 10 if 'Sentinel 2' in io.sensors else 30
     
     output.add_live_msg(ms.download.start_download)
+    
+    # the tasks and the files are named after the parameters so that 2 scenarios never share them
+    result_dir = result_cache.get_dir(aoi_io, io, io.cache_key)
+    name = result_cache.name(aoi_io, io.cache_key)
         
     # create the export path
-    land_cover_desc = f'{aoi_io.get_aoi_name()}_land_cover'
-    soc_desc = f'{aoi_io.get_aoi_name()}_soc'
-    productivity_desc = f'{aoi_io.get_aoi_name()}_productivity'
-    indicator_desc = f'{aoi_io.get_aoi_name()}_indicator_15_3_1'
+    land_cover_desc = f'{name}_land_cover'
+    soc_desc = f'{name}_soc'
+    productivity_desc = f'{name}_productivity'
+    indicator_desc = f'{name}_indicator_15_3_1'
         
     # load the drive_handler
     drive_handler = gdrive()
@@ -50,44 +63,73 @@ def download_maps(aoi_io, io, output):
         productivity = io.productivity
         indicator = io.indicator_15_3_1
         
-    # download all files
-    downloads = drive_handler.download_to_disk(land_cover_desc, land_cover, aoi_io, output)
-    downloads = drive_handler.download_to_disk(soc_desc, soc, aoi_io, output)
-    downloads = drive_handler.download_to_disk(productivity_desc, productivity, aoi_io, output)
-    downloads = drive_handler.download_to_disk(indicator_desc, indicator, aoi_io, output)
-        
-    # I assume that they are always launch at the same time 
-    # If not it's going to crash
-    if downloads:
-        wait_for_completion([land_cover_desc, soc_desc, productivity_desc, indicator_desc], output)
-    output.add_live_msg(ms.gee.tasks_completed, 'success') 
-    
-    # create merge names 
-    land_cover_merge = pm.result_dir.joinpath(f'{land_cover_desc}_merge.tif')
-    soc_merge = pm.result_dir.joinpath(f'{soc_desc}_merge.tif')
-    productivity_merge = pm.result_dir.joinpath(f'{productivity_desc}_merge.tif')
-    indicator_merge = pm.result_dir.joinpath(f'{indicator_desc}_merge.tif')
-    
-    # digest the tiles
-    digest_tiles(aoi_io, land_cover_desc, pm.result_dir, output, land_cover_merge)
-    digest_tiles(aoi_io, soc_desc, pm.result_dir, output, soc_merge)
-    digest_tiles(aoi_io, productivity_desc, pm.result_dir, output, productivity_merge)
-    digest_tiles(aoi_io, indicator_desc, pm.result_dir, output, indicator_merge)
-        
-    output.add_live_msg(ms.download.remove_gdrive)
-    # remove the files from drive
-    drive_handler.delete_files(drive_handler.get_files(land_cover_desc))
-    drive_handler.delete_files(drive_handler.get_files(soc_desc))
-    drive_handler.delete_files(drive_handler.get_files(productivity_desc))
-    drive_handler.delete_files(drive_handler.get_files(indicator_desc))
+    images = {
+        land_cover_desc: land_cover,
+        soc_desc: soc,
+        productivity_desc: productivity,
+        indicator_desc: indicator
+    }
+    
+    # create merge names, they don't need the hash as they are already in the folder of the parameters
+    aoi_name = aoi_io.get_aoi_name()
+    land_cover_merge = result_dir.joinpath(f'{aoi_name}_land_cover_merge.tif')
+    soc_merge = result_dir.joinpath(f'{aoi_name}_soc_merge.tif')
+    productivity_merge = result_dir.joinpath(f'{aoi_name}_productivity_merge.tif')
+    indicator_merge = result_dir.joinpath(f'{aoi_name}_indicator_15_3_1_merge.tif')
+    
+    merges = {
+        land_cover_desc: land_cover_merge,
+        soc_desc: soc_merge,
+        productivity_desc: productivity_merge,
+        indicator_desc: indicator_merge
+    }
+    
+    # stack the layers in a single image that will be split in the same merge files once downloaded
+    splits = {}
+    if io.single_export:
+        stack_desc = f'{name}_15_3_1'
+        splits = {stack_desc: [merges[desc] for desc in images]}
+        merges = {stack_desc: result_dir.joinpath(f'{stack_desc}_merge.tif')}
+        images = {stack_desc: ee.Image.cat(*images.values()).rename([*images])}
+        
+    # launch all the exports, the layers that are not running are already in the drive
+    running = [desc for desc, image in images.items() if drive_handler.download_to_disk(desc, image, aoi_io, output)]
+    
+    # each layer is downloaded, merged and removed from the drive as soon as its own export is completed
+    with ThreadPoolExecutor(pm.digest_max_workers) as digest_pool, ThreadPoolExecutor(1) as delete_pool:
+        
+        def digest(desc):
+            digest_tiles(aoi_io, desc, result_dir, output, merges[desc], splits.get(desc))
+            return delete_pool.submit(lambda: drive_handler.delete_files(drive_handler.get_files(desc)))
+        
+        digests = [digest_pool.submit(digest, desc) for desc in images if desc not in running]
         
+        states = {}
+        if running:
+            def on_final_state(desc, state):
+                if state == 'COMPLETED':
+                    digests.append(digest_pool.submit(digest, desc))
+            states = wait_for_completion(running, output, on_final_state)
+            
+        # raise the errors of the pipeline if any
+        [future.result().result() for future in digests]
+    
+    failed = [desc for desc, state in states.items() if state != 'COMPLETED']
+    if failed:
+        raise Exception(ms.gee.error.failed.format(', '.join(failed)))
+    
+    result_cache.touch(io.cache_key)
+    
     #display msg 
     output.add_live_msg(ms.download.completed, 'success')
 
     return (land_cover_merge, soc_merge, productivity_merge, indicator_merge)
 
+@traced('display_maps')
 def display_maps(aoi_io, io, m, output):
     
+    init_ee()
+    
     m.zoom_ee_object(aoi_io.get_aoi_ee().geometry())
     
     # get the geometry to clip on 
@@ -115,61 +157,197 @@ def display_maps(aoi_io, io, m, output):
     
     return 
 
+@traced('compute_indicator_maps')
 def compute_indicator_maps(aoi_io, io, output):
     
     # raise an error if the years are not in the rigth order 
     if not (io.start <io.baseline_end <= io.target_start < io.end):
         raise Exception(ms._15_3_1.error.wrong_year)
     
+    if io.backend == 'gee':
+        init_ee()
+    
+    # identify the results of this set of parameters
+    io.cache_key = result_cache.key(aoi_io, io)
+    
+    if io.backend == 'local':
+        return compute_indicator_maps_local(aoi_io, io, output)
+    
+    # each stage is measured so that a request too big to be computed fails before any task is submitted
+    report = GraphReport()
+    io.graph_report = report.stages
+    
     # compute intermediary maps 
-    ndvi_int, climate_int = integrate_ndvi_climate(aoi_io, io, output)
-    prod_trajectory = productivity_trajectory(io, ndvi_int, climate_int, output)
-    prod_performance = productivity_performance(aoi_io, io, ndvi_int, climate_int, output)
-    prod_state = productivity_state(aoi_io, io, ndvi_int, climate_int, output) 
+    ndvi_int, climate_int = report.run(['ndvi_int', 'climate_int'], integrate_ndvi_climate, aoi_io, io, output)
+    prod_trajectory = report.run('trajectory', productivity_trajectory, io, ndvi_int, climate_int, output)
+    prod_performance = report.run('performance', productivity_performance, aoi_io, io, ndvi_int, climate_int, output)
+    prod_state = report.run('state', productivity_state, aoi_io, io, ndvi_int, climate_int, output) 
     
     # compute result maps 
-    io.land_cover = land_cover(io, aoi_io, output)
-    io.soc = soil_organic_carbon(io, aoi_io, output)
-    io.productivity = productivity_final(prod_trajectory, prod_performance, prod_state, output)
+    io.land_cover = report.run('land_cover', land_cover, io, aoi_io, output)
+    io.soc = report.run('soc', soil_organic_carbon, io, aoi_io, output)
+    io.productivity = report.run('productivity', productivity_final, prod_trajectory, prod_performance, prod_state, io.productivity_table, output)
     
     # sump up in a map
-    io.indicator_15_3_1 = indicator_15_3_1(io.productivity, io.land_cover, io.soc, output)
+    io.indicator_15_3_1 = report.run('indicator', indicator_15_3_1, io.productivity, io.land_cover, io.soc, output)
+    
+    output.add_live_msg(report.to_msg())
 
     return 
 
+def compute_indicator_maps_local(aoi_io, io, output):
+    """compute the maps window by window on the local stacks of the io and write them in the result directory"""
+    
+    # create the outputs with the same names as the downloaded maps 
+    result_dir = result_cache.get_dir(aoi_io, io, io.cache_key)
+    layers = ['land_cover', 'soc', 'productivity', 'indicator_15_3_1']
+    paths = {layer: result_dir.joinpath(f'{aoi_io.get_aoi_name()}_{layer}_merge.tif') for layer in layers}
+    
+    # the same parameters have already been computed
+    if all(path.is_file() for path in paths.values()):
+        output.add_live_msg(ms.download.file_exist.format(result_dir), 'warning')
+    else:
+        _write_indicator_maps_local(io, paths, output)
+    
+    io.land_cover = paths['land_cover']
+    io.soc = paths['soc']
+    io.productivity = paths['productivity']
+    io.indicator_15_3_1 = paths['indicator_15_3_1']
+    
+    result_cache.touch(io.cache_key)
+    
+    output.add_live_msg(ms.local.completed.format(result_dir), 'success')
+    
+    return
+
+def _write_indicator_maps_local(io, paths, output):
+    """compute the 4 maps in 2 passes on the local stacks and write them in paths"""
+    
+    import rasterio as rio
+    from .download import get_colormap, to_cog
+    
+    stacks = open_stacks(io)
+    windows = list(stacks['ndvi'].windows())
+    
+    # first pass: 90th percentile of the mean ndvi per similar ecoregion
+    def ecoregion_values(window):
+        ndvi_int, _ = integrate_ndvi_climate_local(io, stacks, window)
+        ndvi_mean, similar_ecoregions, mask = ecoregions_local(io, stacks, window, ndvi_int)
+        
+        # the approximate percentile only needs the histograms of the window
+        if io.percentile_error:
+            return HistogramSketch(io.percentile_error).update(similar_ecoregions[mask], ndvi_mean[mask])
+        
+        return (similar_ecoregions[mask], ndvi_mean[mask])
+    
+    output.add_live_msg(ms.local.percentile)
+    if io.percentile_error:
+        sketch = HistogramSketch(io.percentile_error)
+        for window, window_sketch in map_windows(ecoregion_values, windows):
+            sketch.merge(window_sketch)
+        percentile_90 = sketch.quantile(90)
+    else:
+        values = (window_values for window, window_values in map_windows(ecoregion_values, windows))
+        percentile_90, exact = exact_percentile_local(values, 90)
+        if not exact:
+            output.add_live_msg(ms.local.percentile_approx.format(pm.exact_percentile_max_values, pm.percentile_error), 'warning')
+    
+    # second pass: compute all the maps
+    def indicator_maps(window):
+        ndvi_int, climate_int = integrate_ndvi_climate_local(io, stacks, window)
+        prod_trajectory = productivity_trajectory_local(io, ndvi_int, climate_int)
+        ndvi_mean, similar_ecoregions, _ = ecoregions_local(io, stacks, window, ndvi_int)
+        prod_performance = productivity_performance_local(ndvi_mean, similar_ecoregions, percentile_90)
+        prod_state = productivity_state_local(io, ndvi_int)
+        
+        maps = {}
+        maps['land_cover'] = land_cover_local(io, stacks, window)
+        maps['soc'] = soil_organic_carbon_local(io, stacks, window)
+        maps['productivity'] = productivity_final_local(prod_trajectory, prod_performance, prod_state, io.productivity_table)
+        maps['indicator_15_3_1'] = indicator_15_3_1_local(maps['productivity'], maps['land_cover'], maps['soc'])
+        
+        return maps
+    
+    dsts = {layer: rio.open(path, 'w', **stacks['ndvi'].profile()) for layer, path in paths.items()}
+    
+    # the windows are computed in parallel and written one by one
+    try:
+        for i, (window, maps) in enumerate(map_windows(indicator_maps, windows)):
+            output.add_live_msg(ms.local.window.format(i + 1, len(windows)))
+            for layer, data in maps.items():
+                dsts[layer].write(data, 1, window=window)
+                
+    finally:
+        for dst in dsts.values():
+            dst.write_colormap(1, get_colormap())
+            dst.close()
+        [stack.close() for stack in stacks.values()]
+    
+    [to_cog(path) for path in paths.values()]
+    
+    return 
+
+@traced('compute_zonal_analysis')
 def compute_zonal_analysis(aoi_io, io, output):
     
-    indicator_stats = pm.result_dir.joinpath(f'{aoi_io.get_aoi_name()}_indicator_15_3_1')
+    # the libs of the statistics are heavy, they are only loaded when needed
+    import geopandas as gpd
+    import pandas as pd
+    from ipywidgets import Output
+    from .zonal import zonal_statistics_local
+    
+    result_dir = result_cache.get_dir(aoi_io, io, io.cache_key)
+    indicator_stats = result_dir.joinpath(f'{aoi_io.get_aoi_name()}_indicator_15_3_1')
     
     #check if the file already exist
     indicator_zip = indicator_stats.with_suffix('.zip')
     if indicator_zip.is_file():
         output.add_live_msg(ms.download.already_exist.format(indicator_zip), 'warning')
+        result_cache.touch(io.cache_key)
         time.sleep(2)
         return indicator_zip
         
-    output_widget = Output()
-    output.add_msg(output_widget)
-        
-    indicator_csv = indicator_stats.with_suffix('.csv') # to be removed when moving to shp
-    scale = 100 if 'Sentinel 2' in io.sensors else 300
-    with output_widget:
-        geemap.zonal_statistics_by_group(
-            in_value_raster = io.indicator_15_3_1,
-            in_zone_vector = aoi_io.get_aoi_ee(),
-            out_file_path = indicator_csv,
-            statistics_type = "SUM",
-            denominator = 1000000,
-            decimal_places = 2,
-            scale = scale,
-            tile_scale = 1.0
-        )
+    # the local backend never talks to gee, its aoi is read from the disk
+    if io.backend == 'local':
+        if not io.local_aoi:
+            raise Exception(ms.local.error.no_aoi)
+        aoi_gdf = gpd.read_file(io.local_aoi).to_crs('EPSG:4326')
+    else:
+        import geemap
+        init_ee()
+        aoi_json = geemap.ee_to_geojson(aoi_io.get_aoi_ee())
+        aoi_gdf = gpd.GeoDataFrame.from_features(aoi_json).set_crs('EPSG:4326')
+    
+    # the merged indicator is on the disk with the local backend or once the maps are downloaded
+    indicator_merge = result_dir.joinpath(f'{aoi_io.get_aoi_name()}_indicator_15_3_1_merge.tif')
+    if indicator_merge.is_file():
+        output.add_live_msg(ms._15_3_1.local_stats)
+        zone_file = result_dir.joinpath(f'{aoi_io.get_aoi_name()}_zones.tif')
+        areas = zonal_statistics_local(indicator_merge, aoi_gdf, zone_file)
+        indicator_df = pd.DataFrame(areas.round(2), columns=[f'Class_{i}' for i in range(areas.shape[1])])
+    else:
+        import geemap
+        output_widget = Output()
+        output.add_msg(output_widget)
+        
+        indicator_csv = indicator_stats.with_suffix('.csv') # to be removed when moving to shp
+        scale = 100 if 'Sentinel 2' in io.sensors else 300
+        with output_widget:
+            geemap.zonal_statistics_by_group(
+                in_value_raster = io.indicator_15_3_1,
+                in_zone_vector = aoi_io.get_aoi_ee(),
+                out_file_path = indicator_csv,
+                statistics_type = "SUM",
+                denominator = 1000000,
+                decimal_places = 2,
+                scale = scale,
+                tile_scale = 1.0
+            )
+            
+        indicator_df = pd.read_csv(indicator_csv)
+        
     # this should be removed once geemap is repaired
     #########################################################################
-    aoi_json = geemap.ee_to_geojson(aoi_io.get_aoi_ee())
-    aoi_gdf = gpd.GeoDataFrame.from_features(aoi_json).set_crs('EPSG:4326')
-    
-    indicator_df = pd.read_csv(indicator_csv)
     if 'Class_0' in indicator_df.columns:
         aoi_gdf['NoData'] = indicator_df['Class_0']
     if 'Class_3' in indicator_df.columns:
@@ -191,49 +369,41 @@ def compute_zonal_analysis(aoi_io, io, output):
             file = indicator_stats.with_suffix(suffix)
             myzip.write(file, file.name)
             
+    result_cache.touch(io.cache_key)
+    
     output.add_live_msg(ms._15_3_1.stats_complete.format(indicator_zip), 'success')
         
     return indicator_zip
     
+def write_trace(aoi_io, io):
+    """write the spans of the run in a Chrome trace file next to the results"""
+    
+    result_dir = result_cache.get_dir(aoi_io, io, io.cache_key)
+    trace = tracer.write(result_dir.joinpath(f'{aoi_io.get_aoi_name()}_trace.json'))
+    result_cache.touch(io.cache_key)
+    
+    return trace
+    
 def indicator_15_3_1(productivity, landcover, soc, output):
+    """combine the 3 sub-indicators with a single remap on pm.indicator_table"""
     
-
-    indicator = ee.Image(0) \
-    .where(productivity.eq(3).And(landcover.eq(3)).And(soc.eq(3)),3) \
-    .where(productivity.eq(3).And(landcover.eq(3)).And(soc.eq(2)),3) \
-    .where(productivity.eq(3).And(landcover.eq(3)).And(soc.eq(1)),1) \
-    .where(productivity.eq(3).And(landcover.eq(2)).And(soc.eq(3)),3) \
-    .where(productivity.eq(3).And(landcover.eq(2)).And(soc.eq(2)),3) \
-    .where(productivity.eq(3).And(landcover.eq(2)).And(soc.eq(1)),1) \
-    .where(productivity.eq(3).And(landcover.eq(1)).And(soc.eq(3)),1) \
-    .where(productivity.eq(3).And(landcover.eq(1)).And(soc.eq(2)),1) \
-    .where(productivity.eq(3).And(landcover.eq(1)).And(soc.eq(1)),1) \
-    .where(productivity.eq(2).And(landcover.eq(3)).And(soc.eq(3)),3) \
-    .where(productivity.eq(2).And(landcover.eq(3)).And(soc.eq(2)),3) \
-    .where(productivity.eq(2).And(landcover.eq(3)).And(soc.eq(1)),1) \
-    .where(productivity.eq(2).And(landcover.eq(2)).And(soc.eq(3)),3) \
-    .where(productivity.eq(2).And(landcover.eq(2)).And(soc.eq(2)),2) \
-    .where(productivity.eq(2).And(landcover.eq(2)).And(soc.eq(1)),1) \
-    .where(productivity.eq(2).And(landcover.eq(1)).And(soc.eq(3)),1) \
-    .where(productivity.eq(2).And(landcover.eq(1)).And(soc.eq(2)),1) \
-    .where(productivity.eq(2).And(landcover.eq(1)).And(soc.eq(1)),1) \
-    .where(productivity.eq(1).And(landcover.eq(3)).And(soc.eq(3)),1) \
-    .where(productivity.eq(1).And(landcover.eq(3)).And(soc.eq(2)),1) \
-    .where(productivity.eq(1).And(landcover.eq(3)).And(soc.eq(1)),1) \
-    .where(productivity.eq(1).And(landcover.eq(2)).And(soc.eq(3)),1) \
-    .where(productivity.eq(1).And(landcover.eq(2)).And(soc.eq(2)),1) \
-    .where(productivity.eq(1).And(landcover.eq(2)).And(soc.eq(1)),1) \
-    .where(productivity.eq(1).And(landcover.eq(1)).And(soc.eq(3)),1) \
-    .where(productivity.eq(1).And(landcover.eq(1)).And(soc.eq(2)),1) \
-    .where(productivity.eq(1).And(landcover.eq(1)).And(soc.eq(1)),1) \
-    .where(productivity.eq(1).And(landcover.lt(1)).And(soc.lt(1)),1) \
-    .where(productivity.lt(1).And(landcover.eq(1)).And(soc.lt(1)),1) \
-    .where(productivity.lt(1).And(landcover.lt(1)).And(soc.eq(1)),1) \
-    .where(productivity.eq(2).And(landcover.lt(1)).And(soc.lt(1)),2) \
-    .where(productivity.lt(1).And(landcover.eq(2)).And(soc.lt(1)),2) \
-    .where(productivity.lt(1).And(landcover.lt(1)).And(soc.eq(2)),2) \
-    .where(productivity.eq(3).And(landcover.lt(1)).And(soc.lt(1)),3) \
-    .where(productivity.lt(1).And(landcover.eq(3)).And(soc.lt(1)),3) \
-    .where(productivity.lt(1).And(landcover.lt(1)).And(soc.eq(3)),3)
+    # a masked sub-indicator (only the land cover can be) masks the code, set to 0 like in the where based implementation
+    indicator = productivity \
+        .multiply(16) \
+        .add(landcover.multiply(4)) \
+        .add(soc) \
+        .remap(list(range(64)), pm.indicator_table) \
+        .unmask(0)
     
     return indicator.uint8()
+
+def indicator_15_3_1_local(productivity, landcover, soc):
+    """local equivalent of indicator_15_3_1, the 0 of the land cover are its masked pixels and mask the indicator as in the ee graph"""
+    
+    table = np.array(pm.indicator_table, dtype=np.uint8)
+    code = productivity.astype(np.intp) * 16 + landcover * 4 + soc
+    
+    indicator = table[code]
+    indicator[landcover == 0] = 0
+        
+    return indicator
@@ -1,18 +1,20 @@
 import ee 
-
-ee.Initialize()
+import numpy as np
 
 from component import parameter as pm
+from .stack import remap, where
 
 def soil_organic_carbon(io, aoi_io, output):
-    """Calculate soil organic carbon indicator"""
+    """Calculate soil organic carbon indicator
+    
+    The yearly changes are computed server side with an ee.List.iterate that only 
+    carries the last year state so the size of the request doesn't depend on the period.
+    """
     
     soc = ee.Image(pm.soc).clip(aoi_io.get_aoi_ee().geometry().bounds())
     soc = soc.updateMask(soc.neq(pm.int_16_min))
     
-    lc = ee.Image(pm.land_cover) \
-        .clip(aoi_io.get_aoi_ee().geometry().bounds()) \
-        .select(ee.List.sequence(io.start - 1992, pm.land_use_max_year -1992, 1))
+    lc = ee.Image(pm.land_cover).clip(aoi_io.get_aoi_ee().geometry().bounds())
     
     lc = lc \
         .where(lc.eq(9999), pm.int_16_min) \
@@ -24,15 +26,15 @@ def soil_organic_carbon(io, aoi_io, output):
     else: 
         climate_conversion_coef = io.conversion_coef 
         
+    def lc_year(year):
+        """select the land cover of a year (python or ee number) in IPCC classes"""
         
-    # compute the soc change for the first two years
-    lc_time0 = lc \
-        .select(0) \
-        .remap(pm.translation_matrix[0],pm.translation_matrix[1])
+        band = ee.String('y').cat(ee.Number(year).format('%d'))
+        return lc.select(band).remap(pm.translation_matrix[0],pm.translation_matrix[1])
         
-    lc_time1 = lc \
-        .select(1) \
-        .remap(pm.translation_matrix[0],pm.translation_matrix[1])
+    # compute the soc change for the first two years
+    lc_time0 = lc_year(io.start)
+    lc_time1 = lc_year(io.start + 1)
     
      # compute transition map for the first two years(1st digit for baseline land cover, 2nd for target land cover)
     lc_transition = lc_time0 \
@@ -42,6 +44,67 @@ def soil_organic_carbon(io, aoi_io, output):
     # compute raster to register years since transition for the first and second year
     lc_transition_time =ee.Image(2).where(lc_time0.neq(lc_time1),1)
     
+    organic_carbon_change = soc_change(soc, lc_transition, climate_conversion_coef)
+            
+    # compute final soc for the period
+    soc_time1 = soc.subtract(organic_carbon_change)
+    
+    # the state carried from one year to the next one
+    bands = ['lc', 'transition', 'transition_time', 'soc', 'change']
+    state = ee.Image.cat(lc_time1, lc_transition, lc_transition_time, soc_time1, organic_carbon_change).rename(bands)
+    
+    def compute_soc(year, state):
+        """compute the state of a year from the previous one"""
+        
+        state = ee.Image(state)
+        
+        lc_time0 = state.select('lc')
+        lc_time1 = lc_year(year)
+        
+        lc_transition_time = state.select('transition_time')
+        lc_transition_time = lc_transition_time \
+            .where(lc_time0.eq(lc_time1),lc_transition_time.add(ee.Image(1))) \
+            .where(lc_time0.neq(lc_time1),ee.Image(1))
+                
+        # compute transition map (1st digit for baseline land cover, 2nd for target land cover)
+        # But only update where changes acually occured.
+        lc_transition_temp = lc_time0.multiply(10).add(lc_time1)
+        lc_transition = state.select('transition').where(lc_time0.neq(lc_time1), lc_transition_temp)
+            
+        organic_carbon_change = state.select('change') \
+            .where(lc_time0.neq(lc_time1), soc_change(state.select('soc'), lc_transition, climate_conversion_coef)) \
+            .where(lc_transition_time.gt(20),0)
+            
+        soc_final = state.select('soc').subtract(organic_carbon_change)
+        
+        return ee.Image.cat(lc_time1, lc_transition, lc_transition_time, soc_final, organic_carbon_change).rename(bands)
+    
+    # Compute the soc change for the rest of  the years
+    if io.start + 2 <= pm.land_use_max_year:
+        years = ee.List.sequence(io.start + 2, pm.land_use_max_year)
+        state = ee.Image(years.iterate(compute_soc, state))
+            
+    # Compute soc percent change for the analysis period
+    soc_percent_change = state \
+        .select('soc') \
+        .subtract(soc) \
+        .divide(soc) \
+        .multiply(100)
+    
+    # use the bytes convention 
+    # 1 degraded - 2 stable - 3 improved
+    soc_class = ee.Image(0) \
+        .where(soc_percent_change.gt(10),3) \
+        .where(soc_percent_change.lt(10).And(soc_percent_change.gt(-10)),2) \
+        .where(soc_percent_change.lt(-10),1)\
+        .rename('soc') \
+        .uint8()
+    
+    return soc_class
+
+def soc_change(soc, lc_transition, climate_conversion_coef):
+    """yearly soc change associated to the land cover transitions. part of soil_organic_carbon"""
+    
     # store change factor for land use
     #333 and -333 will be recoded using the chosen climate coef.
     lc_transition_climate_coef_tmp =  lc_transition \
@@ -63,94 +126,91 @@ def soil_organic_carbon(io, aoi_io, output):
             .multiply(lc_transition_organic_factor)
          ) \
          .divide(20)
-            
-    # compute final soc for the period
-    soc_time1 = soc.subtract(organic_carbon_change)
-            
-    # add to land cover and soc to stacks from both dates for the first period
-    lc_images = ee.Image(lc_time0).addBands(lc_time1)
-            
-    soc_images = ee.Image(soc).addBands(soc_time1)
     
-    # Compute the soc change for the rest of  the years
-    #years = ee.List.sequence(1, io.end - io.start)
-    #soc_images = years.itterate(compute_soc, soc_images)
+    return organic_carbon_change
+
+###########################
+#      local backend      #
+###########################
+
+def soil_organic_carbon_local(io, stacks, window):
+    """local equivalent of soil_organic_carbon on a window of the soc, land cover and climate zones stacks
+    
+    The land cover years are read one band at a time and only the running state (last land cover, transition, 
+    years since transition, soc and change) is kept so the memory does not depend on the period.
+    """
+    
+    soc = stacks['soc'].read(window, [0])[0].astype(np.float64)
+    soc[soc == pm.int_16_min] = np.nan
+    
+    if not io.conversion_coef:
+        ipcc_climate_zones = stacks['climate_zones'].read(window, [0])[0]
+        climate_conversion_coef = remap(ipcc_climate_zones, pm.climate_conversion_matrix[0], pm.climate_conversion_matrix[1], np.float64)
+    else:
+        climate_conversion_coef = io.conversion_coef
+        
+    lc_stack = stacks['land_cover']
+    def read_lc(year):
+        lc = lc_stack.read(window, [lc_stack.index(f'y{year}')])[0]
+        lc[lc == 9999] = np.nan
+        return remap(lc, pm.translation_matrix[0], pm.translation_matrix[1])
+    
+    # compute the soc change for the first two years
+    lc_time0 = read_lc(io.start)
+    lc_time1 = read_lc(io.start + 1)
     
+    # nan != nan so the masked pixels need to be excluded explicitly
+    changed = (lc_time0 != lc_time1) & ~np.isnan(lc_time0) & ~np.isnan(lc_time1)
     
+    lc_transition = lc_time0 * 10 + lc_time1
+    lc_transition_time = where(np.full(soc.shape, 2.), changed, 1)
     
+    organic_carbon_change = soc_change_local(soc, lc_transition, climate_conversion_coef)
+    soc_final = soc - organic_carbon_change
     
-    for year_index in range(1, pm.land_use_max_year - io.start):
-        lc_time0 = lc \
-            .select(year_index) \
-            .remap(pm.translation_matrix[0],pm.translation_matrix[1])
+    # Compute the soc change for the rest of the years
+    for year in range(io.start + 2, pm.land_use_max_year + 1):
         
-        lc_time1 = lc \
-            .select(year_index +1) \
-            .remap(pm.translation_matrix[0],pm.translation_matrix[1])
+        lc_time0 = lc_time1
+        lc_time1 = read_lc(year)
         
-        lc_transition_time = lc_transition_time \
-            .where(lc_time0.eq(lc_time1),lc_transition_time.add(ee.Image(1))) \
-            .where(lc_time0.neq(lc_time1),ee.Image(1))
-                
-        # compute transition map (1st digit for baseline land cover, 2nd for target land cover)
-        # But only update where changes acually occured.
-        lc_transition_temp = lc_time0.multiply(10).add(lc_time1)
-        lc_transition =lc_transition.where(lc_time0.neq(lc_time1), lc_transition_temp)
+        changed = (lc_time0 != lc_time1) & ~np.isnan(lc_time0) & ~np.isnan(lc_time1)
         
-        #stock change factor for land use
-        #333 and -333 will be recoded using the choosen climate coef.            
-        lc_transition_climate_coef_tmp =  lc_transition \
-            .remap(pm.IPCC_lc_change_matrix, pm.c_conversion_factor)
-        lc_transition_climate_coef = lc_transition_climate_coef_tmp \
-            .where(lc_transition_climate_coef_tmp.eq(333),climate_conversion_coef) \
-            .where(lc_transition_climate_coef_tmp.eq(-333), ee.Image(1).divide(climate_conversion_coef))
-                            
-        # stock change factor for management regime
-        lc_transition_management_factor = lc_transition.remap(pm.IPCC_lc_change_matrix, pm.management_factor)
+        lc_transition_time = where(lc_transition_time, lc_time0 == lc_time1, lc_transition_time + 1)
+        lc_transition_time = where(lc_transition_time, changed, 1)
+        
+        # only update the transition where changes acually occured.
+        lc_transition = where(lc_transition, changed, lc_time0 * 10 + lc_time1)
+        
+        organic_carbon_change = where(organic_carbon_change, changed, soc_change_local(soc_final, lc_transition, climate_conversion_coef))
+        organic_carbon_change = where(organic_carbon_change, lc_transition_time > 20, 0)
+        
+        soc_final = soc_final - organic_carbon_change
         
-        # Stock change factor for input of organic matter
-        lc_transition_organic_factor = lc_transition.remap(pm.IPCC_lc_change_matrix, pm.input_factor)
-            
-        organic_carbon_change = organic_carbon_change \
-            .where(
-                lc_time0.neq(lc_time1),
-                soc_images \
-                    .select(year_index) \
-                    .subtract(soc_images \
-                        .select(year_index) \
-                        .multiply(lc_transition_climate_coef) \
-                        .multiply(lc_transition_management_factor) \
-                        .multiply(lc_transition_organic_factor)
-                    ) \
-                    .divide(20) \
-            ) \
-            .where(lc_transition_time.gt(20),0)
-            
-            
-        soc_final = soc_images \
-            .select(year_index) \
-            .subtract(organic_carbon_change)
-                        
-        lc_images = lc_images \
-            .addBands(lc_time1)
-            
-        soc_images = soc_images \
-            .addBands(soc_final)
-            
     # Compute soc percent change for the analysis period
-    soc_percent_change = soc_images \
-        .select(pm.land_use_max_year - io.start) \
-        .subtract(soc_images.select(0)) \
-        .divide(soc_images.select(0)) \
-        .multiply(100)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        soc_percent_change = (soc_final - soc) / soc * 100
     
     # use the bytes convention 
     # 1 degraded - 2 stable - 3 improved
-    soc_class = ee.Image(0) \
-        .where(soc_percent_change.gt(10),3) \
-        .where(soc_percent_change.lt(10).And(soc_percent_change.gt(-10)),2) \
-        .where(soc_percent_change.lt(-10),1)\
-        .rename('soc') \
-        .uint8()
+    soc_class = np.zeros(soc.shape, dtype=np.uint8)
+    soc_class[soc_percent_change > 10] = 3
+    soc_class[(soc_percent_change < 10) & (soc_percent_change > -10)] = 2
+    soc_class[soc_percent_change < -10] = 1
+    
+    return soc_class
+
+def soc_change_local(soc, lc_transition, climate_conversion_coef):
+    """yearly soc change associated to the land cover transitions. part of soil_organic_carbon_local"""
+    
+    #333 and -333 will be recoded using the chosen climate coef.
+    lc_transition_climate_coef_tmp = remap(lc_transition, pm.IPCC_lc_change_matrix, pm.c_conversion_factor, np.float64)
+    lc_transition_climate_coef = where(lc_transition_climate_coef_tmp, lc_transition_climate_coef_tmp == 333, climate_conversion_coef)
+    with np.errstate(divide='ignore'):
+        lc_transition_climate_coef = where(lc_transition_climate_coef, lc_transition_climate_coef_tmp == -333, 1 / np.asarray(climate_conversion_coef, dtype=np.float64))
+    
+    # store change factor for management regime and for input of organic matter
+    lc_transition_management_factor = remap(lc_transition, pm.IPCC_lc_change_matrix, pm.management_factor, np.float64)
+    lc_transition_organic_factor = remap(lc_transition, pm.IPCC_lc_change_matrix, pm.input_factor, np.float64)
     
-    return soc_class
\ No newline at end of file
+    return (soc - soc * lc_transition_climate_coef * lc_transition_management_factor * lc_transition_organic_factor) / 20
@@ -0,0 +1,228 @@
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
+import warnings
+
+import numpy as np
+
+from component import parameter as pm
+from component.message import ms
+
+class Stack():
+    """Read only access to a local raster stack (GeoTIFF or Zarr) used by the local backend
+
+    The bands are identified by their names: the band descriptions of a GeoTIFF or the 'bands' attribute of a Zarr array.
+    A Zarr array is expected in the (band, row, col) order with 'transform' (6 affine coefficients), 'crs' and optionally 'nodata' attributes.
+    nodata values are read as np.nan.
+
+    Args:
+        path (str|pathlib.Path): the path to the stack
+    """
+
+    def __init__(self, path):
+
+        self.path = Path(path)
+
+        # rasterio datasets cannot be read from several threads at once
+        self._lock = threading.Lock()
+
+        if self.path.suffix == '.zarr':
+            self._open_zarr()
+        else:
+            self._open_tif()
+
+    def _open_tif(self):
+
+        # rasterio is only loaded when the local backend is used
+        import rasterio as rio
+
+        self._src = rio.open(self.path)
+        self._zarr = None
+
+        self.width = self._src.width
+        self.height = self._src.height
+        self.count = self._src.count
+        self.transform = self._src.transform
+        self.crs = self._src.crs
+        self.nodata = self._src.nodata
+        self.names = [d or str(i) for i, d in enumerate(self._src.descriptions)]
+
+        return
+
+    def _open_zarr(self):
+
+        # zarr is only needed when the user works with zarr stacks
+        import zarr
+        from rasterio.transform import Affine
+
+        self._src = None
+        self._zarr = zarr.open(str(self.path), mode='r')
+
+        self.count, self.height, self.width = self._zarr.shape
+        self.transform = Affine(*self._zarr.attrs['transform'][:6])
+        self.crs = self._zarr.attrs['crs']
+        self.nodata = self._zarr.attrs.get('nodata', None)
+        self.names = self._zarr.attrs.get('bands', [str(i) for i in range(self.count)])
+
+        return
+
+    def close(self):
+
+        if self._src:
+            self._src.close()
+
+        return
+
+    def index(self, name):
+        """return the index of the band called name"""
+
+        return self.names.index(name)
+
+    def dates(self):
+        """return the dates of the bands as datetime objects, the band names need to be set as YYYY-MM-DD"""
+
+        return [datetime.strptime(name[:10], '%Y-%m-%d') for name in self.names]
+
+    def read(self, window, bands=None):
+        """read the selected bands (all by default) of the stack in the window
+
+        Args:
+            window (rasterio.windows.Window): the window to read
+            bands ([int], optional): the 0-based indexes of the bands to read
+
+        Returns:
+            data (np.array): float array of shape (bands, rows, cols), nodata are set to np.nan
+        """
+
+        bands = bands if bands is not None else list(range(self.count))
+
+        if self._zarr is not None:
+            rows, cols = window.toslices()
+            data = np.stack([self._zarr[b, rows, cols] for b in bands])
+        else:
+            with self._lock:
+                data = self._src.read([b + 1 for b in bands], window=window)
+
+        data = data.astype(np.float32)
+        if self.nodata is not None:
+            data[data == self.nodata] = np.nan
+
+        return data
+
+    def windows(self, size=pm.local_block_size):
+        """yield the square windows covering the stack"""
+
+        return get_windows(self.width, self.height, size)
+
+    def profile(self):
+        """return the rasterio profile of a single band uint8 output on the stack grid"""
+
+        return {
+            'driver': 'GTiff',
+            'height': self.height,
+            'width': self.width,
+            'count': 1,
+            'dtype': 'uint8',
+            'crs': self.crs,
+            'transform': self.transform,
+            'nodata': 0,
+            'compress': 'lzw'
+        }
+
+def get_windows(width, height, size=pm.local_block_size):
+    """yield the square windows covering a raster of width x height pixels"""
+
+    from rasterio.windows import Window
+
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            yield Window(col, row, min(size, width - col), min(size, height - row))
+
+def open_stacks(io):
+    """open all the local stacks set in the io and check that they share the same grid
+
+    Returns:
+        stacks (dict): the Stack objects indexed by dataset name
+    """
+
+    paths = {
+        'ndvi': io.local_ndvi,
+        'precipitation': io.local_precipitation,
+        'land_cover': io.local_land_cover,
+        'soc': io.local_soc,
+        'soil_tax': io.local_soil_tax,
+        'climate_zones': io.local_climate_zones
+    }
+
+    # the climate zones are only needed if no conversion coef is set
+    if io.conversion_coef:
+        paths.pop('climate_zones')
+
+    stacks = {}
+    for name, path in paths.items():
+        if not path:
+            raise Exception(ms.local.error.no_stack.format(name))
+        stacks[name] = Stack(path)
+
+    ref = stacks['ndvi']
+    for name, stack in stacks.items():
+        if (stack.width, stack.height, stack.transform) != (ref.width, ref.height, ref.transform):
+            raise Exception(ms.local.error.grid.format(name))
+
+    return stacks
+
+def map_windows(function, windows, max_workers=pm.local_max_workers):
+    """apply the function to each window in a thread pool (numpy releases the GIL) and yield the (window, result) in order
+
+    At most 2 x max_workers windows are in memory at the same time.
+    """
+
+    with ThreadPoolExecutor(max_workers) as executor:
+
+        futures = deque()
+        for window in windows:
+            futures.append((window, executor.submit(function, window)))
+            if len(futures) >= 2 * max_workers:
+                window, future = futures.popleft()
+                yield (window, future.result())
+
+        while futures:
+            window, future = futures.popleft()
+            yield (window, future.result())
+
+def remap(array, from_, to, dtype=np.float32):
+    """numpy equivalent of ee.Image.remap, the values that are not in from_ are set to np.nan"""
+
+    from_ = np.asarray(from_, dtype=np.float64)
+    to = np.asarray(to, dtype=np.float64)
+
+    order = np.argsort(from_)
+    from_, to = from_[order], to[order]
+
+    index = np.clip(np.searchsorted(from_, array), 0, len(from_) - 1)
+    found = from_[index] == array
+
+    return np.where(found, to[index], np.nan).astype(dtype)
+
+def where(array, test, value):
+    """numpy equivalent of ee.Image.where, the input is kept where the test or the value is masked (np.nan)"""
+
+    value = np.broadcast_to(value, np.shape(array))
+
+    return np.where(test & ~np.isnan(value), value, array)
+
+def to_uint8(array):
+    """numpy equivalent of ee.Image.uint8, masked (np.nan) pixels are set to 0"""
+
+    return np.nan_to_num(np.clip(array, 0, 255), nan=0).astype(np.uint8)
+
+def nanmean(array, axis=0):
+    """np.nanmean without the warning on empty slices, they are set to np.nan"""
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        mean = np.nanmean(array, axis=axis)
+
+    return mean
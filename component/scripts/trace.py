@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+from functools import wraps
+import threading
+import json
+import time
+import os
+
+class Tracer(object):
+    """record the wall time, the bytes moved and the number of calls of the stages of a run
+
+    The spans are written in the Chrome trace format (chrome://tracing or https://ui.perfetto.dev).
+    """
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """forget the spans of the previous run"""
+
+        with self.lock:
+            self.events = []
+            self.origin = time.perf_counter()
+
+        return
+
+    @contextmanager
+    def span(self, name, **args):
+        """record the duration of the context as a span, the yielded args can be completed (e.g. with 'bytes')"""
+
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            event = {
+                'name': name,
+                'ph': 'X',
+                'ts': (start - self.origin) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': {k: v if isinstance(v, (int, float)) else str(v) for k, v in args.items()}
+            }
+            with self.lock:
+                self.events.append(event)
+
+    def summary(self):
+        """return the number of calls, the total time (s) and the bytes moved by each stage"""
+
+        summary = {}
+        with self.lock:
+            for event in self.events:
+                stage = summary.setdefault(event['name'], {'calls': 0, 'time': 0, 'bytes': 0})
+                stage['calls'] += 1
+                stage['time'] += event['dur'] / 1e6
+                stage['bytes'] += event['args'].get('bytes', 0)
+
+        return summary
+
+    def write(self, file):
+        """write the spans of the run in a Chrome trace file"""
+
+        with self.lock:
+            trace = {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+        with open(file, 'w') as f:
+            json.dump(trace, f)
+
+        return file
+
+def traced(name):
+    """decorator recording each call of the function as a span of the tracer"""
+
+    def decorator(function):
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+# the tracer of the current run
+tracer = Tracer()
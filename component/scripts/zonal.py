@@ -0,0 +1,151 @@
+from functools import lru_cache
+import threading
+
+import numpy as np
+import rasterio as rio
+from rasterio import windows
+from rasterio.features import rasterize
+from shapely.geometry import box
+
+from component import parameter as pm
+from .stack import map_windows, get_windows
+
+class ThreadReader(object):
+    """open the rasters once per thread so that the windows can be read in parallel"""
+
+    def __init__(self, *files):
+
+        self.files = files
+        self.local = threading.local()
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def read(self, window):
+        """return the first band of each file in the window"""
+
+        if not hasattr(self.local, 'sources'):
+            self.local.sources = [rio.open(file) for file in self.files]
+            with self.lock:
+                self.opened += self.local.sources
+
+        return [src.read(1, window=window) for src in self.local.sources]
+
+    def close(self):
+
+        [src.close() for src in self.opened]
+
+        return
+
+def rasterize_zones(gdf, raster, zone_file, block_size=pm.local_block_size, max_workers=pm.local_max_workers):
+    """rasterize the features of gdf in a zone raster on the grid of raster, block by block
+
+    The zone of a pixel is the 1-based position of its feature in gdf, 0 outside of the features.
+    Only the features intersecting a block (spatial index) are burned in it.
+
+    Args:
+        gdf (gpd.GeoDataFrame): the zones
+        raster (pathlib.Path): the raster that defines the grid
+        zone_file (pathlib.Path): the zone raster to create
+    """
+
+    with rio.open(raster) as src:
+        profile = src.profile
+
+    dtype = 'uint16' if len(gdf) < np.iinfo(np.uint16).max else 'uint32'
+    geoms = gdf.to_crs(profile['crs']).geometry.reset_index(drop=True)
+    sindex = geoms.sindex
+
+    def zones(window):
+
+        ids = sindex.query(box(*windows.bounds(window, profile['transform'])))
+        if not len(ids):
+            return np.zeros((window.height, window.width), dtype=dtype)
+
+        return rasterize(
+            ((geoms[i], i + 1) for i in sorted(ids)),
+            out_shape = (window.height, window.width),
+            transform = windows.transform(window, profile['transform']),
+            fill = 0,
+            dtype = dtype
+        )
+
+    profile.update(dtype=dtype, count=1, nodata=None, compress='lzw', tiled=True, blockxsize=block_size, blockysize=block_size)
+    with rio.open(zone_file, 'w', **profile) as dst:
+        for window, data in map_windows(zones, get_windows(profile['width'], profile['height'], block_size), max_workers):
+            dst.write(data, 1, window=window)
+
+    return zone_file
+
+def zonal_areas(raster, zone_file, n_zones, n_classes, block_size=pm.local_block_size, max_workers=pm.local_max_workers):
+    """sum the area of the pixels of each class in each zone with a single weighted bincount per window on the (zone, class) codes
+
+    Returns:
+        areas (np.array): the area (m²) of shape (n_zones, n_classes)
+    """
+
+    reader = ThreadReader(raster, zone_file)
+    size = (n_zones + 1) * n_classes
+
+    with rio.open(raster) as src:
+        width, height = src.width, src.height
+        row_areas = pixel_areas(src.transform, src.height, src.crs)
+
+    def count(window):
+        classes, zones = reader.read(window)
+        codes = zones.astype(np.int64) * n_classes + classes
+        rows = row_areas[window.row_off: window.row_off + window.height, None]
+        weights = np.broadcast_to(rows, codes.shape)
+        return np.bincount(codes.ravel(), weights=weights.ravel(), minlength=size)
+
+    areas = np.zeros(size, dtype=np.float64)
+    try:
+        for window, data in map_windows(count, get_windows(width, height, block_size), max_workers):
+            areas += data
+    finally:
+        reader.close()
+
+    # drop the pixels outside of the zones
+    return areas.reshape(n_zones + 1, n_classes)[1:]
+
+def pixel_areas(transform, height, crs):
+    """return the area (m²) of the pixels of each row of a north up grid, the vector is computed once per grid
+
+    Geographic pixels are measured on the WGS84 ellipsoid, their area only depends on their latitude.
+    """
+
+    return _pixel_areas(tuple(transform)[:6], height, crs.to_string(), crs.is_geographic)
+
+@lru_cache(maxsize=32)
+def _pixel_areas(transform, height, crs, is_geographic):
+
+    x_res, _, _, _, y_res, top = transform
+
+    if not is_geographic:
+        areas = np.full(height, abs(x_res * y_res))
+    else:
+        lats = np.radians(top + y_res * np.arange(height + 1))
+        areas = np.abs(np.diff(_authalic(lats))) * np.radians(abs(x_res))
+
+    # the vector is shared between the calls
+    areas.setflags(write=False)
+
+    return areas
+
+def _authalic(lat, a=6378137, f=1/298.257223563):
+    """primitive of the area of the WGS84 ellipsoid between the equator and lat for 1 radian of longitude"""
+
+    e = np.sqrt(f * (2 - f))
+    sin = np.sin(lat)
+
+    return a ** 2 * (1 - e ** 2) / 2 * (sin / (1 - (e * sin) ** 2) + np.arctanh(e * sin) / e)
+
+def zonal_statistics_local(raster, gdf, zone_file, n_classes=4):
+    """compute the area (km²) of each class of raster in each feature of gdf
+
+    Returns:
+        areas (np.array): the area of shape (len(gdf), n_classes)
+    """
+
+    rasterize_zones(gdf, raster, zone_file)
+
+    return zonal_areas(raster, zone_file, len(gdf), n_classes) / 1000000
@@ -76,15 +76,24 @@ class Tile_15_3_1(sw.Tile):
         # will work in next sepal_ui patch
         #if not self.output.check_input(self.io.sensors, 'no sensors'): return widget.toggle_loading()
         
+        # a new run starts
+        cs.tracer.reset()
+        
         try: 
             cs.compute_indicator_maps(self.aoi_io, self.io, self.output)
 
-            # get the result map        
-            cs.display_maps(self.aoi_io, self.io, self.result_tile.m, self.output)
-            
+            # the local maps are not ee objects, they can only be downloaded
+            if self.io.backend == 'gee':
+
+                # get the result map
+                cs.display_maps(self.aoi_io, self.io, self.result_tile.m, self.output)
+
             # create the csv result
             stats = cs.compute_zonal_analysis(self.aoi_io, self.io, self.output)
             self.result_tile.shp_btn.set_url(str(stats))
+            
+            # show where the time went
+            self.result_tile.update_trace()
         
             # release the download btn
             self.result_tile.tif_btn.disabled = False
@@ -125,6 +134,9 @@ class Result_15_3_1(sw.Tile):
         self.soc_btn = sw.DownloadBtn(ms._15_3_1.down_soc)
         self.indicator_btn = sw.DownloadBtn(ms._15_3_1.down_ind)
         
+        # the time spent in each stage of the run
+        self.trace_table = cw.TraceTable()
+        
         self.tif_btn = sw.Btn(text = ms._15_3_1.result_btn, icon = 'mdi-download', class_='ma-5')
         self.tif_btn.disabled = True
         
@@ -141,7 +153,7 @@ class Result_15_3_1(sw.Tile):
         super().__init__(
             '15_3_1_widgets', 
             ms._15_3_1.results, 
-            [markdown, btn_line, self.m],
+            [markdown, btn_line, self.m, self.trace_table],
             output = self.output, 
             btn = self.tif_btn
         )
@@ -163,6 +175,8 @@ class Result_15_3_1(sw.Tile):
             self.soc_btn.set_url(str(links[1]))
             self.prod_btn.set_url(str(links[2]))
             self.indicator_btn.set_url(str(links[3]))
+            
+            self.update_trace()
         
         except Exception as e:
             self.output.add_live_msg(str(e), 'error')
@@ -170,4 +184,12 @@ class Result_15_3_1(sw.Tile):
         widget.toggle_loading()
             
         return
+    
+    def update_trace(self):
+        """display the summary of the run and write its trace next to the results"""
+        
+        self.trace_table.set_trace(cs.tracer.summary())
+        cs.write_trace(self.aoi_io, self.io)
+        
+        return
         
\ No newline at end of file
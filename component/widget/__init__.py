@@ -1,4 +1,5 @@
 from .climate_regime import *
 from .picker_line import *
 from .sensor_select import *
-from .transition_matrix import *
\ No newline at end of file
+from .transition_matrix import *
+from .trace_table import *
\ No newline at end of file
@@ -0,0 +1,25 @@
+import ipyvuetify as v
+
+from component.message import ms
+
+class TraceTable(v.SimpleTable):
+    """display the summary of the stages recorded by the tracer of the run"""
+    
+    def __init__(self):
+        
+        super().__init__(class_='mt-5', children=[])
+        self.set_trace({})
+        
+    def set_trace(self, summary):
+        """display the summary of a run, see scripts.Tracer.summary"""
+        
+        header = v.Html(tag='tr', children=[v.Html(tag='th', children=[title]) for title in ms._15_3_1.trace_header])
+        
+        rows = []
+        for name, stage in summary.items():
+            cells = [name, stage['calls'], f"{stage['time']:.1f}", f"{stage['bytes'] / 1024**2:.1f}"]
+            rows.append(v.Html(tag='tr', children=[v.Html(tag='td', children=[str(cell)]) for cell in cells]))
+        
+        self.children = [v.Html(tag='tbody', children=[header] + rows)]
+        
+        return self
@@ -0,0 +1,89 @@
+import sys
+
+import pytest
+
+from . import fake_ee
+
+# the package is tested offline: the stub replaces ee before any module of the package imports it
+sys.modules['ee'] = fake_ee
+
+from component import parameter as pm
+from component.io import Io_15_3_1
+from component.scripts.graph import GraphReport, count_getinfo
+
+class FakeAoi(object):
+    """the aoi_io of the sepal_ui aoi selector"""
+
+    def get_aoi_name(self):
+        return 'test_aoi'
+
+    def get_aoi_ee(self):
+        return fake_ee.FeatureCollection('users/test/aoi')
+
+class FakeOutput(object):
+    """the Alert of the tiles, the messages are kept"""
+
+    def __init__(self):
+        self.msgs = []
+
+    def add_live_msg(self, msg, type_=None):
+        self.msgs.append((msg, type_))
+
+    def add_msg(self, msg, type_=None):
+        self.msgs.append((msg, type_))
+
+@pytest.fixture(autouse=True)
+def reset_ee():
+    """start each test with no recorded call"""
+
+    fake_ee.reset()
+    yield
+    fake_ee.reset()
+
+@pytest.fixture
+def aoi_io():
+    return FakeAoi()
+
+@pytest.fixture
+def output():
+    return FakeOutput()
+
+@pytest.fixture
+def io():
+    """the parameters of a 2001-2018 analysis on the landsat 8 collection"""
+
+    io = Io_15_3_1()
+    io.start = 2001
+    io.baseline_end = 2015
+    io.target_start = 2016
+    io.end = 2018
+    io.sensors = ['Landsat 8']
+    io.trajectory = pm.trajectories[0]['value']
+    io.conversion_coef = pm.climate_regimes[0]['value']
+
+    return io
+
+@pytest.fixture
+def measure(benchmark):
+    """time the construction of a graph with pytest-benchmark and measure it with a GraphReport
+
+    The size of the graph and the number of ee calls of a single construction are saved in the
+    extra_info of the benchmark, the budgets of pm.graph_budget are checked.
+    """
+
+    def measure(name, function, *args):
+
+        fake_ee.calls.clear()
+        with count_getinfo() as counter:
+            obj = function(*args)
+        calls = sum(fake_ee.calls.values()) - fake_ee.calls['getInfo']
+
+        report = GraphReport()
+        report.add(name, obj, counter['getinfo'])
+        benchmark.extra_info.update(report.stages[name], calls=calls)
+
+        benchmark(function, *args)
+
+        return report.stages[name]
+
+    return measure
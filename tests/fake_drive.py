@@ -0,0 +1,113 @@
+"""Offline stand-in of the gdrive v3 service built by scripts.gdrive
+
+The files are kept in memory in ``store`` (by name) and every request is counted by name in ``calls``.
+Only the requests used by the module are implemented: files().list (paged, "name contains" queries),
+files().get (size), files().get_media (with a Range header) and files().delete.
+"""
+
+from collections import Counter
+import re
+
+class _Request(object):
+
+    def __init__(self, service, name, function):
+
+        self.service = service
+        self.name = name
+        self.function = function
+        self.headers = {}
+
+    def execute(self):
+
+        self.service.calls[self.name] += 1
+        failures = self.service.failures
+        if self.name in failures:
+            if failures[self.name] == 0:
+                del failures[self.name]
+                raise ConnectionError(f'{self.name} failed')
+            failures[self.name] -= 1
+
+        return self.function(self)
+
+class _Files(object):
+
+    def __init__(self, service):
+
+        self.service = service
+
+    def list(self, q='', pageSize=100, pageToken=None, fields=None):
+
+        def execute(request):
+
+            files = self.service.store
+            match = re.search(r"name contains '((?:[^'\\]|\\.)*)'", q)
+            names = sorted(files)
+            if match:
+                names = [n for n in names if match.group(1).replace("\\'", "'") in n]
+
+            start = int(pageToken or 0)
+            page = names[start: start + pageSize]
+            results = {'files': [{'id': files[n]['id'], 'name': n, 'size': str(len(files[n]['data']))} for n in page]}
+            if start + pageSize < len(names):
+                results['nextPageToken'] = str(start + pageSize)
+
+            return results
+
+        return _Request(self.service, 'list', execute)
+
+    def get(self, fileId, fields=None):
+
+        return _Request(self.service, 'get', lambda request: {'size': str(len(self.service.by_id(fileId)['data']))})
+
+    def get_media(self, fileId):
+
+        def execute(request):
+
+            data = self.service.by_id(fileId)['data']
+            start, end = re.match(r'bytes=(\d+)-(\d+)', request.headers['Range']).groups()
+
+            return data[int(start): int(end) + 1]
+
+        return _Request(self.service, 'get_media', execute)
+
+    def delete(self, fileId):
+
+        def execute(request):
+
+            name = self.service.by_id(fileId)['name']
+            del self.service.store[name]
+
+            return ''
+
+        return _Request(self.service, 'delete', execute)
+
+class FakeDrive(object):
+    """a gdrive service holding files in memory
+
+    Args:
+        files (dict): the content (bytes) of the files by name
+    """
+
+    def __init__(self, files={}):
+
+        self.store = {}
+        self.calls = Counter()
+        # number of successful requests before a request fails once, by request name (e.g. {'get_media': 2})
+        self.failures = {}
+
+        for name, data in files.items():
+            self.add(name, data)
+
+    def add(self, name, data):
+        """add a file, like the end of an export task"""
+
+        self.store[name] = {'id': f'id_{name}', 'name': name, 'data': data}
+
+        return
+
+    def by_id(self, id_):
+
+        return next(f for f in self.store.values() if f['id'] == id_)
+
+    def files(self):
+        return _Files(self)
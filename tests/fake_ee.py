@@ -0,0 +1,304 @@
+"""Offline stand-in of the ee API used by the module
+
+Nothing is sent to a server: each function call is recorded as a node of a graph. The objects can be serialized
+like the real ones (same functionInvocationValue nodes, identical sub-graphs are only written once) so that
+scripts.graph.count_nodes measures them, and the calls are counted by name in ``calls``.
+The tests set what the server would answer: the getInfo results in ``data.values`` (by function name)
+and the tasks in ``batch.Task.tasks``.
+
+conftest.py installs the module as ``ee`` before the package is imported.
+"""
+
+from collections import Counter
+import inspect
+import json
+import sys
+
+# number of calls of each ee function (e.g. 'Image.remap') since the last reset
+calls = Counter()
+
+def reset():
+    """forget the recorded calls, the getInfo results and the tasks"""
+
+    calls.clear()
+    data.values.clear()
+    batch.Task.tasks.clear()
+
+    return
+
+# the class of the object returned by the methods that don't return an object of the caller class,
+# by 'Class.method' or by method name for all the classes
+RETURNS = {
+    'ImageCollection.reduce': 'Image',
+    'ImageCollection.toBands': 'Image',
+    'reduceRegion': 'Dictionary',
+    'toDictionary': 'Dictionary',
+    'get': 'ComputedObject',
+    'iterate': 'ComputedObject',
+    'aggregate_array': 'List',
+    'toList': 'List',
+    'size': 'Number',
+    'length': 'Number',
+    'arrayLength': 'Image',
+    'geometry': 'Geometry',
+    'bounds': 'Geometry',
+    'first': 'Image',
+    'toBands': 'Image',
+    'toArray': 'Image',
+    'mosaic': 'Image',
+    'median': 'Image',
+    'mean': 'Image',
+    'projection': 'Projection',
+    'format': 'String',
+    'apply': 'FeatureCollection',
+}
+
+class _Recorder(type):
+    """the static functions (ee.Image.cat, ee.Reducer.mean...) are recorded like the methods"""
+
+    def __getattr__(cls, name):
+
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def static(*args, **kwargs):
+            return_cls = RETURNS.get(f'{cls.__name__}.{name}')
+            return _record(globals()[return_cls] if return_cls else cls, name, args, kwargs, cls)
+
+        return static
+
+class ComputedObject(object, metaclass=_Recorder):
+    """a node of the graph: the name of the function that created it and its arguments
+    
+    The arguments of the functions passed to map or iterate are variables: nodes without function, only a name.
+    """
+
+    var = None
+
+    def __init__(self, value=None, *args, **kwargs):
+
+        # casting an object keeps its node, like ee.Image(ee_object)
+        if isinstance(value, ComputedObject):
+            self.func, self.args, self.var = value.func, value.args, value.var
+        else:
+            name = type(self).__name__
+            calls[name] += 1
+            self.func = name
+            self.args = {'value': value, 'args': list(args), **kwargs}
+
+    def __getattr__(self, name):
+
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            cls = type(self)
+            return_cls = RETURNS.get(f'{cls.__name__}.{name}', RETURNS.get(name))
+            return _record(globals()[return_cls] if return_cls else cls, name, (self,) + args, kwargs, cls)
+
+        return method
+
+    def getInfo(self):
+        """ask the value to the "server", see data.computeValue"""
+
+        return data.computeValue(self)
+
+    def serialize(self):
+        """encode the graph like ee.serializer: a dict of the values and the reference of the result"""
+
+        return json.dumps(_Serializer().encode_all(self))
+
+def _variable(name):
+
+    obj = ComputedObject.__new__(ComputedObject)
+    obj.func, obj.args, obj.var = None, {}, name
+
+    return obj
+
+def _record(return_cls, name, args, kwargs, caller_cls=None):
+    """create the node of a call of caller_cls.name, the functions passed as argument are recorded once with variables"""
+
+    func = f'{(caller_cls or return_cls).__name__}.{name}'
+    calls[func] += 1
+
+    args = [_function(arg) if callable(arg) and not isinstance(arg, ComputedObject) else arg for arg in args]
+    kwargs = {k: _function(v) if callable(v) and not isinstance(v, ComputedObject) else v for k, v in kwargs.items()}
+
+    obj = return_cls.__new__(return_cls)
+    obj.func = func
+    obj.args = {'args': args, **kwargs}
+
+    return obj
+
+class _Function(object):
+    """a function passed to the server: its argument names and the graph of its body"""
+
+    def __init__(self, names, body):
+
+        self.names = names
+        self.body = body
+
+def _function(function):
+
+    # like a call, a partial with wrong arguments raises a TypeError
+    try:
+        signature = inspect.signature(function)
+    except ValueError as e:
+        raise TypeError(str(e))
+
+    parameters = [
+        p for p in signature.parameters.values()
+        if p.kind in [p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD] and p.default is p.empty
+    ]
+    names = [f'_MAPPING_VAR_{i}_{p.name}' for i, p in enumerate(parameters)]
+
+    return _Function(names, function(*[_variable(name) for name in names]))
+
+class _Serializer(object):
+
+    def __init__(self):
+
+        self.values = {}
+        self.ids = {}
+        self.encoded = {}
+
+    def encode_all(self, obj):
+
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 100000))
+        try:
+            result = self.encode(obj)
+        finally:
+            sys.setrecursionlimit(limit)
+
+        return {'result': result['valueReference'], 'values': self.values}
+
+    def encode(self, value):
+
+        if isinstance(value, ComputedObject) and value.var:
+            return {'argumentReference': value.var}
+        elif isinstance(value, ComputedObject):
+            # an object used several times is only encoded once
+            if id(value) not in self.encoded:
+                self.encoded[id(value)] = (value, self.reference({'functionInvocationValue': {
+                    'functionName': value.func,
+                    'arguments': {k: self.encode(v) for k, v in value.args.items()}
+                }}))
+            return self.encoded[id(value)][1]
+        elif isinstance(value, _Function):
+            return {'functionDefinitionValue': {'argumentNames': value.names, 'body': self.encode(value.body)}}
+        elif isinstance(value, (list, tuple)):
+            return {'arrayValue': {'values': [self.encode(v) for v in value]}}
+        elif isinstance(value, dict):
+            return {'dictionaryValue': {'values': {str(k): self.encode(v) for k, v in value.items()}}}
+        elif hasattr(value, 'item'):
+            # numpy scalars
+            return {'constantValue': value.item()}
+        elif value is None or isinstance(value, (bool, int, float, str)):
+            return {'constantValue': value}
+
+        return {'constantValue': str(value)}
+
+    def reference(self, encoded):
+        """identical nodes share the same reference"""
+
+        key = json.dumps(encoded, sort_keys=True)
+        if key not in self.ids:
+            self.ids[key] = str(len(self.ids))
+            self.values[self.ids[key]] = encoded
+
+        return {'valueReference': self.ids[key]}
+
+class Element(ComputedObject): pass
+class Image(Element): pass
+class Feature(Element): pass
+class Collection(Element): pass
+class ImageCollection(Collection): pass
+class FeatureCollection(Collection): pass
+class Geometry(ComputedObject): pass
+class Projection(ComputedObject): pass
+class Reducer(ComputedObject): pass
+class Filter(ComputedObject): pass
+class Join(ComputedObject): pass
+class List(ComputedObject): pass
+class Dictionary(ComputedObject): pass
+class Number(ComputedObject): pass
+class String(ComputedObject): pass
+class Date(ComputedObject): pass
+class Array(ComputedObject): pass
+
+class _Data(object):
+    """ee.data: the getInfo results are read in values, indexed by the name of the function that created the object"""
+
+    def __init__(self):
+
+        self.values = {}
+
+    def computeValue(self, obj):
+
+        calls['getInfo'] += 1
+
+        return self.values.get(obj.func)
+
+data = _Data()
+
+class Task(object):
+    """ee.batch.Task, its state is set by the tests"""
+
+    # the submitted tasks, most recent last
+    tasks = []
+
+    def __init__(self, config, state='UNSUBMITTED'):
+
+        self.config = config
+        self.state = state
+
+    def start(self):
+
+        calls['Task.start'] += 1
+        self.state = 'READY'
+        Task.tasks.append(self)
+
+        return
+
+    def status(self):
+
+        return {'description': self.config['description'], 'state': self.state}
+
+    @staticmethod
+    def list():
+        """the tasks of the user, most recent first like the server"""
+
+        calls['Task.list'] += 1
+
+        return list(reversed(Task.tasks))
+
+class _ImageExport(object):
+
+    @staticmethod
+    def toDrive(**config):
+
+        calls['Export.image.toDrive'] += 1
+
+        return Task(config)
+
+class _Export(object):
+
+    image = _ImageExport
+
+class _Batch(object):
+
+    Task = Task
+    Export = _Export
+
+batch = _Batch()
+
+def Initialize(*args, **kwargs):
+
+    calls['Initialize'] += 1
+
+    return
+
+def Credentials(*args, **kwargs):
+
+    return object()
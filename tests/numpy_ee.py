@@ -0,0 +1,118 @@
+"""ee evaluated on numpy arrays, used to compare the gee functions with their local equivalents
+
+Only the calls of the functions under test are implemented. An Image is a dict of 2D arrays (one per band,
+nan for the masked pixels) and a dict of properties, an ImageCollection a list of Images.
+The tests replace the ee module of the tested script by this one (monkeypatch).
+"""
+
+from datetime import datetime, timezone
+import warnings
+
+import numpy as np
+
+class Image(object):
+
+    def __init__(self, bands=None, props=None):
+
+        self.bands = bands or {}
+        self.props = props or {}
+
+    def constant(self, value):
+        return Image({'constant': np.float32(value)}, self.props)
+
+    def float(self):
+        return Image({k: np.asarray(v, dtype=np.float32) for k, v in self.bands.items()}, self.props)
+
+    def rename(self, name):
+        return Image({name: next(iter(self.bands.values()))}, self.props)
+
+    def addBands(self, image):
+        return Image({**self.bands, **image.bands}, self.props)
+
+    def set(self, key, value):
+        return Image(self.bands, {**self.props, key: value})
+
+    def get(self, key):
+        return self.props[key]
+
+class ImageCollection(object):
+
+    def __init__(self, images):
+
+        self.images = list(images)
+
+    @staticmethod
+    def fromImages(images):
+        return ImageCollection(images.values)
+
+    def filter(self, filter_):
+        return ImageCollection(image for image in self.images if filter_(image))
+
+    def aggregate_array(self, key):
+        return List([image.get(key) for image in self.images])
+
+    def reduce(self, reducer):
+        """the masked pixels are ignored, the bands are suffixed by the reducer name"""
+
+        bands = {}
+        for band in self.images[0].bands:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                bands[f'{band}_{reducer}'] = reducers[reducer](np.stack([image.bands[band] for image in self.images]), axis=0)
+
+        return Image(bands)
+
+reducers = {'mean': np.nanmean}
+
+class Reducer(object):
+
+    @staticmethod
+    def mean():
+        return 'mean'
+
+class Filter(object):
+
+    @staticmethod
+    def calendarRange(start, end=None, field='day_of_year'):
+
+        end = start if end is None else end
+
+        return lambda image: start <= getattr(Date(image.get('system:time_start')).date, field) <= end
+
+class Date(object):
+
+    def __init__(self, millis):
+
+        self.date = datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+
+    def format(self, pattern):
+        return self.date.strftime(pattern.replace('yyyy', '%Y').replace('MM', '%m').replace('dd', '%d'))
+
+class Number(object):
+
+    @staticmethod
+    def parse(string):
+        return int(string)
+
+class List(object):
+
+    def __init__(self, values):
+
+        self.values = list(values)
+
+    @staticmethod
+    def sequence(start, end):
+        return List(range(start, end + 1))
+
+    def map(self, function):
+        return List(function(value) for value in self.values)
+
+    def distinct(self):
+        return List(dict.fromkeys(self.values))
+
+def image(bands, date):
+    """an Image of bands acquired at date (datetime)"""
+
+    millis = date.replace(tzinfo=timezone.utc).timestamp() * 1000
+
+    return Image(bands, {'system:time_start': millis})
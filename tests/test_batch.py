@@ -0,0 +1,119 @@
+import sys
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from component import scripts as cs
+from component.message import ms
+from component.scripts.batch import BatchAoi, get_io, run_aoi, run_batch, _parse_value
+
+from . import fake_ee
+
+batch_module = sys.modules['component.scripts.batch']
+
+def test_get_io():
+
+    io = get_io({'start': 2005, 'end': 2019, 'sensors': ['Landsat 7']})
+
+    assert (io.start, io.end, io.sensors) == (2005, 2019, ['Landsat 7'])
+
+    with pytest.raises(Exception, match=ms.batch.error.param.format('starts')):
+        get_io({'starts': 2005})
+
+def test_get_aoi_name():
+
+    assert BatchAoi('users/test/gaul').get_aoi_name() == 'gaul'
+    assert BatchAoi('users/test/gaul', 'ADM0_CODE', 12).get_aoi_name() == 'gaul_ADM0_CODE_12'
+
+    # a single value of the column is selected
+    BatchAoi('users/test/gaul', 'ADM0_CODE', 12).get_aoi_ee()
+    assert fake_ee.calls['Filter.eq'] == 1
+
+@pytest.mark.parametrize('value, expected', [('12', 12), ('1.5', 1.5), ('Kenya', 'Kenya'), ('012', '012')])
+def test_parse_value(value, expected):
+
+    assert _parse_value(value) == expected
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path):
+    """replace the stages of the pipeline, the aois named in pipeline['fail'] raise in the computation"""
+
+    pipeline = {'fail': [], 'stages': []}
+
+    def compute(aoi_io, io, output):
+        pipeline['stages'].append('compute')
+        if aoi_io.get_aoi_name() in pipeline['fail']:
+            raise Exception('no image in the aoi')
+        io.cache_key = 'key'
+
+    def download(aoi_io, io, output):
+        pipeline['stages'].append('download')
+        return [tmp_path / f'{layer}.tif' for layer in ['lc', 'soc', 'prod', 'ind']]
+
+    def statistics(aoi_io, io, output):
+        pipeline['stages'].append('statistics')
+        return tmp_path / 'stats.csv'
+
+    monkeypatch.setattr(cs, 'compute_indicator_maps', compute)
+    monkeypatch.setattr(cs, 'download_maps', download)
+    monkeypatch.setattr(cs, 'compute_zonal_analysis', statistics)
+    monkeypatch.setattr(cs, 'write_trace', lambda aoi_io, io: tmp_path / 'trace.json')
+
+    return pipeline
+
+def test_run_aoi(pipeline, tmp_path):
+
+    entry = run_aoi({'asset': 'users/test/gaul', 'column': 'ADM0_CODE', 'value': 12}, {'start': 2005})
+
+    assert entry['status'] == 'completed'
+    assert pipeline['stages'] == ['compute', 'download', 'statistics']
+    assert entry['outputs']['productivity'] == str(tmp_path / 'prod.tif')
+    assert entry['outputs']['statistics'] == str(tmp_path / 'stats.csv')
+    assert entry['cache_key'] == 'key'
+    assert set(entry['timings']) == {'compute', 'download', 'statistics', 'total'}
+
+def test_run_aoi_failed(pipeline):
+
+    pipeline['fail'] = ['gaul']
+    entry = run_aoi({'asset': 'users/test/gaul'}, {'start': 2005})
+
+    # the error is kept and the next stages are skipped
+    assert entry['status'] == 'failed'
+    assert entry['error'] == 'no image in the aoi'
+    assert pipeline['stages'] == ['compute']
+    assert 'total' in entry['timings']
+
+    # so are the wrong parameters
+    entry = run_aoi({'asset': 'users/test/gaul'}, {'starts': 2005})
+    assert entry['error'] == ms.batch.error.param.format('starts')
+
+def test_run_batch_manifest(pipeline, monkeypatch, tmp_path):
+
+    # the aois run in threads of this process so that they use the replaced pipeline
+    executor = lambda max_workers, mp_context, initializer, initargs: ThreadPoolExecutor(max_workers, initializer=initializer, initargs=initargs)
+    monkeypatch.setattr(batch_module, 'ProcessPoolExecutor', executor)
+    pipeline['fail'] = ['gaul_ADM0_CODE_2']
+
+    aois = [{'asset': 'users/test/gaul', 'column': 'ADM0_CODE', 'value': value} for value in [1, 2, 3]]
+    manifest_file = tmp_path / 'runs' / 'batch.json'
+    manifest = run_batch(aois, {'start': 2005}, max_workers=2, manifest_file=manifest_file)
+
+    assert json.loads(manifest_file.read_text()) == json.loads(json.dumps(manifest))
+    assert manifest['params'] == {'start': 2005}
+    assert {'start', 'end'} <= set(manifest)
+    assert {name: entry['status'] for name, entry in manifest['aois'].items()} == {
+        'gaul_ADM0_CODE_1': 'completed',
+        'gaul_ADM0_CODE_2': 'failed',
+        'gaul_ADM0_CODE_3': 'completed'
+    }
+    assert manifest['aois']['gaul_ADM0_CODE_2']['aoi'] == aois[1]
+    assert not manifest_file.with_suffix('.tmp').exists()
+
+def test_run_batch_params(tmp_path):
+
+    # the wrong parameters are reported before starting any process
+    with pytest.raises(Exception, match=ms.batch.error.param.format('starts')):
+        run_batch([{'asset': 'users/test/gaul'}], {'starts': 2005}, manifest_file=tmp_path / 'batch.json')
+
+    assert not tmp_path.joinpath('batch.json').exists()
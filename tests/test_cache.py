@@ -0,0 +1,98 @@
+import sys
+import os
+import json
+import itertools
+import multiprocessing
+from types import SimpleNamespace
+
+import pytest
+
+from component.io import Io_15_3_1
+from component.scripts.cache import ResultCache
+
+from .conftest import FakeAoi
+
+cache_module = sys.modules['component.scripts.cache']
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """a cache of 2500 bytes in tmp_path, each call to time.time is 1 second later"""
+
+    clock = itertools.count(1000)
+    monkeypatch.setattr(cache_module, 'time', SimpleNamespace(time=lambda: next(clock)))
+
+    return ResultCache(tmp_path / 'cache', max_size=2500)
+
+def store(cache, aoi_io, io, key, size):
+    """compute a result of size bytes in the folder of key"""
+
+    folder = cache.get_dir(aoi_io, io, key)
+    folder.joinpath('result.tif').write_bytes(b'0' * size)
+    cache.touch(key)
+
+    return folder
+
+def test_evict_least_recently_used(cache, aoi_io, io):
+
+    keys = [f'{i}' * 64 for i in range(6)]
+    folders = [store(cache, aoi_io, io, key, 1000) for key in keys[:2]]
+
+    # key 2 is used by another live process, key 3 never completed (its process is gone)
+    folders.append(store(cache, aoi_io, io, keys[2], 1000))
+    folders.append(cache.get_dir(aoi_io, io, keys[3]))
+    manifest = cache._read()
+    manifest[keys[2]]['running'] = {str(os.getppid()): cache_module.time.time()}
+    manifest[keys[3]]['running'] = {}
+    cache._write(manifest)
+
+    # 4000 bytes: the oldest completed keys are removed until the cache fits
+    folders.append(store(cache, aoi_io, io, keys[4], 1000))
+    manifest = cache._read()
+
+    assert set(manifest) == {keys[2], keys[3], keys[4]}
+    assert [folder.exists() for folder in folders] == [False, False, True, True, True]
+
+    # a result larger than the cache is kept, all the others that can be removed are
+    folder = store(cache, aoi_io, io, keys[5], 3000)
+    manifest = cache._read()
+
+    assert set(manifest) == {keys[2], keys[3], keys[5]}
+    assert folder.exists() and not folders[4].exists()
+    assert manifest[keys[5]]['size'] == 3000
+
+def test_key_stack_mtime(tmp_path, aoi_io, io):
+
+    stack = tmp_path / 'ndvi.tif'
+    stack.write_bytes(b'0')
+    io.backend, io.local_ndvi = 'local', stack
+    cache = ResultCache(tmp_path / 'cache')
+    key = cache.key(aoi_io, io)
+
+    assert cache.key(aoi_io, io) == key
+
+    # the stack is rewritten in place
+    os.utime(stack, (0, 0))
+    assert cache.key(aoi_io, io) != key
+
+def register(root, keys):
+    """register the keys in the manifest from another process"""
+
+    io = Io_15_3_1()
+    io.backend = 'local'
+    cache = ResultCache(root)
+    for key in keys:
+        cache.get_dir(FakeAoi(), io, key)
+
+def test_manifest_lock(tmp_path):
+
+    # the processes of a batch run update the manifest at the same time
+    keys = [[f'{i:02d}{j:02d}' * 16 for j in range(20)] for i in range(4)]
+    processes = [multiprocessing.get_context('fork').Process(target=register, args=(tmp_path / 'cache', k)) for k in keys]
+    [p.start() for p in processes]
+    [p.join() for p in processes]
+
+    manifest = json.loads(tmp_path.joinpath('cache', 'manifest.json').read_text())
+
+    assert [p.exitcode for p in processes] == [0] * 4
+    assert set(manifest) == {key for k in keys for key in k}
+    assert len(list(tmp_path.joinpath('cache').glob('*.tmp'))) == 0
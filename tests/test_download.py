@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from component.scripts.download import merge_tiles
+
+# the layers are 4 tiles of tile_size x tile_size pixels
+tile_size = 2048
+
+def class_map(rng, height, width):
+    """a 1 degraded - 2 stable - 3 improved map made of patches with some noise"""
+
+    data = rng.integers(1, 4, (height // 64, width // 64), dtype=np.uint8).repeat(64, 0).repeat(64, 1)
+    noise = rng.random(data.shape) < 0.1
+    data[noise] = rng.integers(1, 4, noise.sum(), dtype=np.uint8)
+
+    return data
+
+@pytest.fixture(scope='module')
+def layers(tmp_path_factory):
+    """the tiles of an export, the COG merged from them and the stripped GeoTIFF written before the COGs"""
+
+    tmp_path = tmp_path_factory.mktemp('layers')
+    rng = np.random.default_rng(0)
+    data = class_map(rng, 2 * tile_size, 2 * tile_size)
+    meta = {'driver': 'GTiff', 'dtype': 'uint8', 'count': 1, 'crs': 'EPSG:4326', 'nodata': 0}
+    res = 0.00025
+
+    tiles = []
+    for row in range(2):
+        for col in range(2):
+            tile = tmp_path.joinpath(f'layer-{row * tile_size:010d}-{col * tile_size:010d}.tif')
+            transform = from_origin(col * tile_size * res, -row * tile_size * res, res, res)
+            with rio.open(tile, 'w', height=tile_size, width=tile_size, transform=transform, **meta) as dst:
+                dst.write(data[row * tile_size: (row + 1) * tile_size, col * tile_size: (col + 1) * tile_size], 1)
+            tiles.append(tile)
+
+    cog = tmp_path.joinpath('layer_cog.tif')
+    merge_tiles(tiles, cog)
+
+    stripped = tmp_path.joinpath('layer_stripped.tif')
+    transform = from_origin(0, 0, res, res)
+    with rio.open(stripped, 'w', height=data.shape[0], width=data.shape[1], transform=transform, compress='lzw', **meta) as dst:
+        dst.write(data, 1)
+
+    return {'data': data, 'cog': cog, 'stripped': stripped}
+
+def test_merge_tiles(layers):
+
+    with rio.open(layers['cog']) as src:
+
+        assert (src.read(1) == layers['data']).all()
+        assert src.profile['tiled']
+        assert src.overviews(1)
+        assert src.colormap(1)[1]
+
+def read(file, factor):
+    """read the layer as displayed at 1:factor, a 1024 x 1024 window at full resolution or the whole layer decimated"""
+
+    with rio.open(file) as src:
+        if factor == 1:
+            return src.read(1, window=Window(src.width // 4, src.height // 4, 1024, 1024))
+
+        return src.read(1, out_shape=(src.height // factor, src.width // factor), resampling=Resampling.nearest)
+
+@pytest.mark.parametrize('format_', ['cog', 'stripped'])
+@pytest.mark.parametrize('factor', [1, 16])
+def test_read_speed(benchmark, layers, factor, format_):
+
+    data = benchmark(read, layers[format_], factor)
+
+    if benchmark.stats:
+        benchmark.extra_info['Mpix/s'] = data.size / 1e6 / benchmark.stats.stats.mean
@@ -0,0 +1,164 @@
+import sys
+import math
+import os
+
+import pytest
+
+from component.scripts.gdrive import gdrive, DriveIndex
+
+from .fake_drive import FakeDrive
+
+gdrive_module = sys.modules['component.scripts.gdrive']
+
+@pytest.fixture
+def drive(monkeypatch):
+    """a gdrive object using an in memory service and an empty index"""
+
+    service = FakeDrive()
+    monkeypatch.setattr(gdrive, 'build_service', lambda self: service)
+    monkeypatch.setattr(gdrive_module, 'drive_index', DriveIndex())
+
+    return gdrive()
+
+def test_get_items_pages(drive):
+
+    for i in range(2500):
+        drive.service.add(f'file_{i:04d}.tif', b'')
+
+    assert len(drive.get_items()) == 2500
+    assert drive.service.calls['list'] == 3
+
+def test_get_files_tiles(drive):
+
+    for name in ['map.tif', 'map-0000000000-0000000000.tif', 'map-0000000000-0000065536.tif', 'map_2.tif', 'other.tif']:
+        drive.service.add(name, b'0')
+
+    files = drive.get_files('map')
+
+    assert sorted(f['name'] for f in files) == ['map-0000000000-0000000000.tif', 'map-0000000000-0000065536.tif', 'map.tif']
+
+def test_get_files_index(drive):
+
+    drive.service.add('lc.tif', b'0')
+    drive.get_files('lc')
+    drive.get_files('soc')
+
+    # the second search reuses the listing
+    assert drive.service.calls['list'] == 1
+
+    # the files of an export are only listed again once the prefix is invalidated
+    drive.service.add('soc.tif', b'0')
+    assert drive.get_files('soc') == []
+
+    gdrive_module.drive_index.invalidate('soc')
+    assert [f['name'] for f in drive.get_files('soc')] == ['soc.tif']
+    assert drive.service.calls['list'] == 2
+
+def test_get_files_stale_through_full_listing(drive):
+
+    gdrive_module.drive_index.invalidate('soc')
+
+    # the index expired while the export was running: the full listing doesn't clear the prefix
+    gdrive_module.drive_index.date = None
+    drive.get_files('lc')
+    drive.service.add('soc.tif', b'0')
+
+    assert [f['name'] for f in drive.get_files('soc')] == ['soc.tif']
+
+def test_get_files_stale_covering_prefix(drive):
+
+    drive.get_files('lc')
+    gdrive_module.drive_index.invalidate('soc')
+    drive.service.add('soc_2020.tif', b'0')
+    drive.service.add('soc_2021.tif', b'0')
+
+    # the longer prefix is listed once, the rest of the shorter one is still stale
+    assert [f['name'] for f in drive.get_files('soc_2020')] == ['soc_2020.tif']
+    assert [f['name'] for f in drive.get_files('soc_2020')] == ['soc_2020.tif']
+    assert drive.service.calls['list'] == 2
+
+    assert [f['name'] for f in drive.get_files('soc_2021')] == ['soc_2021.tif']
+    assert drive.service.calls['list'] == 3
+
+    # a new invalidation of the shorter prefix covers the longer one again
+    gdrive_module.drive_index.invalidate('soc')
+    drive.get_files('soc_2020')
+    assert drive.service.calls['list'] == 4
+
+    # the listing of the shorter prefix clears everything
+    drive.get_files('soc')
+    assert gdrive_module.drive_index.stale == gdrive_module.drive_index.listed == {}
+
+@pytest.mark.parametrize('size', [0, 1, 1000, 1024])
+def test_download_file(drive, tmp_path, size):
+
+    data = os.urandom(size)
+    drive.service.add('map.tif', data)
+    file = drive.get_files('map')[0]
+
+    dst = drive.download_file(file, tmp_path, chunk_size=256)
+
+    assert dst.read_bytes() == data
+    assert drive.service.calls['get_media'] == math.ceil(size / 256)
+    assert not dst.with_name('map.tif.part').exists()
+
+def test_download_file_resume(drive, tmp_path):
+
+    data = os.urandom(1000)
+    drive.service.add('map.tif', data)
+    file = drive.get_files('map')[0]
+
+    # the connection is lost on the third chunk
+    drive.service.failures['get_media'] = 2
+    with pytest.raises(ConnectionError):
+        drive.download_file(file, tmp_path, chunk_size=100)
+
+    assert tmp_path.joinpath('map.tif.part').stat().st_size == 200
+
+    # only the missing chunks are requested again
+    drive.service.calls.clear()
+    dst = drive.download_file(file, tmp_path, chunk_size=100)
+
+    assert dst.read_bytes() == data
+    assert drive.service.calls['get_media'] == 8
+
+def test_download_file_size(drive, tmp_path):
+
+    data = os.urandom(100)
+    drive.service.add('map.tif', data)
+
+    # files listed without their size
+    dst = drive.download_file({'id': 'id_map.tif', 'name': 'map.tif', 'size': None}, tmp_path)
+
+    assert dst.read_bytes() == data
+    assert drive.service.calls['get'] == 1
+
+def test_delete_files(drive):
+
+    for name in ['map.tif', 'lc.tif']:
+        drive.service.add(name, b'0')
+
+    files = drive.get_files('map')
+    drive.delete_files(files + [{'id': 'id_lc.tif', 'name': 'lc.tif'}])
+
+    assert drive.service.store == {}
+    assert gdrive_module.drive_index.search('') == []
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_download_files_throughput(benchmark, drive, tmp_path, max_workers):
+
+    n_files, size, chunk_size = 8, 4 * 1024 * 1024, 1024 * 1024
+    for i in range(n_files):
+        drive.service.add(f'map-{i:010d}.tif', os.urandom(size))
+    files = drive.get_files('map')
+
+    def download():
+        for file in tmp_path.iterdir():
+            file.unlink()
+        drive.download_files(files, tmp_path, max_workers, chunk_size)
+
+    benchmark(download)
+    if benchmark.stats:
+        benchmark.extra_info['MB/s'] = n_files * size / 1024 ** 2 / benchmark.stats.stats.mean
+
+    assert sum(f.stat().st_size for f in tmp_path.iterdir()) == n_files * size
@@ -0,0 +1,118 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from component import parameter as pm
+from component.message import ms
+from component.scripts.gee import wait_for_completion, search_task
+
+from . import fake_ee
+
+gee_module = sys.modules['component.scripts.gee']
+
+@pytest.fixture
+def polls(monkeypatch):
+    """replace the clock and the sleep of the polling loop, the states of the tasks are updated by the steps (one function per poll)
+
+    Returns:
+        polls (dict): the delays of the sleeps in polls['delays'] and the steps to run in polls['steps']
+    """
+
+    polls = {'delays': [], 'steps': [], 'clock': 0}
+
+    def sleep(delay):
+        polls['delays'].append(delay)
+        polls['clock'] += delay
+        if polls['steps']:
+            polls['steps'].pop(0)()
+
+    monkeypatch.setattr(gee_module, 'time', SimpleNamespace(time=lambda: polls['clock'], sleep=sleep))
+
+    return polls
+
+def start(*descriptions):
+    """submit a task per description"""
+
+    tasks = [fake_ee.batch.Export.image.toDrive(description=d) for d in descriptions]
+    [task.start() for task in tasks]
+
+    return tasks
+
+def set_state(task, state):
+    return lambda: setattr(task, 'state', state)
+
+def test_wait_for_completion(polls, output):
+
+    lc, soc = start('lc', 'soc')
+    polls['steps'] = [set_state(lc, 'RUNNING'), set_state(lc, 'COMPLETED'), set_state(soc, 'FAILED')]
+
+    finished = []
+    states = wait_for_completion(['lc', 'soc'], output, lambda d, s: finished.append((d, s)))
+
+    assert states == {'lc': 'COMPLETED', 'soc': 'FAILED'}
+    assert finished == [('lc', 'COMPLETED'), ('soc', 'FAILED')]
+
+    # a single task list per poll
+    assert fake_ee.calls['Task.list'] == len(polls['delays']) == 3
+
+    # each task reports the time it took to reach its final state
+    msg, _ = output.msgs[-1]
+    assert ms.gee.task_status.format('lc', 'COMPLETED', sum(polls['delays'][:2])) in msg
+    assert ms.gee.task_status.format('soc', 'FAILED', sum(polls['delays'])) in msg
+    assert sum(polls['delays'][:2]) < sum(polls['delays'])
+
+def test_wait_for_completion_backoff(polls, output):
+
+    task, = start('lc')
+    steps = 10
+    polls['steps'] = [lambda: None] * steps + [set_state(task, 'RUNNING')] + [lambda: None] * steps + [set_state(task, 'COMPLETED')]
+
+    wait_for_completion(['lc'], output)
+
+    # the first poll sees the submitted task (READY), then nothing changes
+    delays = polls['delays']
+    assert delays[:2] == [pm.poll_min, pm.poll_min]
+    assert all(b == min(a * pm.poll_factor, pm.poll_max) for a, b in zip(delays[1:steps], delays[2:steps + 1]))
+    assert max(delays) == pm.poll_max
+
+    # the polling is fast again once the task starts running
+    assert delays[steps + 1] == pm.poll_min
+
+def test_wait_for_completion_missing(polls, output):
+
+    task, = start('lc')
+    polls['steps'] = [set_state(task, 'COMPLETED')]
+
+    # the submission of soc failed: the task never shows up in the list
+    states = wait_for_completion(['lc', 'soc'], output)
+
+    assert states == {'lc': 'COMPLETED', 'soc': 'FAILED'}
+    assert len(polls['delays']) == pm.poll_missing_max
+
+def test_search_task_most_recent():
+
+    old, new = start('lc', 'lc')
+    old.state = 'FAILED'
+
+    assert search_task('lc') is new
+    assert search_task('soc') is None
+
+@pytest.mark.parametrize('n_tasks', [10, 100])
+def test_wait_for_completion_requests(benchmark, polls, output, n_tasks):
+
+    descriptions = [f'task_{i}' for i in range(n_tasks)]
+
+    def run():
+        fake_ee.reset()
+        tasks = start(*descriptions)
+        polls['delays'].clear()
+        polls['steps'] = [set_state(task, 'COMPLETED') for task in tasks]
+        return wait_for_completion(descriptions, output)
+
+    states = benchmark(run)
+
+    # the number of requests only depends on the number of polls
+    benchmark.extra_info.update(polls=len(polls['delays']), task_lists=fake_ee.calls['Task.list'])
+    assert fake_ee.calls['Task.list'] == len(polls['delays']) == n_tasks
+    assert set(states.values()) == {'COMPLETED'}
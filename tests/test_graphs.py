@@ -0,0 +1,104 @@
+"""time the construction of the graph of each public gee function and measure the request it sends
+
+run with ``pytest --benchmark-only`` to only get the benchmarks, the sizes are in the extra_info of the report
+"""
+
+import pytest
+
+from component import parameter as pm
+from component import scripts as cs
+
+from . import fake_ee
+
+@pytest.fixture
+def integration(aoi_io, io, output):
+    return cs.integrate_ndvi_climate(aoi_io, io, output)
+
+@pytest.fixture
+def maps(aoi_io, io, output, integration):
+    """the 3 sub-indicators"""
+
+    ndvi_int, climate_int = integration
+    trajectory = cs.productivity_trajectory(io, ndvi_int, climate_int, output)
+    performance = cs.productivity_performance(aoi_io, io, ndvi_int, climate_int, output)
+    state = cs.productivity_state(aoi_io, io, ndvi_int, climate_int, output)
+
+    productivity = cs.productivity_final(trajectory, performance, state, io.productivity_table, output)
+    land_cover = cs.land_cover(io, aoi_io, output)
+    soc = cs.soil_organic_carbon(io, aoi_io, output)
+
+    return productivity, land_cover, soc
+
+@pytest.mark.parametrize('i, name', [(0, 'ndvi_int'), (1, 'climate_int')])
+def test_integrate_ndvi_climate(measure, aoi_io, io, output, i, name):
+
+    stage = measure(name, lambda: cs.integrate_ndvi_climate(aoi_io, io, output)[i])
+
+    assert stage['getinfo'] == 0
+
+@pytest.mark.parametrize('fit', pm.trend_fits)
+@pytest.mark.parametrize('trajectory', ['ndvi_trend', 'p_restrend', 'ue_trend'])
+def test_productivity_trajectory(measure, io, output, integration, trajectory, fit):
+
+    io.trajectory, io.trend_fit = trajectory, fit
+    stage = measure('trajectory', cs.productivity_trajectory, io, *integration, output)
+
+    assert stage['getinfo'] == 0
+    assert (fake_ee.calls['Reducer.sensSlope'] > 0) == (fit == 'theil_sen')
+
+@pytest.mark.parametrize('percentile_error', [None, pm.percentile_error])
+def test_productivity_performance(measure, aoi_io, io, output, integration, percentile_error):
+
+    io.percentile_error = percentile_error
+    stage = measure('performance', cs.productivity_performance, aoi_io, io, *integration, output)
+
+    assert stage['getinfo'] == 0
+
+def test_productivity_state(measure, aoi_io, io, output, integration):
+
+    stage = measure('state', cs.productivity_state, aoi_io, io, *integration, output)
+
+    assert stage['getinfo'] == 0
+
+def test_productivity_final(measure, aoi_io, io, output, integration):
+
+    ndvi_int, climate_int = integration
+    trajectory = cs.productivity_trajectory(io, ndvi_int, climate_int, output)
+    performance = cs.productivity_performance(aoi_io, io, ndvi_int, climate_int, output)
+    state = cs.productivity_state(aoi_io, io, ndvi_int, climate_int, output)
+
+    stage = measure('productivity', cs.productivity_final, trajectory, performance, state, io.productivity_table, output)
+
+    assert stage['getinfo'] == 0
+
+def test_land_cover(measure, aoi_io, io, output):
+
+    stage = measure('land_cover', cs.land_cover, io, aoi_io, output)
+
+    assert stage['getinfo'] == 0
+
+def test_soil_organic_carbon(measure, aoi_io, io, output):
+
+    stage = measure('soc', cs.soil_organic_carbon, io, aoi_io, output)
+
+    assert stage['getinfo'] == 0
+
+def test_indicator_15_3_1(measure, output, maps):
+
+    stage = measure('indicator', cs.indicator_15_3_1, *maps, output)
+
+    assert stage['getinfo'] == 0
+
+def test_mann_kendall(measure, integration):
+
+    stage = measure('mann_kendall', cs.mann_kendall, integration[0].select('ndvi'))
+
+    assert stage['getinfo'] == 0
+
+def test_compute_indicator_maps(benchmark, aoi_io, io, output):
+
+    benchmark(cs.compute_indicator_maps, aoi_io, io, output)
+    benchmark.extra_info.update(io.graph_report)
+
+    assert set(io.graph_report) == {'ndvi_int', 'climate_int', 'trajectory', 'performance', 'state', 'land_cover', 'soc', 'productivity', 'indicator'}
+    assert all(stage['getinfo'] == 0 for stage in io.graph_report.values())
@@ -0,0 +1,65 @@
+import subprocess
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# maximum time to import component.parameter and component.scripts once the ui libs are loaded (s)
+import_budget = 1
+
+# modules that are only needed by some functions and must not be loaded by the import
+heavy_modules = ['geemap', 'geopandas', 'pandas', 'rasterio', 'matplotlib', 'googleapiclient', 'apiclient', 'zarr', 'shapely']
+
+script = '''
+import json
+import sys
+import time
+
+from tests import fake_ee
+sys.modules['ee'] = fake_ee
+
+# the ui libs are loaded by the notebooks anyway
+import ipyvuetify
+import sepal_ui.translator
+
+before = set(sys.modules)
+start = time.perf_counter()
+import component.parameter
+import component.scripts
+duration = time.perf_counter() - start
+
+print(json.dumps({'duration': duration, 'modules': sorted(set(sys.modules) - before), 'calls': dict(fake_ee.calls)}))
+'''
+
+def import_package():
+    """import the package in a new interpreter, return the import time, the modules it loaded and the ee calls"""
+
+    root = Path(__file__).parents[1]
+    result = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True, check=True)
+
+    return json.loads(result.stdout.splitlines()[-1])
+
+@pytest.fixture(scope='module')
+def imports():
+    return [import_package() for _ in range(3)]
+
+def test_import_time(imports):
+
+    assert min(i['duration'] for i in imports) < import_budget
+
+def test_import_modules(imports):
+
+    modules = imports[0]['modules']
+    assert [m for m in heavy_modules if m in modules] == []
+
+def test_import_no_initialize(imports):
+
+    # ee is only initialized by the functions that talk to the server
+    assert imports[0]['calls'] == {}
+
+def test_import_speed(benchmark):
+    """the time of the interpreter, the time of the import alone is in the extra_info"""
+
+    result = benchmark.pedantic(import_package, rounds=5)
+    benchmark.extra_info['import_s'] = result['duration']
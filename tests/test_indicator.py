@@ -0,0 +1,114 @@
+import json
+
+import numpy as np
+import pytest
+
+from component.scripts.run_15_3_1 import indicator_15_3_1, indicator_15_3_1_local
+from component.scripts.graph import count_nodes
+
+from . import fake_ee as ee
+
+def legacy_indicator_15_3_1(productivity, landcover, soc, zero):
+    """the where chain used before the lookup table, zero is the image of 0 (ee.Image(0) or LocalImage(0))"""
+
+    indicator = zero \
+    .where(productivity.eq(3).And(landcover.eq(3)).And(soc.eq(3)),3) \
+    .where(productivity.eq(3).And(landcover.eq(3)).And(soc.eq(2)),3) \
+    .where(productivity.eq(3).And(landcover.eq(3)).And(soc.eq(1)),1) \
+    .where(productivity.eq(3).And(landcover.eq(2)).And(soc.eq(3)),3) \
+    .where(productivity.eq(3).And(landcover.eq(2)).And(soc.eq(2)),3) \
+    .where(productivity.eq(3).And(landcover.eq(2)).And(soc.eq(1)),1) \
+    .where(productivity.eq(3).And(landcover.eq(1)).And(soc.eq(3)),1) \
+    .where(productivity.eq(3).And(landcover.eq(1)).And(soc.eq(2)),1) \
+    .where(productivity.eq(3).And(landcover.eq(1)).And(soc.eq(1)),1) \
+    .where(productivity.eq(2).And(landcover.eq(3)).And(soc.eq(3)),3) \
+    .where(productivity.eq(2).And(landcover.eq(3)).And(soc.eq(2)),3) \
+    .where(productivity.eq(2).And(landcover.eq(3)).And(soc.eq(1)),1) \
+    .where(productivity.eq(2).And(landcover.eq(2)).And(soc.eq(3)),3) \
+    .where(productivity.eq(2).And(landcover.eq(2)).And(soc.eq(2)),2) \
+    .where(productivity.eq(2).And(landcover.eq(2)).And(soc.eq(1)),1) \
+    .where(productivity.eq(2).And(landcover.eq(1)).And(soc.eq(3)),1) \
+    .where(productivity.eq(2).And(landcover.eq(1)).And(soc.eq(2)),1) \
+    .where(productivity.eq(2).And(landcover.eq(1)).And(soc.eq(1)),1) \
+    .where(productivity.eq(1).And(landcover.eq(3)).And(soc.eq(3)),1) \
+    .where(productivity.eq(1).And(landcover.eq(3)).And(soc.eq(2)),1) \
+    .where(productivity.eq(1).And(landcover.eq(3)).And(soc.eq(1)),1) \
+    .where(productivity.eq(1).And(landcover.eq(2)).And(soc.eq(3)),1) \
+    .where(productivity.eq(1).And(landcover.eq(2)).And(soc.eq(2)),1) \
+    .where(productivity.eq(1).And(landcover.eq(2)).And(soc.eq(1)),1) \
+    .where(productivity.eq(1).And(landcover.eq(1)).And(soc.eq(3)),1) \
+    .where(productivity.eq(1).And(landcover.eq(1)).And(soc.eq(2)),1) \
+    .where(productivity.eq(1).And(landcover.eq(1)).And(soc.eq(1)),1) \
+    .where(productivity.eq(1).And(landcover.lt(1)).And(soc.lt(1)),1) \
+    .where(productivity.lt(1).And(landcover.eq(1)).And(soc.lt(1)),1) \
+    .where(productivity.lt(1).And(landcover.lt(1)).And(soc.eq(1)),1) \
+    .where(productivity.eq(2).And(landcover.lt(1)).And(soc.lt(1)),2) \
+    .where(productivity.lt(1).And(landcover.eq(2)).And(soc.lt(1)),2) \
+    .where(productivity.lt(1).And(landcover.lt(1)).And(soc.eq(2)),2) \
+    .where(productivity.eq(3).And(landcover.lt(1)).And(soc.lt(1)),3) \
+    .where(productivity.lt(1).And(landcover.eq(3)).And(soc.lt(1)),3) \
+    .where(productivity.lt(1).And(landcover.lt(1)).And(soc.eq(3)),3)
+
+    return indicator
+
+class LocalImage(object):
+    """numpy array with the ee.Image methods of the legacy where chain"""
+
+    def __init__(self, array):
+        self.array = np.asarray(array)
+
+    def eq(self, value):
+        return LocalImage(self.array == value)
+
+    def lt(self, value):
+        return LocalImage(self.array < value)
+
+    def And(self, other):
+        return LocalImage(self.array & other.array)
+
+    def where(self, test, value):
+        return LocalImage(np.where(test.array, value, self.array))
+
+@pytest.fixture
+def images():
+    return [ee.Image(f'users/test/{name}') for name in ['productivity', 'land_cover', 'soc']]
+
+def test_indicator_nodes(images, output):
+
+    nodes = count_nodes(json.loads(indicator_15_3_1(*images, output).serialize()))
+    legacy = count_nodes(json.loads(legacy_indicator_15_3_1(*images, ee.Image(0)).uint8().serialize()))
+
+    assert ee.calls['Image.remap'] == 1
+    assert nodes < legacy / 5
+
+@pytest.mark.parametrize('function', [indicator_15_3_1, 'legacy'])
+def test_indicator_graph(measure, images, output, function):
+
+    if function == 'legacy':
+        measure('indicator', lambda: legacy_indicator_15_3_1(*images, ee.Image(0)).uint8())
+    else:
+        measure('indicator', function, *images, output)
+
+def test_indicator_table():
+
+    # all the combinations of classes, 0 is the nodata (a masked land cover in the ee graph)
+    productivity, landcover, soc = (c.ravel() for c in np.meshgrid(*[np.arange(4, dtype=np.uint8)] * 3, indexing='ij'))
+
+    indicator = indicator_15_3_1_local(productivity, landcover, soc)
+    legacy = legacy_indicator_15_3_1(*(LocalImage(c) for c in [productivity, landcover, soc]), LocalImage(np.zeros(64))).array
+
+    # the land cover is the only sub-indicator that can be masked, it masks the indicator
+    masked = landcover == 0
+    assert (indicator[masked] == 0).all()
+    assert (indicator[~masked] == legacy[~masked]).all()
+
+@pytest.mark.parametrize('size', [1024, 4096])
+def test_indicator_local_speed(benchmark, size):
+
+    rng = np.random.default_rng(0)
+    productivity, landcover, soc = rng.integers(0, 4, (3, size, size), dtype=np.uint8)
+
+    benchmark(indicator_15_3_1_local, productivity, landcover, soc)
+
+    if benchmark.stats:
+        benchmark.extra_info['Mpix/s'] = size * size / 1e6 / benchmark.stats.stats.mean
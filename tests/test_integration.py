@@ -0,0 +1,49 @@
+import sys
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from component.scripts.integration import int_yearly_ndvi, int_yearly_climate, int_yearly_ndvi_local, int_yearly_climate_local
+
+from . import numpy_ee
+
+integration_module = sys.modules['component.scripts.integration']
+
+@pytest.fixture
+def observations():
+    """an irregular time series: 3 images in january, 1 in june and 2 in september of each year, 20% masked"""
+
+    rng = np.random.default_rng(0)
+    dates = [datetime(year, month, day) for year in range(2001, 2004) for month, day in [(1, 2), (1, 12), (1, 22), (6, 15), (9, 1), (9, 20)]]
+    stack = rng.normal(5000, 1000, (len(dates), 8, 8)).astype(np.float32)
+    stack[rng.random(stack.shape) < 0.2] = np.nan
+
+    return dates, stack
+
+def evaluate(function, band, dates, stack, start, end, monkeypatch):
+    """run the gee function on numpy_ee images of band, return the yearly integration (first band) as a (years, rows, cols) array"""
+
+    monkeypatch.setattr(integration_module, 'ee', numpy_ee)
+    collection = numpy_ee.ImageCollection(numpy_ee.image({band: data}, date) for date, data in zip(dates, stack))
+
+    return np.stack([next(iter(image.bands.values())) for image in function(collection, start, end).images])
+
+def test_int_yearly_ndvi_parity(observations, monkeypatch):
+
+    dates, stack = observations
+    gee = evaluate(int_yearly_ndvi, 'ndvi', dates, stack, 2001, 2003, monkeypatch)
+    local = int_yearly_ndvi_local(stack, dates, 2001, 2003)
+
+    np.testing.assert_allclose(local, gee, rtol=1e-6)
+
+    # each month counts once: it is not the mean of the images of the year
+    assert not np.allclose(local, np.stack([np.nanmean(stack[i: i + 6], axis=0) for i in range(0, 18, 6)]), equal_nan=True)
+
+def test_int_yearly_climate_parity(observations, monkeypatch):
+
+    dates, stack = observations
+    gee = evaluate(int_yearly_climate, 'precipitation', dates, stack, 2001, 2003, monkeypatch)
+    local = int_yearly_climate_local(stack, dates, 2001, 2003)
+
+    np.testing.assert_allclose(local, gee, rtol=1e-6)
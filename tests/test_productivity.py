@@ -0,0 +1,311 @@
+import json
+
+import numpy as np
+import pytest
+
+from component import parameter as pm
+from component.scripts.productivity import mann_kendall, mann_kendall_local, trend_fit_local, exact_percentile_local, HistogramSketch
+from component.scripts.productivity import ndvi_climate_merge, p_restrend_local, ue_trend_local
+from component.scripts.productivity import nanpercentile_local, percentile_classes_local, productivity_state_local
+from component.scripts.graph import count_nodes
+
+from . import fake_ee as ee
+
+def legacy_mann_kendall(imageCollection):
+    """the S statistic computed with a pair of images per pair of years, as before the array version"""
+
+    TimeSeriesList = imageCollection.toList(50)
+
+    NumberOfItems = TimeSeriesList.length().getInfo()
+    ConcordantArray = []
+    DiscordantArray = []
+    for i in range(0, NumberOfItems - 1):
+        CurrentImage = ee.Image(TimeSeriesList.get(i))
+        for j in range(i + 1, NumberOfItems):
+            nextImage = ee.Image(TimeSeriesList.get(j))
+            ConcordantArray.append(CurrentImage.lt(nextImage))
+            DiscordantArray.append(CurrentImage.gt(nextImage))
+
+    ConcordantSum = ee.ImageCollection(ConcordantArray).sum()
+    DiscordantSum = ee.ImageCollection(DiscordantArray).sum()
+
+    return ConcordantSum.subtract(DiscordantSum)
+
+def yearly_collection(n):
+    """a collection of n yearly images"""
+
+    ee.data.values['List.length'] = n
+
+    return ee.ImageCollection([ee.Image(f'users/test/ndvi_{2000 + i}').set('year', 2000 + i) for i in range(n)])
+
+def nodes(obj):
+    return count_nodes(json.loads(obj.serialize()))
+
+def test_mann_kendall_nodes():
+
+    array = {n: nodes(mann_kendall(yearly_collection(n))) for n in [10, 20, 40]}
+    legacy = {n: nodes(legacy_mann_kendall(yearly_collection(n))) for n in [10, 20, 40]}
+
+    # only the images of the collection depend on n, the pairs of images of the legacy graph grow in n²
+    assert array[40] - array[20] == 2 * (array[20] - array[10])
+    assert legacy[40] - legacy[20] > 3 * (legacy[20] - legacy[10])
+    assert all(array[n] < legacy[n] for n in array)
+    assert array[40] < legacy[40] / 10
+
+def test_mann_kendall_getinfo():
+
+    mann_kendall(yearly_collection(20))
+
+    assert ee.calls['getInfo'] == 0
+
+@pytest.mark.parametrize('function', [mann_kendall, legacy_mann_kendall])
+@pytest.mark.parametrize('n', [10, 20, 40])
+def test_mann_kendall_graph(measure, n, function):
+
+    collection = yearly_collection(n)
+    measure('mann_kendall', function, collection)
+
+@pytest.fixture
+def stack():
+
+    rng = np.random.default_rng(0)
+
+    def stack(n, size=256):
+        stack = rng.integers(0, 50, (n, size, size)).astype(np.float32)
+        stack[rng.random(stack.shape) < 0.1] = np.nan
+        return stack
+
+    return stack
+
+def test_mann_kendall_local(stack):
+
+    # few distinct values so that most pixels have ties
+    stack = stack(12, 8) // 10
+
+    # a masked pixel, a single value and only ties
+    stack[:, 0, 0] = np.nan
+    stack[1:, 0, 1] = np.nan
+    stack[:, 0, 2] = 3
+    mk_trend = mann_kendall_local(stack)
+
+    for row, col in np.ndindex(stack.shape[1:]):
+        values = stack[:, row, col]
+        values = values[~np.isnan(values)]
+        n = len(values)
+
+        if n < 2:
+            assert np.isnan(mk_trend[:, row, col]).all()
+            continue
+
+        s = sum(np.sign(values[j] - values[i]) for i in range(n) for j in range(i + 1, n))
+        ties = np.unique(values, return_counts=True)[1]
+        var = (n * (n - 1) * (2 * n + 5) - sum(t * (t - 1) * (2 * t + 5) for t in ties)) / 18
+        z = (s - np.sign(s)) / np.sqrt(var) if s else 0
+
+        assert mk_trend[0, row, col] == s
+        assert mk_trend[1, row, col] == pytest.approx(var)
+        assert mk_trend[2, row, col] == pytest.approx(z)
+
+@pytest.mark.parametrize('n', [10, 20, 40])
+def test_mann_kendall_local_speed(benchmark, stack, n):
+
+    stack = stack(n)
+    benchmark(mann_kendall_local, stack)
+
+    if benchmark.stats:
+        benchmark.extra_info['Mpix/s'] = stack[0].size / 1e6 / benchmark.stats.stats.mean
+
+@pytest.mark.parametrize('n', [20, 35])
+def test_trend_fit_local(stack, n):
+
+    years = np.arange(2001, 2001 + n)
+    stack = stack(n, 8)
+
+    ols_scale, ols_offset = trend_fit_local(years, stack, 'ols')
+    ts_scale, ts_offset = trend_fit_local(years, stack, 'theil_sen')
+
+    for row, col in np.ndindex(stack.shape[1:]):
+        values = stack[:, row, col]
+        valid = ~np.isnan(values)
+        x, y = years[valid], values[valid].astype(np.float64)
+
+        scale, offset = np.polyfit(x, y, 1)
+        assert ols_scale[row, col] == pytest.approx(scale, abs=1e-3)
+        assert ols_offset[row, col] == pytest.approx(offset, rel=1e-3)
+
+        slopes = [(y[j] - y[i]) / (x[j] - x[i]) for i in range(len(x)) for j in range(i + 1, len(x))]
+        assert ts_scale[row, col] == pytest.approx(np.median(slopes), abs=1e-4)
+
+@pytest.mark.parametrize('fit', pm.trend_fits)
+@pytest.mark.parametrize('n', [20, 35])
+def test_trend_fit_local_speed(benchmark, stack, n, fit):
+
+    years = np.arange(2001, 2001 + n)
+    stack = stack(n)
+    benchmark(trend_fit_local, years, stack, fit)
+
+    if benchmark.stats:
+        benchmark.extra_info['Mpix/s'] = stack[0].size / 1e6 / benchmark.stats.stats.mean
+
+@pytest.mark.parametrize('max_values', [10**6, 1000])
+def test_exact_percentile_local(max_values):
+
+    rng = np.random.default_rng(0)
+    groups = rng.integers(0, 5, 10000)
+    values = rng.normal(5000, 1000, 10000)
+    windows = [(groups[i: i + 500], values[i: i + 500]) for i in range(0, 10000, 500)]
+
+    quantiles, exact = exact_percentile_local(windows, 90, max_values)
+
+    # above max_values the nearest rank percentile is approximated within pm.percentile_error
+    assert exact == (max_values >= values.size)
+    for code in range(5):
+        if exact:
+            assert quantiles[code] == np.percentile(values[groups == code], 90)
+        else:
+            assert quantiles[code] == pytest.approx(np.percentile(values[groups == code], 90, method='inverted_cdf'), abs=pm.percentile_error)
+
+@pytest.mark.parametrize('error', [pm.percentile_error, 1])
+def test_histogram_sketch_merge(error):
+
+    rng = np.random.default_rng(0)
+    groups = rng.integers(0, 5, 20000)
+    values = np.concatenate([rng.normal(5000, 1000, 10000), rng.uniform(-2000, 9000, 10000)])
+
+    # one sketch per window, group 4 is only in the last window
+    groups[groups == 4] = 3
+    groups[-100:] = 4
+    sketches = [HistogramSketch(error).update(groups[i: i + 2500], values[i: i + 2500]) for i in range(0, 20000, 2500)]
+    sketch = sketches[0]
+    [sketch.merge(other) for other in sketches[1:]]
+
+    # the merged counts are the counts of a single sketch of all the values
+    quantiles = sketch.quantile(90)
+    assert quantiles == HistogramSketch(error).update(groups, values).quantile(90)
+
+    for code in range(5):
+        assert quantiles[code] == pytest.approx(np.percentile(values[groups == code], 90, method='inverted_cdf'), abs=error)
+
+def test_ndvi_climate_merge_period():
+
+    ndvi_climate_merge(ee.ImageCollection('users/test/clim'), ee.ImageCollection('users/test/ndvi'), 2001, 2010)
+
+    # both collections are reduced to the years of the period before the join
+    assert ee.calls['Filter.rangeContains'] == 1
+    assert ee.calls['ImageCollection.filter'] == 2
+
+@pytest.fixture
+def ndvi_climate():
+    """yearly ndvi partly explained by the climate, 10% masked"""
+
+    rng = np.random.default_rng(0)
+    years = np.arange(2001, 2021)
+    climate = rng.gamma(4, 200, (len(years), 8, 8)).astype(np.float32)
+    ndvi = (3000 + 2 * climate + rng.normal(0, 100, climate.shape) + rng.normal(0, 30, (1, 8, 8)) * (years - 2001)[:, None, None]).astype(np.float32)
+    ndvi[rng.random(ndvi.shape) < 0.1] = np.nan
+    climate[rng.random(climate.shape) < 0.05] = np.nan
+
+    return years, ndvi, climate
+
+def test_p_restrend_local(ndvi_climate):
+
+    years, ndvi, climate = ndvi_climate
+    scale, mk_trend = p_restrend_local(years, ndvi, climate)
+
+    for row, col in np.ndindex(ndvi.shape[1:]):
+        valid = ~np.isnan(ndvi[:, row, col]) & ~np.isnan(climate[:, row, col])
+        x, y = climate[valid, row, col].astype(np.float64), ndvi[valid, row, col].astype(np.float64)
+
+        # residuals of the least square fit of the ndvi against the climate, then their trend
+        coefficients = np.linalg.lstsq(np.stack([np.ones_like(x), x], axis=1), y, rcond=None)[0]
+        residuals = y - (coefficients[0] + coefficients[1] * x)
+        assert scale[row, col] == pytest.approx(np.polyfit(years[valid], residuals, 1)[0], abs=1e-2)
+
+        s = sum(np.sign(residuals[j] - residuals[i]) for i in range(len(x)) for j in range(i + 1, len(x)))
+        assert mk_trend[0, row, col] == s
+
+def test_ue_trend_local(ndvi_climate):
+
+    years, ndvi, climate = ndvi_climate
+    scale, mk_trend = ue_trend_local(years, ndvi, climate)
+
+    for row, col in np.ndindex(ndvi.shape[1:]):
+        valid = ~np.isnan(ndvi[:, row, col]) & ~np.isnan(climate[:, row, col])
+        ue = ndvi[valid, row, col].astype(np.float64) / (climate[valid, row, col].astype(np.float64) / 1000)
+
+        assert scale[row, col] == pytest.approx(np.polyfit(years[valid], ue, 1)[0], rel=1e-3)
+
+def where_chain(ndvi_mean, ndvi_perc):
+    """the percentile classes computed as the gee where chain of productivity_state"""
+
+    classes = np.full(ndvi_mean.shape, pm.int_16_min)
+    classes[ndvi_mean <= ndvi_perc[0]] = 1
+    for i in range(9):
+        classes[ndvi_mean > ndvi_perc[i]] = i + 2
+
+    return classes
+
+@pytest.mark.parametrize('axis', [0, 2])
+def test_nanpercentile_local(stack, axis):
+
+    stack = stack(15, 16)
+
+    # from all masked pixels to fully valid ones
+    stack[:, 0, 0] = np.nan
+    stack[1:, 0, 1] = np.nan
+    stack[:, 0, 2] = 7
+    stack = np.moveaxis(stack, 0, axis)
+
+    percentiles = [0, 10, 25, 50, 90, 100]
+    with pytest.warns(RuntimeWarning):
+        expected = np.nanpercentile(stack, percentiles, axis=axis)
+
+    np.testing.assert_allclose(nanpercentile_local(stack, percentiles, axis=axis), expected, rtol=1e-6)
+
+def test_percentile_classes_local(stack):
+
+    stack = stack(12, 16)
+    ndvi_perc = np.nanpercentile(stack, np.arange(10, 110, 10), axis=0)
+    ndvi_means = np.stack([np.nanmean(stack[:6], axis=0), np.nanmean(stack[6:], axis=0)])
+
+    # masked means and masked percentiles
+    ndvi_means[0, 0, :3] = np.nan
+    ndvi_perc[:, 1, :3] = np.nan
+
+    # the values on the edges of the classes
+    ndvi_means[1, 2] = ndvi_perc[np.arange(16) % 10, 2, np.arange(16)]
+
+    for ndvi_mean, classes in zip(ndvi_means, percentile_classes_local(ndvi_means, ndvi_perc)):
+        np.testing.assert_array_equal(classes, where_chain(ndvi_mean, ndvi_perc))
+        np.testing.assert_array_equal(percentile_classes_local(ndvi_mean, ndvi_perc), classes)
+
+def test_productivity_state_local(io):
+
+    rng = np.random.default_rng(0)
+    years = np.arange(io.start, io.end + 1)
+    ndvi_int = rng.normal(5000, 300, (len(years), 32, 32)).astype(np.float32)
+    ndvi_int[years > io.baseline_end] += rng.normal(0, 400, (32, 32)).astype(np.float32)
+    ndvi_int[rng.random(ndvi_int.shape) < 0.1] = np.nan
+    ndvi_int[:, 0, 0] = np.nan
+
+    # reference: np.nanpercentile and the where chain on the extended baseline
+    baseline = ndvi_int[years <= io.baseline_end]
+    target = ndvi_int[years >= io.target_start]
+    with pytest.warns(RuntimeWarning):
+        low, high = np.nanmin(baseline, axis=0), np.nanmax(baseline, axis=0)
+        extended = np.concatenate([baseline, [low - (high - low) * 0.05], [high + (high - low) * 0.05]])
+        ndvi_perc = np.nanpercentile(extended, np.arange(10, 110, 10), axis=0)
+        baseline_mean, target_mean = np.nanmean(baseline, axis=0), np.nanmean(target, axis=0)
+
+    change = where_chain(target_mean, ndvi_perc) - where_chain(baseline_mean, ndvi_perc)
+    change[np.abs(baseline_mean - target_mean) <= 100] = 0
+    state = np.full(change.shape, pm.int_16_min)
+    state[change >= 2] = 3
+    state[(change <= -2) & (change != pm.int_16_min)] = 1
+    state[(change < 2) & (change > -2)] = 2
+
+    result = productivity_state_local(io, ndvi_int)
+
+    assert result.dtype == np.uint8
+    np.testing.assert_array_equal(result, np.clip(state, 0, 255))
+    assert set(np.unique(result[1:])) == {1, 2, 3}
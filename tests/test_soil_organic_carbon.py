@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from component.scripts import soil_organic_carbon
+from component.scripts.graph import count_nodes
+
+from . import fake_ee
+
+# nodes of the soc graph, the yearly changes are a single iterate whatever the period
+max_nodes = 150
+
+def soc_nodes(io, aoi_io, output):
+
+    soc = soil_organic_carbon(io, aoi_io, output)
+
+    return count_nodes(json.loads(soc.serialize()))
+
+@pytest.mark.parametrize('conversion_coef', [0.8, None])
+def test_soc_nodes_independent_of_period(io, aoi_io, output, conversion_coef):
+
+    io.conversion_coef = conversion_coef
+
+    nodes = {}
+    for start in [1995, 2001, 2010, 2015]:
+        io.start = start
+        nodes[start] = soc_nodes(io, aoi_io, output)
+
+    assert len(set(nodes.values())) == 1
+    assert nodes[2001] <= max_nodes
+
+def test_soc_single_iterate(io, aoi_io, output):
+
+    soil_organic_carbon(io, aoi_io, output)
+
+    assert fake_ee.calls['List.iterate'] == 1
+    assert fake_ee.calls['getInfo'] == 0
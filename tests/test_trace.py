@@ -0,0 +1,84 @@
+import sys
+import json
+import threading
+
+import pytest
+
+from component.scripts.trace import Tracer, traced
+
+trace_module = sys.modules['component.scripts.trace']
+
+def test_span_nesting():
+
+    tracer = Tracer()
+    with tracer.span('compute'):
+        with tracer.span('download', file='map.tif') as args:
+            args['bytes'] = 1024
+
+    # the inner span ends first and lies within the outer one
+    download, compute = tracer.events
+
+    assert (download['name'], compute['name']) == ('download', 'compute')
+    assert compute['ts'] <= download['ts']
+    assert download['ts'] + download['dur'] <= compute['ts'] + compute['dur']
+    assert download['args'] == {'file': 'map.tif', 'bytes': 1024}
+
+def test_span_exception():
+
+    tracer = Tracer()
+    with pytest.raises(ValueError):
+        with tracer.span('compute'):
+            raise ValueError
+
+    # the failed stages are recorded too
+    assert [event['name'] for event in tracer.events] == ['compute']
+
+def test_summary():
+
+    tracer = Tracer()
+    for size in [100, 200]:
+        with tracer.span('download') as args:
+            args['bytes'] = size
+    with tracer.span('statistics'):
+        pass
+
+    summary = tracer.summary()
+
+    assert {name: (stage['calls'], stage['bytes']) for name, stage in summary.items()} == {'download': (2, 300), 'statistics': (1, 0)}
+    assert summary['download']['time'] == pytest.approx(sum(event['dur'] for event in tracer.events[:2]) / 1e6)
+
+    tracer.reset()
+    assert tracer.summary() == {}
+
+def test_write(tmp_path):
+
+    tracer = Tracer()
+    with tracer.span('compute', aoi=tmp_path):
+        def download():
+            with tracer.span('download'):
+                pass
+        thread = threading.Thread(target=download)
+        thread.start()
+        thread.join()
+
+    trace = json.loads(tracer.write(tmp_path / 'trace.json').read_text())
+
+    # complete events in µs, one row per thread
+    assert trace['displayTimeUnit'] == 'ms'
+    assert [event['name'] for event in trace['traceEvents']] == ['download', 'compute']
+    assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in trace['traceEvents'])
+    assert len({event['tid'] for event in trace['traceEvents']}) == 2
+    assert trace['traceEvents'][1]['args'] == {'aoi': str(tmp_path)}
+
+def test_traced(monkeypatch):
+
+    tracer = Tracer()
+    monkeypatch.setattr(trace_module, 'tracer', tracer)
+
+    @traced('compute')
+    def compute(a, b=1):
+        return a + b
+
+    assert compute(1, b=2) == 3
+    assert compute.__name__ == 'compute'
+    assert tracer.summary()['compute']['calls'] == 1
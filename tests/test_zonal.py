@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+import geopandas as gpd
+from shapely.geometry import box
+
+from component.scripts.zonal import rasterize_zones, zonal_areas, zonal_statistics_local, pixel_areas
+
+# semi major axis and flattening of WGS84
+A, F = 6378137, 1 / 298.257223563
+
+def authalic_band_area(south, north):
+    """area (m²) of the band between 2 latitudes (degrees) on the authalic sphere: pi a² (q(north) - q(south))"""
+
+    e = np.sqrt(F * (2 - F))
+
+    def q(lat):
+        sin = np.sin(np.radians(lat))
+        return (1 - e ** 2) * (sin / (1 - (e * sin) ** 2) - np.log((1 - e * sin) / (1 + e * sin)) / (2 * e))
+
+    return np.pi * A ** 2 * (q(north) - q(south))
+
+@pytest.mark.parametrize('south', [0, 45, -89])
+def test_pixel_areas_band(south):
+
+    # a 1° band of 0.01° pixels
+    areas = pixel_areas(from_origin(-180, south + 1, 0.01, 0.01), 100, CRS.from_epsg(4326))
+
+    assert areas.sum() * 36000 == pytest.approx(authalic_band_area(south, south + 1), rel=1e-9)
+    assert not areas.flags.writeable
+
+def test_pixel_areas_earth():
+
+    areas = pixel_areas(from_origin(-180, 90, 1, 1), 180, CRS.from_epsg(4326))
+
+    # the surface of the WGS84 ellipsoid
+    assert areas.sum() * 360 == pytest.approx(510065621.7e6, rel=1e-9)
+
+def test_pixel_areas_projected():
+
+    areas = pixel_areas(from_origin(500000, 100000, 30, 30), 10, CRS.from_epsg(32630))
+
+    assert (areas == 900).all()
+
+@pytest.fixture
+def classes(tmp_path):
+    """a 64 x 64 raster of 4 classes on a geographic grid of 0.5° pixels, tiled by 16 x 16 blocks"""
+
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 4, (64, 64)).astype(np.uint8)
+    transform = from_origin(10, 50, 0.5, 0.5)
+
+    raster = tmp_path / 'classes.tif'
+    profile = dict(driver='GTiff', width=64, height=64, count=1, dtype='uint8', crs='EPSG:4326', transform=transform, tiled=True, blockxsize=16, blockysize=16)
+    with rio.open(raster, 'w', **profile) as dst:
+        dst.write(data, 1)
+
+    return raster, data, transform
+
+@pytest.fixture
+def zones():
+    """2 polygons on the pixel edges, the west one crosses the blocks, the last column is out of both"""
+
+    return gpd.GeoDataFrame(geometry=[box(10, 30, 20.5, 50), box(20.5, 22, 41.5, 45)], crs='EPSG:4326')
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_zonal_areas(classes, zones, tmp_path, max_workers):
+
+    raster, data, transform = classes
+    zone_file = rasterize_zones(zones, raster, tmp_path / 'zones.tif', block_size=16, max_workers=max_workers)
+
+    # the zone of each pixel is the 1-based position of the polygon it's in
+    rows, cols = np.mgrid[:64, :64]
+    lons, lats = transform * (cols + 0.5, rows + 0.5)
+    expected_zones = np.zeros((64, 64), dtype=int)
+    for i, (west, south, east, north) in enumerate(zones.bounds.values):
+        expected_zones[(lons > west) & (lons < east) & (lats > south) & (lats < north)] = i + 1
+
+    with rio.open(zone_file) as src:
+        np.testing.assert_array_equal(src.read(1), expected_zones)
+
+    # the pixels of each (zone, class) weighted by the area of their row
+    row_areas = np.array([authalic_band_area(50 - 0.5 * (row + 1), 50 - 0.5 * row) / 720 for row in range(64)])
+    expected = np.zeros((2, 4))
+    for zone in range(2):
+        for code in range(4):
+            expected[zone, code] = (((expected_zones == zone + 1) & (data == code)) * row_areas[:, None]).sum()
+
+    areas = zonal_areas(raster, zone_file, 2, 4, block_size=16, max_workers=max_workers)
+
+    np.testing.assert_allclose(areas, expected, rtol=1e-9)
+
+    # the total of each zone is the area of its polygon
+    np.testing.assert_allclose(areas.sum(axis=1), [authalic_band_area(30, 50) * 10.5 / 360, authalic_band_area(22, 45) * 21 / 360], rtol=1e-9)
+
+def test_zonal_statistics_local(classes, zones, tmp_path):
+
+    raster, _, _ = classes
+    areas = zonal_statistics_local(raster, zones, tmp_path / 'zones.tif')
+
+    assert areas.shape == (2, 4)
+    np.testing.assert_allclose(areas.sum(axis=1), [authalic_band_area(30, 50) * 10.5 / 360 / 1e6, authalic_band_area(22, 45) * 21 / 360 / 1e6], rtol=1e-9)